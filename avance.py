@@ -0,0 +1,153 @@
+import io
+import json
+import zipfile
+from datetime import datetime
+
+import pandas as pd
+
+from nucleo_cfdi import aplicar_esquema, calcular_periodo, conceptos_a_df
+from complementos import ESQUEMAS_COMPLEMENTO
+
+# Formato binario del avance: un ZIP sin comprimir con un Parquet (zstd) por tabla,
+# un metadatos.json con la versión del esquema y los periodos de cada tabla y, si hay,
+# un ediciones.json con la bitácora de ediciones. Las tablas de conceptos y las tablas
+# laterales de complementos (pagos, nómina) van cada una en su propio Parquet, sin
+# ordenar por periodo.
+VERSION_AVANCE = 1
+EXTENSION_AVANCE = "avance"
+TABLAS_AVANCE = {"df_recibidos": "recibidos", "df_emitidos": "emitidos"}
+CONCEPTOS_AVANCE = {"df_recibidos": "conceptos_recibidos", "df_emitidos": "conceptos_emitidos"}
+_FILAS_POR_GRUPO = 65_536
+
+
+def guardar_avance_binario(tablas, ediciones=None, conceptos=None, complementos=None):
+    """
+    tablas: {"df_recibidos": df, "df_emitidos": df}; ediciones: entradas de la bitácora
+    de ediciones (se guardan en ediciones.json); conceptos: {"df_recibidos": df, ...}
+    con las tablas de conceptos; complementos: {"df_recibidos": {tabla_lateral: df},
+    ...}. Regresa los bytes del archivo.
+    """
+    metadatos = {
+        "version": VERSION_AVANCE,
+        "creado": datetime.now().isoformat(timespec="seconds"),
+        "tablas": {},
+        "conceptos": {},
+        "complementos": {},
+    }
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as zf:
+        for tabla, nombre in TABLAS_AVANCE.items():
+            df = tablas.get(tabla)
+            if df is None or df.empty:
+                continue
+            periodos = calcular_periodo(df["Fecha"])
+            # Ordenar por periodo (estable) permite saltar grupos de filas al cargar por periodo
+            orden = periodos.argsort(kind="stable")
+            df_archivo = df.assign(Periodo=periodos).iloc[orden]
+            parquet = io.BytesIO()
+            df_archivo.to_parquet(parquet, engine="pyarrow", compression="zstd",
+                                  index=False, row_group_size=_FILAS_POR_GRUPO)
+            zf.writestr(f"{nombre}.parquet", parquet.getvalue())
+            metadatos["tablas"][tabla] = {
+                "archivo": f"{nombre}.parquet",
+                "filas": len(df),
+                "periodos": sorted(periodos.unique().tolist()),
+            }
+        for tabla, nombre in CONCEPTOS_AVANCE.items():
+            df = (conceptos or {}).get(tabla)
+            if df is None or df.empty:
+                continue
+            parquet = io.BytesIO()
+            df.to_parquet(parquet, engine="pyarrow", compression="zstd",
+                          index=False, row_group_size=_FILAS_POR_GRUPO)
+            zf.writestr(f"{nombre}.parquet", parquet.getvalue())
+            metadatos["conceptos"][tabla] = {"archivo": f"{nombre}.parquet", "filas": len(df)}
+        for tabla, nombre in TABLAS_AVANCE.items():
+            for lateral, df in (complementos or {}).get(tabla, {}).items():
+                if df.empty:
+                    continue
+                archivo = f"{lateral}_{nombre}.parquet"
+                parquet = io.BytesIO()
+                df.to_parquet(parquet, engine="pyarrow", compression="zstd",
+                              index=False, row_group_size=_FILAS_POR_GRUPO)
+                zf.writestr(archivo, parquet.getvalue())
+                metadatos["complementos"].setdefault(tabla, {})[lateral] = {"archivo": archivo, "filas": len(df)}
+        if ediciones:
+            zf.writestr("ediciones.json", json.dumps(ediciones, ensure_ascii=False))
+        zf.writestr("metadatos.json", json.dumps(metadatos, ensure_ascii=False, indent=2))
+    return buffer.getvalue()
+
+
+def leer_metadatos_avance(archivo):
+    with zipfile.ZipFile(archivo) as zf:
+        metadatos = json.loads(zf.read("metadatos.json"))
+    if metadatos.get("version", 0) > VERSION_AVANCE:
+        raise ValueError(f"El archivo de avance es de una versión más reciente ({metadatos['version']}).")
+    return metadatos
+
+
+def cargar_avance_binario(archivo, periodos=None):
+    """
+    Regresa {"df_recibidos": df, "df_emitidos": df}. Con periodos sólo se leen las filas
+    de esos periodos ("AAAA-MM").
+    """
+    metadatos = leer_metadatos_avance(archivo)
+    filtros = [("Periodo", "in", list(periodos))] if periodos else None
+    tablas = {}
+    with zipfile.ZipFile(archivo) as zf:
+        for tabla in TABLAS_AVANCE:
+            info = metadatos["tablas"].get(tabla)
+            if info is None:
+                tablas[tabla] = pd.DataFrame()
+                continue
+            # Las entradas van sin comprimir: el Parquet se lee directo del ZIP, sin copiarlo
+            with zf.open(info["archivo"]) as parquet:
+                df = pd.read_parquet(parquet, engine="pyarrow", filters=filtros)
+            tablas[tabla] = aplicar_esquema(df.drop(columns="Periodo").reset_index(drop=True))
+    return tablas
+
+
+def leer_ediciones_avance(archivo):
+    """
+    Entradas de la bitácora de ediciones guardadas con el avance ([] si no trae).
+    """
+    with zipfile.ZipFile(archivo) as zf:
+        if "ediciones.json" not in zf.namelist():
+            return []
+        return json.loads(zf.read("ediciones.json"))
+
+
+def cargar_conceptos_avance(archivo):
+    """
+    Regresa {"df_recibidos": df, "df_emitidos": df} con las tablas de conceptos (vacías
+    si el avance no las trae). Al incorporarlas se quedan sólo las de los CFDIs cargados.
+    """
+    metadatos = leer_metadatos_avance(archivo)
+    conceptos = {}
+    with zipfile.ZipFile(archivo) as zf:
+        for tabla in CONCEPTOS_AVANCE:
+            info = metadatos.get("conceptos", {}).get(tabla)
+            if info is None:
+                conceptos[tabla] = conceptos_a_df([])
+                continue
+            with zf.open(info["archivo"]) as parquet:
+                conceptos[tabla] = pd.read_parquet(parquet, engine="pyarrow")
+    return conceptos
+
+
+def cargar_complementos_avance(archivo):
+    """
+    Regresa {"df_recibidos": {tabla_lateral: df}, "df_emitidos": {...}} con las tablas de
+    complementos que trae el avance; las que no reconoce esta versión se ignoran.
+    """
+    metadatos = leer_metadatos_avance(archivo)
+    complementos = {}
+    with zipfile.ZipFile(archivo) as zf:
+        for tabla in TABLAS_AVANCE:
+            complementos[tabla] = {}
+            for lateral, info in metadatos.get("complementos", {}).get(tabla, {}).items():
+                if lateral not in ESQUEMAS_COMPLEMENTO:
+                    continue
+                with zf.open(info["archivo"]) as parquet:
+                    complementos[tabla][lateral] = pd.read_parquet(parquet, engine="pyarrow")
+    return complementos
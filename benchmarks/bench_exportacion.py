@@ -0,0 +1,102 @@
+"""
+Memoria pico y tiempo de la exportación a Excel según el número de filas.
+
+    python benchmarks/bench_exportacion.py [--filas 10000 40000 160000]
+
+Compara el motor de exportador_excel (constant_memory, archivo temporal) contra la
+exportación anterior (to_excel a un BytesIO). Con el motor la memoria pico debe
+mantenerse plana al crecer las filas; con to_excel crece de forma lineal.
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nucleo_cfdi import aplicar_esquema, indice_periodos_desde_df  # noqa: E402
+from exportador_excel import ESTRATEGIAS_HOJAS, exportar_excel  # noqa: E402
+
+
+def df_sintetico(n, semilla=0):
+    rnd = np.random.default_rng(semilla)
+    subtotal = rnd.uniform(100, 50_000, n).round(2)
+    iva = (subtotal * 0.16).round(2)
+    fechas = pd.Timestamp("2024-01-01") + pd.to_timedelta(rnd.integers(0, 365 * 86400, n), unit="s")
+    df = pd.DataFrame({
+        "XML": [f"{i:08d}.xml" for i in range(n)],
+        "Rfc Emisor": rnd.choice([f"AAA0101{i:02d}AAA" for i in range(40)], n),
+        "Nombre Emisor": "PROVEEDOR DE PRUEBA SA DE CV",
+        "Rfc Receptor": "BBB010101BBB",
+        "Nombre Receptor": "EMPRESA DE PRUEBA SA DE CV",
+        "Tipo": "I",
+        "Serie": "A",
+        "Folio": [str(i) for i in range(n)],
+        "Fecha": fechas.strftime("%Y-%m-%dT%H:%M:%S"),
+        "Sub Total": subtotal,
+        "Descuento": 0.0,
+        "Total impuesto Trasladado": iva,
+        "Total impuesto Retenido": 0.0,
+        "Total": subtotal + iva,
+        "UUID": [f"{i:08x}-0000-4000-8000-000000000000" for i in range(n)],
+        "Moneda": "MXN",
+        "Tipo de Cambio": 1.0,
+        "Deducible": rnd.random(n) < 0.8,
+    })
+    return aplicar_esquema(df)
+
+
+def exportar_motor(df, indice_periodos, periodos, estrategia):
+    with tempfile.TemporaryDirectory() as directorio:
+        ruta = os.path.join(directorio, "bench.xlsx")
+        exportar_excel(df, indice_periodos, periodos, estrategia, ruta)
+        return os.path.getsize(ruta)
+
+
+def exportar_to_excel(df, indice_periodos, periodos):
+    # Exportación anterior: una hoja por periodo armada completa en memoria
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine="xlsxwriter", datetime_format='dd-mm-yyyy') as writer:
+        for p in periodos:
+            df.iloc[indice_periodos.filas(p)].assign(Periodo=p).to_excel(writer, sheet_name=p, index=False)
+    return output.getbuffer().nbytes
+
+
+def medir(funcion, *args):
+    tracemalloc.start()
+    inicio = time.perf_counter()
+    tamano = funcion(*args)
+    segundos = time.perf_counter() - inicio
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return segundos, pico, tamano
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--filas", type=int, nargs="+", default=[10_000, 40_000, 160_000])
+    parser.add_argument("--sin-anterior", action="store_true", help="no medir to_excel (es lento)")
+    args = parser.parse_args()
+
+    print(f"{'filas':>8} {'método':<22} {'seg':>7} {'pico MiB':>9} {'archivo MB':>10}")
+    for n in args.filas:
+        df = df_sintetico(n)
+        indice = indice_periodos_desde_df(df)
+        periodos = indice.periodos()
+        casos = [(f"motor ({nombre})", exportar_motor, (df, indice, periodos, estrategia))
+                 for nombre, estrategia in ESTRATEGIAS_HOJAS.items()]
+        if not args.sin_anterior:
+            casos.append(("to_excel (anterior)", exportar_to_excel, (df, indice, periodos)))
+        for nombre, funcion, argumentos in casos:
+            segundos, pico, tamano = medir(funcion, *argumentos)
+            print(f"{n:>8} {nombre:<22} {segundos:>7.2f} {pico / 2**20:>9.1f} {tamano / 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
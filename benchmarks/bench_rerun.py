@@ -0,0 +1,120 @@
+"""
+Latencia de un rerun de la sección Recibidos según los meses de historia.
+
+    python benchmarks/bench_rerun.py [--documentos 20000] [--repeticiones 5]
+
+Genera con generador_cfdi.py un ZIP por año (2023 y 2024, así hay 24 meses), los
+procesa con procesar_zip y arma la tabla con aplicar_esquema. Un rerun es lo que la
+página hace en cada interacción: la lista de periodos de la barra lateral, la
+selección del periodo, los conteos Deducibles / No Deducibles, las dos vistas por
+bandera y sus sumatorias. Se mide con 12 y con 24 meses de historia:
+
+- "índices": IndicePeriodos y AgregadosPorBandera, como las secciones ahora.
+- "anterior": copiar la tabla, derivar Periodo y filtrar con máscaras booleanas en
+  cada rerun, como antes del índice de periodos.
+
+Con los índices el rerun cuesta lo que mide el periodo seleccionado, no la historia.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from nucleo_cfdi import (  # noqa: E402
+    agregados_desde_df, aplicar_esquema, calcular_periodo, columnas_resumen, indice_periodos_desde_df,
+    procesar_zip
+)
+from generador_cfdi import generar_zip  # noqa: E402
+
+BANDERA = "Deducible"
+
+
+def cronometrar(funcion, repeticiones):
+    # Mejor tiempo de las repeticiones y el resultado de la última
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion()
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor, resultado
+
+
+def armar_tabla(documentos, semilla, directorio):
+    # 24 meses: un ZIP por año, con fechas al azar dentro de cada año
+    partes = []
+    for anio in (2023, 2024):
+        ruta = os.path.join(directorio, f"cfdi_{anio}.zip")
+        generar_zip(ruta, documentos, semilla, anio=anio)
+        partes.append(aplicar_esquema(pd.DataFrame(procesar_zip(ruta)["filas"])))
+        os.remove(ruta)
+    df = pd.concat(partes, ignore_index=True)
+    df[BANDERA] = np.random.default_rng(semilla).random(len(df)) < 0.8
+    return df
+
+
+def rerun_indices(df, indice_periodos, agregados):
+    periodos = indice_periodos.periodos()
+    periodo = periodos[-1]
+    posiciones = indice_periodos.filas(periodo)
+    conteos = (len(posiciones), agregados.conteo(periodo, True), agregados.conteo(periodo, False))
+    banderas = df[BANDERA].to_numpy()
+    vistas = []
+    for bandera in (True, False):
+        vista = df.take(posiciones[banderas[posiciones] == bandera])
+        vista["Periodo"] = periodo
+        vistas.append((vista, agregados.sumas_de(periodo, bandera)))
+    return conteos, vistas
+
+
+def rerun_anterior(df, columnas):
+    copia = df.copy()
+    copia["Periodo"] = calcular_periodo(copia["Fecha"])
+    periodos = sorted(copia["Periodo"].dropna().unique().tolist())
+    periodo = periodos[-1]
+    filtrado = copia[copia["Periodo"] == periodo]
+    conteos = (len(filtrado), len(filtrado[filtrado[BANDERA] == True]),  # noqa: E712
+               len(filtrado[filtrado[BANDERA] == False]))  # noqa: E712
+    vistas = []
+    for bandera in (True, False):
+        vista = filtrado[filtrado[BANDERA] == bandera]
+        vistas.append((vista, vista.reindex(columns=columnas).sum().to_dict()))
+    return conteos, vistas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--documentos", type=int, default=20_000, help="documentos por año")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--repeticiones", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench_rerun_") as directorio:
+        completa = armar_tabla(args.documentos, args.semilla, directorio)
+
+    print(f"{'meses':>6} {'filas':>9} {'filas periodo':>14} {'índices ms':>11} {'anterior ms':>12} {'razón':>7}")
+    for meses in (12, 24):
+        df = completa.iloc[len(completa) - len(completa) * meses // 24:] if meses < 24 else completa
+        df = df.reset_index(drop=True)
+        # Se construyen una vez, al ingerir; el rerun sólo los consulta
+        indice_periodos = indice_periodos_desde_df(df)
+        agregados = agregados_desde_df(df, "df_recibidos")
+        columnas = columnas_resumen(df)
+
+        s_indices, (conteos, _) = cronometrar(lambda: rerun_indices(df, indice_periodos, agregados),
+                                              args.repeticiones)
+        s_anterior, (conteos_anterior, _) = cronometrar(lambda: rerun_anterior(df, columnas), args.repeticiones)
+        assert conteos == conteos_anterior, (conteos, conteos_anterior)
+        print(f"{meses:>6} {len(df):>9} {conteos[0]:>14} {s_indices * 1000:>11.1f} "
+              f"{s_anterior * 1000:>12.1f} {s_anterior / s_indices:>7.1f}", flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,197 @@
+"""
+Suite de rendimiento de punta a punta sobre ZIPs sintéticos (ver generador_cfdi.py).
+
+    python benchmarks/bench_suite.py --documentos 1000 10000 100000 --salida base.json
+    python benchmarks/bench_suite.py --documentos 1000 10000 100000 --comparar base.json
+
+Mide las etapas de las que depende la aplicación: procesar_zip, armar la tabla
+(aplicar_esquema), filtrar_duplicados_por_uuid contra una tabla existente, derivar el
+Periodo e indexar y filtrar por periodo, mostrar_sumatorias y las exportaciones a Excel
+por periodo y por deducible. De cada etapa se toma el mejor tiempo de --repeticiones.
+
+El resultado se guarda en JSON (metadatos de la corrida y una entrada por etapa y
+tamaño). Con --comparar se imprime la razón contra otra corrida y el código de salida
+es 1 si alguna etapa es más lenta que el umbral.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from nucleo_cfdi import (  # noqa: E402
+    VERSION_EXTRACTOR, aplicar_esquema, calcular_periodo, filtrar_duplicados_por_uuid,
+    indice_periodos_desde_df, procesar_zip
+)
+from indices import IndiceUUID  # noqa: E402
+from exportador_excel import ESTRATEGIAS_HOJAS, exportar_excel  # noqa: E402
+from funciones_utiles import mostrar_sumatorias  # noqa: E402
+from generador_cfdi import MEZCLAS_IMPUESTOS, generar_zip  # noqa: E402
+
+UMBRAL_REGRESION = 0.20
+# Diferencias menores no cuentan como regresión: son ruido de medición
+MIN_DIFERENCIA_SEGUNDOS = 0.01
+
+
+def cronometrar(funcion, repeticiones):
+    # Mejor tiempo de las repeticiones y el resultado de la última
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion()
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor, resultado
+
+
+def _pico_rss_mib():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def medir_tamano(n, args, directorio):
+    """
+    Regresa [(etapa, segundos, elementos), ...] para un ZIP de n documentos.
+    """
+    ruta = os.path.join(directorio, f"cfdi_{n}.zip")
+    generar_zip(ruta, n, args.semilla, tuple(args.conceptos), args.mezcla, args.duplicados, razon_33=args.cfdi33)
+    rep = args.repeticiones
+    etapas = []
+
+    segundos, resultado = cronometrar(lambda: procesar_zip(ruta), rep)
+    etapas.append(("procesar_zip", segundos, n))
+    if args.procesos > 1:
+        segundos, _ = cronometrar(lambda: procesar_zip(ruta, args.procesos), rep)
+        etapas.append((f"procesar_zip ({args.procesos} procesos)", segundos, n))
+
+    filas = resultado["filas"]
+    segundos, df = cronometrar(lambda: aplicar_esquema(pd.DataFrame(filas)), rep)
+    etapas.append(("aplicar_esquema", segundos, n))
+    df["Deducible"] = np.random.default_rng(args.semilla).random(len(df)) < 0.8
+
+    # Como al cargar un segundo ZIP: la mitad ya está en la tabla, la otra mitad llega nueva
+    mitad = len(df) // 2
+    existente, nuevo = df.iloc[:mitad], df.iloc[mitad:]
+    indice = IndiceUUID.desde_df(existente)
+    segundos, _ = cronometrar(lambda: filtrar_duplicados_por_uuid(nuevo, existente, "UUID", indice), rep)
+    etapas.append(("filtrar_duplicados_por_uuid", segundos, len(nuevo)))
+
+    segundos, _ = cronometrar(lambda: calcular_periodo(df["Fecha"]), rep)
+    etapas.append(("calcular_periodo", segundos, n))
+    segundos, indice_periodos = cronometrar(lambda: indice_periodos_desde_df(df), rep)
+    etapas.append(("indice_periodos", segundos, n))
+    periodos = indice_periodos.periodos()
+    segundos, vistas = cronometrar(
+        lambda: [df.iloc[indice_periodos.filas(p)].assign(Periodo=p) for p in periodos], rep)
+    etapas.append(("filtrar_por_periodo", segundos, n))
+
+    segundos, _ = cronometrar(lambda: [mostrar_sumatorias(v) for v in vistas], rep)
+    etapas.append(("mostrar_sumatorias", segundos, n))
+
+    if not args.sin_exportar:
+        destino = os.path.join(directorio, "exportacion.xlsx")
+        for nombre in ("Periodos", "Deducibles"):
+            estrategia = ESTRATEGIAS_HOJAS[nombre]
+            segundos, _ = cronometrar(
+                lambda: exportar_excel(df, indice_periodos, periodos, estrategia, destino), rep)
+            etapas.append((f"exportar_excel ({nombre})", segundos, n))
+    os.remove(ruta)
+    return etapas
+
+
+def comparar(resultados, ruta_base, umbral):
+    with open(ruta_base, encoding="utf-8") as f:
+        base = {(r["etapa"], r["documentos"]): r for r in json.load(f)["resultados"]}
+    regresiones = 0
+    print(f"\n{'etapa':<36} {'docs':>8} {'base s':>9} {'actual s':>9} {'razón':>7}")
+    for r in resultados:
+        anterior = base.get((r["etapa"], r["documentos"]))
+        if anterior is None or not anterior["segundos"]:
+            continue
+        razon = r["segundos"] / anterior["segundos"]
+        marca = ""
+        if razon > 1 + umbral and r["segundos"] - anterior["segundos"] > MIN_DIFERENCIA_SEGUNDOS:
+            regresiones += 1
+            marca = "  <- regresión"
+        print(f"{r['etapa']:<36} {r['documentos']:>8} {anterior['segundos']:>9.3f} "
+              f"{r['segundos']:>9.3f} {razon:>7.2f}{marca}")
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--documentos", type=int, nargs="+", default=[1_000, 10_000])
+    parser.add_argument("--conceptos", type=int, nargs=2, default=[1, 5], metavar=("MIN", "MAX"))
+    parser.add_argument("--mezcla", choices=list(MEZCLAS_IMPUESTOS), default="mixta")
+    parser.add_argument("--duplicados", type=float, default=0.05)
+    parser.add_argument("--cfdi33", type=float, default=0.0, help="fracción de documentos CFDI 3.3")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--procesos", type=int, default=1, help="además mide procesar_zip con N procesos")
+    parser.add_argument("--repeticiones", type=int, default=1)
+    parser.add_argument("--sin-exportar", action="store_true", help="no medir las exportaciones (lentas)")
+    parser.add_argument("--salida", default="bench_resultados.json")
+    parser.add_argument("--comparar", metavar="JSON", help="resultado anterior contra el cual comparar")
+    parser.add_argument("--umbral", type=float, default=UMBRAL_REGRESION,
+                        help="fracción de tiempo extra que cuenta como regresión")
+    args = parser.parse_args()
+
+    resultados = []
+    print(f"{'etapa':<36} {'docs':>8} {'seg':>9} {'por seg':>12}")
+    with tempfile.TemporaryDirectory(prefix="bench_cfdi_") as directorio:
+        for n in args.documentos:
+            for etapa, segundos, elementos in medir_tamano(n, args, directorio):
+                por_segundo = elementos / segundos if segundos else None
+                resultados.append({"etapa": etapa, "documentos": n, "segundos": round(segundos, 6),
+                                   "elementos": elementos,
+                                   "por_segundo": round(por_segundo, 1) if por_segundo else None})
+                print(f"{etapa:<36} {n:>8} {segundos:>9.3f} {por_segundo or 0:>12,.0f}", flush=True)
+
+    salida = {
+        "metadatos": {
+            "fecha": datetime.now().isoformat(timespec="seconds"),
+            "commit": _commit(),
+            "version_extractor": VERSION_EXTRACTOR,
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "plataforma": platform.platform(),
+            "cpus": os.cpu_count(),
+            "pico_rss_mib": _pico_rss_mib(),
+            "parametros": {
+                "conceptos": args.conceptos, "mezcla": args.mezcla, "duplicados": args.duplicados,
+                "cfdi33": args.cfdi33,
+                "semilla": args.semilla, "procesos": args.procesos, "repeticiones": args.repeticiones,
+            },
+        },
+        "resultados": resultados,
+    }
+    with open(args.salida, "w", encoding="utf-8") as f:
+        json.dump(salida, f, ensure_ascii=False, indent=2)
+    print(f"\nResultados en {args.salida}")
+
+    if args.comparar:
+        return 1 if comparar(resultados, args.comparar, args.umbral) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+"""
+Generador de ZIPs con CFDIs 4.0 sintéticos para pruebas de rendimiento.
+
+    python benchmarks/generador_cfdi.py salida.zip --documentos 100000 --conceptos 1 8 \
+        --mezcla mixta --duplicados 0.05
+
+Cada documento se genera a partir de (semilla, número de documento), así que el mismo
+comando produce el mismo ZIP y un duplicado es una copia exacta (mismo UUID) de un
+documento anterior, sin tener que guardar los documentos en memoria. Con --cfdi33 una
+fracción de los documentos sale como CFDI 3.3 (otro namespace, sin los atributos que
+agregó 4.0).
+"""
+import argparse
+import random
+import uuid
+import zipfile
+
+NS_CFDI = "http://www.sat.gob.mx/cfd/4"
+NS_CFDI_33 = "http://www.sat.gob.mx/cfd/3"
+NS_TFD = "http://www.sat.gob.mx/TimbreFiscalDigital"
+
+# Esquemas de impuesto por concepto: (Impuesto, TipoFactor, TasaOCuota)
+ESQUEMAS_TRASLADO = {
+    "IVA 16%": ("002", "Tasa", "0.160000"),
+    "IVA 8%": ("002", "Tasa", "0.080000"),
+    "IVA 0%": ("002", "Tasa", "0.000000"),
+    "IVA Exento": ("002", "Exento", None),
+    "IEPS 26.5%": ("003", "Tasa", "0.265000"),
+    "IEPS Cuota": ("003", "Cuota", "1.500000"),
+}
+# Probabilidad de cada esquema de traslado y de cada retención por concepto
+MEZCLAS_IMPUESTOS = {
+    "iva16": {"traslados": {"IVA 16%": 1.0}, "retenciones": {}},
+    "mixta": {
+        "traslados": {"IVA 16%": 0.6, "IVA 8%": 0.1, "IVA 0%": 0.1, "IVA Exento": 0.1,
+                      "IEPS 26.5%": 0.05, "IEPS Cuota": 0.05},
+        "retenciones": {"001": 0.2, "002": 0.1},
+    },
+}
+TASAS_RETENCION = {"001": 0.10, "002": 0.106667}
+RFC_EMPRESA = "BBB010101BBB"
+
+
+def _elegir(rnd, probabilidades):
+    return rnd.choices(list(probabilidades), weights=list(probabilidades.values()))[0]
+
+
+def _concepto(rnd, mezcla, traslados, retenciones, objeto_imp):
+    cantidad = rnd.randint(1, 20)
+    unitario = round(rnd.uniform(5, 5_000), 2)
+    importe = round(cantidad * unitario, 2)
+    impuesto, factor, tasa = ESQUEMAS_TRASLADO[_elegir(rnd, mezcla["traslados"])]
+    if factor == "Exento":
+        base, monto = importe, 0.0
+        traslado = f'<cfdi:Traslado Base="{base:.2f}" Impuesto="{impuesto}" TipoFactor="Exento"/>'
+    else:
+        # La cuota se aplica por unidad; la tasa, sobre el importe
+        base = float(cantidad) if factor == "Cuota" else importe
+        monto = round(base * float(tasa), 2)
+        traslado = (f'<cfdi:Traslado Base="{base:.2f}" Impuesto="{impuesto}" TipoFactor="{factor}" '
+                    f'TasaOCuota="{tasa}" Importe="{monto:.2f}"/>')
+    base_acumulada, monto_acumulado = traslados.get((impuesto, factor, tasa), (0.0, 0.0))
+    traslados[(impuesto, factor, tasa)] = (base_acumulada + base, monto_acumulado + monto)
+    nodos_retencion = []
+    for impuesto_ret, probabilidad in mezcla["retenciones"].items():
+        if rnd.random() < probabilidad:
+            monto = round(importe * TASAS_RETENCION[impuesto_ret], 2)
+            retenciones[impuesto_ret] = retenciones.get(impuesto_ret, 0.0) + monto
+            nodos_retencion.append(
+                f'<cfdi:Retencion Base="{importe:.2f}" Impuesto="{impuesto_ret}" TipoFactor="Tasa" '
+                f'TasaOCuota="{TASAS_RETENCION[impuesto_ret]:.6f}" Importe="{monto:.2f}"/>')
+    impuestos = f"<cfdi:Traslados>{traslado}</cfdi:Traslados>"
+    if nodos_retencion:
+        impuestos += f"<cfdi:Retenciones>{''.join(nodos_retencion)}</cfdi:Retenciones>"
+    return importe, (
+        f'<cfdi:Concepto ClaveProdServ="{rnd.randint(10_000_000, 99_999_999)}" Cantidad="{cantidad}" '
+        f'ClaveUnidad="H87" Unidad="Pieza" Descripcion="Producto {rnd.randint(1, 5_000)} &amp; servicio" '
+        f'ValorUnitario="{unitario:.2f}" Importe="{importe:.2f}"{objeto_imp}>'
+        f'<cfdi:Impuestos>{impuestos}</cfdi:Impuestos></cfdi:Concepto>'
+    )
+
+
+def generar_cfdi(numero, semilla=0, conceptos=(1, 5), mezcla="mixta", rfc_empresa=RFC_EMPRESA,
+                 razon_emitidos=0.0, anio=2024, razon_33=0.0):
+    """
+    Regresa los bytes del CFDI número `numero`. El mismo (semilla, numero) produce
+    siempre el mismo documento.
+    """
+    rnd = random.Random(semilla * 1_000_003 + numero)
+    # La versión se sortea aparte para que los documentos 4.0 no cambien con razon_33
+    es_33 = razon_33 > 0 and random.Random(f"3.3-{semilla}-{numero}").random() < razon_33
+    mezcla = MEZCLAS_IMPUESTOS[mezcla]
+    traslados, retenciones = {}, {}
+    subtotal, nodos = 0.0, []
+    for _ in range(rnd.randint(*conceptos)):
+        importe, nodo = _concepto(rnd, mezcla, traslados, retenciones, "" if es_33 else ' ObjetoImp="02"')
+        subtotal += importe
+        nodos.append(nodo)
+    total_trasladado = sum(monto for _, monto in traslados.values())
+    total_retenido = sum(retenciones.values())
+    total = subtotal + total_trasladado - total_retenido
+
+    nodos_traslado = []
+    for (impuesto, factor, tasa), (base, monto) in traslados.items():
+        if factor == "Exento":
+            nodos_traslado.append(f'<cfdi:Traslado Base="{base:.2f}" Impuesto="{impuesto}" TipoFactor="Exento"/>')
+        else:
+            nodos_traslado.append(f'<cfdi:Traslado Base="{base:.2f}" Impuesto="{impuesto}" TipoFactor="{factor}" '
+                                  f'TasaOCuota="{tasa}" Importe="{monto:.2f}"/>')
+    impuestos = ""
+    if retenciones:
+        impuestos += "<cfdi:Retenciones>" + "".join(
+            f'<cfdi:Retencion Impuesto="{imp}" Importe="{monto:.2f}"/>' for imp, monto in retenciones.items()
+        ) + "</cfdi:Retenciones>"
+    impuestos += f"<cfdi:Traslados>{''.join(nodos_traslado)}</cfdi:Traslados>"
+    atributos_impuestos = f' TotalImpuestosTrasladados="{total_trasladado:.2f}"'
+    if retenciones:
+        atributos_impuestos += f' TotalImpuestosRetenidos="{total_retenido:.2f}"'
+
+    tercero = f"AAA0101{rnd.randint(0, 99):02d}AAA"
+    if rnd.random() < razon_emitidos:
+        emisor, receptor = rfc_empresa, tercero
+    else:
+        emisor, receptor = tercero, rfc_empresa
+    fecha = f"{anio}-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}T{rnd.randint(0, 23):02d}:{rnd.randint(0, 59):02d}:00"
+    if es_33:
+        ns, version, exportacion, receptor_40 = NS_CFDI_33, "3.3", "", ""
+    else:
+        ns, version, exportacion = NS_CFDI, "4.0", ' Exportacion="01"'
+        receptor_40 = ' DomicilioFiscalReceptor="01000" RegimenFiscalReceptor="601"'
+    return (
+        f'<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<cfdi:Comprobante xmlns:cfdi="{ns}" xmlns:tfd="{NS_TFD}" Version="{version}" Serie="A" '
+        f'Folio="{numero}" Fecha="{fecha}" FormaPago="{rnd.choice(["01", "03", "04", "28", "99"])}" '
+        f'SubTotal="{subtotal:.2f}" Moneda="MXN" Total="{total:.2f}" TipoDeComprobante="I"'
+        f'{exportacion} MetodoPago="{rnd.choice(["PUE", "PPD"])}" LugarExpedicion="01000">'
+        f'<cfdi:Emisor Rfc="{emisor}" Nombre="EMPRESA {emisor}" RegimenFiscal="601"/>'
+        f'<cfdi:Receptor Rfc="{receptor}" Nombre="EMPRESA {receptor}"{receptor_40} '
+        f'UsoCFDI="{rnd.choice(["G01", "G03", "I04"])}"/>'
+        f'<cfdi:Conceptos>{"".join(nodos)}</cfdi:Conceptos>'
+        f'<cfdi:Impuestos{atributos_impuestos}>{impuestos}</cfdi:Impuestos>'
+        f'<cfdi:Complemento><tfd:TimbreFiscalDigital Version="1.1" '
+        f'UUID="{uuid.UUID(int=rnd.getrandbits(128), version=4)}" '
+        f'FechaTimbrado="{fecha}" RfcProvCertif="SAT970701NN3"/></cfdi:Complemento>'
+        f'</cfdi:Comprobante>'
+    ).encode("utf-8")
+
+
+def generar_zip(destino, documentos, semilla=0, conceptos=(1, 5), mezcla="mixta", razon_duplicados=0.0,
+                rfc_empresa=RFC_EMPRESA, razon_emitidos=0.0, anio=2024, razon_33=0.0):
+    """
+    Escribe en destino un ZIP con `documentos` XMLs; una fracción razon_duplicados son
+    copias de documentos anteriores (mismo UUID, otro nombre de archivo). Los documentos
+    se escriben uno a la vez. Regresa el número de documentos distintos.
+    """
+    rnd = random.Random(semilla)
+    distintos = 0
+    with zipfile.ZipFile(destino, "w") as zf:
+        for i in range(documentos):
+            if distintos and rnd.random() < razon_duplicados:
+                numero = rnd.randrange(distintos)
+            else:
+                numero = distintos
+                distintos += 1
+            # Fecha fija en el ZIP para que el archivo sea idéntico entre corridas
+            info = zipfile.ZipInfo(f"{i:08d}.xml", date_time=(anio, 1, 1, 0, 0, 0))
+            info.compress_type = zipfile.ZIP_DEFLATED
+            zf.writestr(info, generar_cfdi(numero, semilla, conceptos, mezcla, rfc_empresa, razon_emitidos, anio,
+                                           razon_33),
+                        compresslevel=1)
+    return distintos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("destino")
+    parser.add_argument("--documentos", type=int, default=1_000)
+    parser.add_argument("--conceptos", type=int, nargs=2, default=[1, 5], metavar=("MIN", "MAX"))
+    parser.add_argument("--mezcla", choices=list(MEZCLAS_IMPUESTOS), default="mixta")
+    parser.add_argument("--duplicados", type=float, default=0.0, help="fracción de documentos repetidos")
+    parser.add_argument("--emitidos", type=float, default=0.0, help="fracción emitidos por la empresa")
+    parser.add_argument("--rfc", default=RFC_EMPRESA, help="RFC de la empresa")
+    parser.add_argument("--cfdi33", type=float, default=0.0, help="fracción de documentos CFDI 3.3")
+    parser.add_argument("--semilla", type=int, default=0)
+    args = parser.parse_args()
+    distintos = generar_zip(args.destino, args.documentos, args.semilla, tuple(args.conceptos), args.mezcla,
+                            args.duplicados, args.rfc, args.emitidos, razon_33=args.cfdi33)
+    print(f"{args.destino}: {args.documentos} documentos ({distintos} distintos)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+# Caché persistente de filas extraídas, direccionada por el contenido de cada XML.
+# Se guarda en SQLite para poder compartirla entre sesiones y procesos.
+RUTA_CACHE_DEFAULT = os.path.join(os.path.expanduser("~"), ".cache", "contabiliza2", "cfdi.sqlite3")
+MAX_ENTRADAS_DEFAULT = 200_000
+_LOTE_SQL = 500
+
+_rutas_inicializadas = set()
+
+
+def clave_contenido(contenido):
+    return hashlib.blake2b(contenido, digest_size=16).hexdigest()
+
+
+class CacheCFDI:
+    """
+    Caché LRU en disco: clave (hash del XML) -> fila extraída.
+
+    Las entradas guardadas con otra versión del extractor se descartan al abrir la
+    caché, y al recortar se eliminan las de acceso más antiguo hasta quedar en
+    max_entradas. La caché es opcional: si la base no se puede leer o escribir (se
+    borró, está bloqueada) una consulta cuenta como fallo y un guardado se omite.
+    """
+    def __init__(self, ruta, version, max_entradas=MAX_ENTRADAS_DEFAULT):
+        self.ruta = ruta
+        self.version = version
+        self.max_entradas = max_entradas
+        if ruta not in _rutas_inicializadas:
+            self._inicializar()
+            _rutas_inicializadas.add(ruta)
+
+    def _conectar(self):
+        # El esquema se asegura en cada conexión: si el archivo se borró o rotó con la
+        # aplicación corriendo, connect crea uno vacío
+        con = sqlite3.connect(self.ruta, timeout=30)
+        con.execute(
+            "CREATE TABLE IF NOT EXISTS filas ("
+            "clave TEXT PRIMARY KEY, version INTEGER NOT NULL, "
+            "fila TEXT NOT NULL, acceso REAL NOT NULL)"
+        )
+        con.execute("CREATE INDEX IF NOT EXISTS filas_acceso ON filas (acceso)")
+        return con
+
+    def _inicializar(self):
+        directorio = os.path.dirname(self.ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        with self._conectar() as con:
+            con.execute("DELETE FROM filas WHERE version != ?", (self.version,))
+
+    def obtener(self, claves):
+        """
+        Regresa {clave: fila} para las claves encontradas y marca su acceso.
+        """
+        encontradas = {}
+        if not claves:
+            return encontradas
+        try:
+            with self._conectar() as con:
+                for i in range(0, len(claves), _LOTE_SQL):
+                    parte = claves[i:i + _LOTE_SQL]
+                    marcas = ",".join("?" * len(parte))
+                    cursor = con.execute(
+                        f"SELECT clave, fila FROM filas WHERE version = ? AND clave IN ({marcas})",
+                        (self.version, *parte),
+                    )
+                    for clave, fila in cursor:
+                        encontradas[clave] = json.loads(fila)
+                if encontradas:
+                    ahora = time.time()
+                    con.executemany("UPDATE filas SET acceso = ? WHERE clave = ?",
+                                    [(ahora, clave) for clave in encontradas])
+        except sqlite3.Error:
+            return {}
+        return encontradas
+
+    def guardar(self, entradas):
+        """
+        entradas: [(clave, fila), ...]
+        """
+        if not entradas:
+            return
+        ahora = time.time()
+        try:
+            with self._conectar() as con:
+                con.executemany(
+                    "INSERT OR REPLACE INTO filas (clave, version, fila, acceso) VALUES (?, ?, ?, ?)",
+                    [(clave, self.version, json.dumps(fila, ensure_ascii=False), ahora)
+                     for clave, fila in entradas],
+                )
+        except sqlite3.Error:
+            pass
+
+    def recortar(self):
+        """
+        Elimina las entradas menos usadas recientemente que excedan max_entradas.
+        """
+        try:
+            with self._conectar() as con:
+                total = con.execute("SELECT COUNT(*) FROM filas").fetchone()[0]
+                exceso = total - self.max_entradas
+                if exceso > 0:
+                    con.execute(
+                        "DELETE FROM filas WHERE clave IN "
+                        "(SELECT clave FROM filas ORDER BY acceso LIMIT ?)",
+                        (exceso,),
+                    )
+        except sqlite3.Error:
+            return 0
+        return max(exceso, 0)
+
+
+def cache_desde_entorno(version):
+    """
+    Construye la caché con CONTABILIZA2_CACHE (ruta; vacío la desactiva) y
+    CONTABILIZA2_CACHE_MAX (número máximo de entradas).
+    """
+    ruta = os.environ.get("CONTABILIZA2_CACHE", RUTA_CACHE_DEFAULT)
+    if not ruta:
+        return None
+    max_entradas = int(os.environ.get("CONTABILIZA2_CACHE_MAX", MAX_ENTRADAS_DEFAULT))
+    return CacheCFDI(ruta, version, max_entradas)
@@ -0,0 +1,255 @@
+"""
+Procesamiento por lotes de ZIPs de CFDIs sin Streamlit.
+
+    python cli.py --rfc AAA010101AAA clientes/ "otros/*.zip" --salida resultados/
+    python cli.py --rfc AAA010101AAA clientes/ --formato avance --procesos 8
+
+Usa la misma extracción, caché y deduplicación que la aplicación. Cada CFDI se
+reparte por RFC: si la empresa es el emisor va a Emitidos y si es el receptor a
+Recibidos; los demás se cuentan como ajenos y se descartan. Los ZIPs se procesan en
+paralelo (uno por proceso); con un solo ZIP el paralelismo es por lotes de XMLs. Los
+complementos de pago y de nómina se escriben como tablas aparte, ligadas por UUID (en
+xlsx, un libro de complementos por tabla).
+
+Códigos de salida:
+    0  todo se procesó
+    1  se escribió la salida, pero hubo ZIPs o XMLs que no se pudieron leer
+    2  argumentos inválidos
+    3  no se encontraron ZIPs o ningún CFDI es de la empresa
+    4  no se pudo escribir la salida
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from xlsxwriter.exceptions import FileCreateError
+
+from nucleo_cfdi import (
+    COLUMNA_BANDERA, NUM_PROCESOS_DEFAULT, aplicar_esquema, calcular_periodo, clasificar_por_rfc, complementos_de,
+    conceptos_a_df, conceptos_de, describir_error, eliminar_duplicados_en_df, indice_periodos_desde_df,
+    obtener_cache, procesar_zip
+)
+from complementos import complementos_a_df
+from indices import IndiceUUID
+from exportador_excel import ESTRATEGIAS_HOJAS, exportar_excel, hojas_por_periodo
+from avance import EXTENSION_AVANCE, guardar_avance_binario
+
+SALIDA_OK = 0
+SALIDA_PARCIAL = 1
+SALIDA_USO = 2
+SALIDA_SIN_DATOS = 3
+SALIDA_ERROR_ESCRITURA = 4
+
+NOMBRES_TABLA = {"df_recibidos": "recibidos", "df_emitidos": "emitidos"}
+
+
+def buscar_zips(entradas):
+    """
+    entradas: directorios (se buscan ZIPs en todos los subdirectorios), archivos o
+    patrones glob. Regresa las rutas sin repetir, en el orden en que se encontraron.
+    """
+    rutas = []
+    for entrada in entradas:
+        if os.path.isdir(entrada):
+            encontradas = sorted(glob.glob(os.path.join(entrada, "**", "*.zip"), recursive=True)
+                                 + glob.glob(os.path.join(entrada, "**", "*.ZIP"), recursive=True))
+        else:
+            encontradas = sorted(glob.glob(entrada, recursive=True))
+        rutas.extend(r for r in encontradas if os.path.isfile(r))
+    return list(dict.fromkeys(os.path.abspath(r) for r in rutas))
+
+
+def _procesar_archivo(ruta, num_procesos=1, usar_cache=True):
+    # Se ejecuta en un proceso del pool
+    return procesar_zip(ruta, num_procesos, cache=obtener_cache() if usar_cache else None)
+
+
+def extraer_zips(rutas, procesos, usar_cache=True):
+    """
+    Regresa [(ruta, resultado), ...] en el orden de rutas, para que la
+    deduplicación (se conserva el primero) no dependa de qué proceso terminó antes.
+    """
+    if len(rutas) == 1 or procesos == 1:
+        return [(ruta, _procesar_archivo(ruta, procesos if len(rutas) == 1 else 1, usar_cache))
+                for ruta in rutas]
+    with ProcessPoolExecutor(max_workers=min(procesos, len(rutas))) as pool:
+        resultados = pool.map(_procesar_archivo, rutas, [1] * len(rutas), [usar_cache] * len(rutas))
+        return list(zip(rutas, resultados))
+
+
+def deduplicar(df):
+    # Igual que en la aplicación: se conserva la primera aparición de cada UUID
+    df, eliminados = eliminar_duplicados_en_df(df, "UUID", IndiceUUID.desde_df(df))
+    return df.reset_index(drop=True), eliminados
+
+
+def escribir_excel(tablas, rfc, periodos, nombre_estrategia, salida):
+    rutas = []
+    sufijo = nombre_estrategia.lower().replace(" ", "_")
+    for tabla, df in tablas.items():
+        if df.empty:
+            continue
+        estrategia = ESTRATEGIAS_HOJAS[nombre_estrategia]
+        if COLUMNA_BANDERA[tabla] != "Deducible" and estrategia is ESTRATEGIAS_HOJAS["Deducibles"]:
+            # Emitidos no tiene columna Deducible
+            estrategia = hojas_por_periodo
+        indice = indice_periodos_desde_df(df)
+        seleccion = [p for p in indice.periodos() if not periodos or p in periodos]
+        ruta = os.path.join(salida, f"{rfc}_{NOMBRES_TABLA[tabla]}_por_{sufijo}.xlsx")
+        exportar_excel(df, indice, seleccion, estrategia, ruta)
+        rutas.append(ruta)
+    return rutas
+
+
+def filtrar_periodos(tablas, periodos):
+    if not periodos:
+        return tablas
+    return {tabla: df[calcular_periodo(df["Fecha"]).isin(periodos).to_numpy()] for tabla, df in tablas.items()}
+
+
+def escribir_complementos(tablas, complementos, rfc, periodos, salida):
+    # Un libro por tabla con una hoja por tabla lateral (pagos, nómina, ...)
+    rutas = []
+    tablas = filtrar_periodos(tablas, periodos)
+    for tabla, df in tablas.items():
+        laterales = complementos_de(complementos[tabla], df)
+        if not laterales:
+            continue
+        ruta = os.path.join(salida, f"{rfc}_{NOMBRES_TABLA[tabla]}_complementos.xlsx")
+        with pd.ExcelWriter(ruta, engine="xlsxwriter") as writer:
+            for lateral, filas in laterales.items():
+                filas.to_excel(writer, sheet_name=lateral, index=False)
+        rutas.append(ruta)
+    return rutas
+
+
+def escribir_avance(tablas, conceptos, complementos, rfc, periodos, salida):
+    if periodos:
+        tablas = filtrar_periodos(tablas, periodos)
+        conceptos = {tabla: conceptos_de(conceptos[tabla], tablas[tabla]) for tabla in tablas}
+        complementos = {tabla: complementos_de(complementos[tabla], tablas[tabla]) for tabla in tablas}
+    ruta = os.path.join(salida, f"{rfc}.{EXTENSION_AVANCE}")
+    with open(ruta, "wb") as f:
+        f.write(guardar_avance_binario(tablas, conceptos=conceptos, complementos=complementos))
+    return [ruta]
+
+
+def imprimir_resumen(tiempos, conteos, salida=sys.stderr):
+    print("\nEtapa                 seg", file=salida)
+    for etapa, segundos in tiempos.items():
+        print(f"{etapa:<18} {segundos:>7.2f}", file=salida)
+    print(f"{'total':<18} {sum(tiempos.values()):>7.2f}\n", file=salida)
+    for nombre, n in conteos.items():
+        print(f"{nombre:<24} {n:>8}", file=salida)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("entradas", nargs="+", help="directorios, ZIPs o patrones glob")
+    parser.add_argument("--rfc", required=True, help="RFC de la empresa")
+    parser.add_argument("--salida", default=".", help="directorio donde se escriben los archivos")
+    parser.add_argument("--formato", choices=["xlsx", EXTENSION_AVANCE], default="xlsx",
+                        help=f"libros de Excel o archivo de avance (.{EXTENSION_AVANCE}, Parquet)")
+    parser.add_argument("--hojas", choices=list(ESTRATEGIAS_HOJAS), default="Deducibles",
+                        help="división en hojas de los libros (Emitidos usa Periodos en lugar de Deducibles)")
+    parser.add_argument("--periodos", nargs="+", default=[], metavar="AAAA-MM",
+                        help="exportar sólo estos periodos")
+    parser.add_argument("--procesos", type=int, default=NUM_PROCESOS_DEFAULT)
+    parser.add_argument("--sin-cache", action="store_true", help="no usar la caché de XMLs")
+    args = parser.parse_args(argv)
+    if args.procesos < 1:
+        parser.error("--procesos debe ser al menos 1")
+    rfc = args.rfc.strip().upper()
+
+    tiempos = {}
+    inicio = time.perf_counter()
+    rutas = buscar_zips(args.entradas)
+    tiempos["buscar"] = time.perf_counter() - inicio
+    if not rutas:
+        print("No se encontraron archivos ZIP.", file=sys.stderr)
+        return SALIDA_SIN_DATOS
+
+    inicio = time.perf_counter()
+    extraidos = extraer_zips(rutas, args.procesos, not args.sin_cache)
+    tiempos["extraer"] = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    filas, conceptos, complementos, versiones = [], [], {}, {}
+    zips_con_error = xml_con_error = aciertos = 0
+    for ruta, resultado in extraidos:
+        errores = resultado["errores"]
+        if any(e["archivo"] == ruta for e in errores):
+            # El ZIP mismo no se pudo abrir
+            zips_con_error += 1
+            print(describir_error(errores[0]), file=sys.stderr)
+            continue
+        for error in errores:
+            print(f"{ruta}: {describir_error(error)}", file=sys.stderr)
+        xml_con_error += len(errores)
+        aciertos += resultado["aciertos_cache"]
+        filas.extend(resultado["filas"])
+        conceptos.extend(resultado["conceptos"])
+        for lateral, filas_lateral in resultado["complementos"].items():
+            complementos.setdefault(lateral, []).extend(filas_lateral)
+        for version, n in resultado["versiones"].items():
+            versiones[version] = versiones.get(version, 0) + n
+    df = aplicar_esquema(pd.DataFrame(filas)) if filas else pd.DataFrame()
+    df_conceptos = conceptos_a_df(conceptos)
+    df_complementos = complementos_a_df(complementos)
+    tiempos["esquema"] = time.perf_counter() - inicio
+
+    conteos = {"ZIPs": len(rutas), "ZIPs con error": zips_con_error, "XMLs leídos": len(filas),
+               "XMLs con error": xml_con_error, "aciertos de caché": aciertos}
+    for version in sorted(versiones, reverse=True):
+        conteos[f"CFDI {version}"] = versiones[version]
+    if df.empty:
+        imprimir_resumen(tiempos, conteos)
+        print("Los ZIPs no contienen CFDIs.", file=sys.stderr)
+        return SALIDA_SIN_DATOS
+
+    inicio = time.perf_counter()
+    tablas, ajenos = clasificar_por_rfc(df, rfc)
+    duplicados = 0
+    for tabla in tablas:
+        tablas[tabla], eliminados = deduplicar(tablas[tabla])
+        tablas[tabla][COLUMNA_BANDERA[tabla]] = True
+        duplicados += eliminados
+    conceptos_tablas = {tabla: conceptos_de(df_conceptos, tablas[tabla]) for tabla in tablas}
+    complementos_tablas = {tabla: complementos_de(df_complementos, tablas[tabla]) for tabla in tablas}
+    tiempos["clasificar"] = time.perf_counter() - inicio
+    conteos.update({"CFDIs ajenos al RFC": len(ajenos), "UUIDs duplicados": duplicados,
+                    "Recibidos": len(tablas["df_recibidos"]), "Emitidos": len(tablas["df_emitidos"])})
+    for lateral in df_complementos:
+        conteos[lateral] = sum(len(c.get(lateral, ())) for c in complementos_tablas.values())
+    if all(t.empty for t in tablas.values()):
+        imprimir_resumen(tiempos, conteos)
+        print(f"Ningún CFDI tiene a {rfc} como emisor o receptor.", file=sys.stderr)
+        return SALIDA_SIN_DATOS
+
+    inicio = time.perf_counter()
+    try:
+        os.makedirs(args.salida, exist_ok=True)
+        if args.formato == "xlsx":
+            escritos = escribir_excel(tablas, rfc, args.periodos, args.hojas, args.salida)
+            escritos += escribir_complementos(tablas, complementos_tablas, rfc, args.periodos, args.salida)
+        else:
+            escritos = escribir_avance(tablas, conceptos_tablas, complementos_tablas, rfc, args.periodos,
+                                       args.salida)
+    except (OSError, FileCreateError) as e:
+        imprimir_resumen(tiempos, conteos)
+        print(f"No se pudo escribir la salida: {e}", file=sys.stderr)
+        return SALIDA_ERROR_ESCRITURA
+    tiempos["escribir"] = time.perf_counter() - inicio
+
+    for ruta in escritos:
+        print(ruta)
+    imprimir_resumen(tiempos, conteos)
+    return SALIDA_PARCIAL if zips_con_error or xml_con_error else SALIDA_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
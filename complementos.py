@@ -0,0 +1,180 @@
+import pandas as pd
+
+# Extractores de complementos del CFDI. Cada uno se registra con el namespace y el
+# elemento raíz de su complemento; _LectorCFDI lo crea sólo si el documento trae ese
+# elemento y le pasa los eventos de su subárbol en la misma pasada del parser. Un
+# extractor llena una o más tablas laterales (p. ej. pagos y sus documentos
+# relacionados) que se ligan al CFDI por UUID y XML, igual que los conceptos.
+
+EXTRACTORES_COMPLEMENTO = {}    # namespace -> clase del extractor
+RAICES_COMPLEMENTO = {}         # "{namespace}Raiz" -> clase del extractor
+ESQUEMAS_COMPLEMENTO = {}       # tabla lateral -> esquema (ver ExtractorComplemento.tablas)
+
+
+def registrar_complemento(clase):
+    """
+    Decorador: da de alta un extractor (subclase de ExtractorComplemento).
+    """
+    EXTRACTORES_COMPLEMENTO[clase.namespace] = clase
+    RAICES_COMPLEMENTO[f"{{{clase.namespace}}}{clase.raiz}"] = clase
+    ESQUEMAS_COMPLEMENTO.update(clase.tablas)
+    return clase
+
+
+class ExtractorComplemento:
+    """
+    Recibe los eventos del subárbol del complemento, raíz incluida, con el nombre local
+    de cada elemento y su nivel relativo a la raíz (0). Un documento usa una sola
+    instancia por clase aunque traiga el complemento más de una vez.
+
+    tablas: {tabla: {"titulo", "campos", "montos", "enteros", "fechas"}}; las filas
+    se acumulan en self.filas[tabla] sin UUID ni XML (procesar_zip los agrega).
+    """
+    namespace = ""
+    raiz = ""
+    tablas = {}
+
+    def __init__(self):
+        self.filas = {tabla: [] for tabla in self.tablas}
+        self.nivel = 0
+        self._prefijo = f"{{{self.namespace}}}"
+
+    def start(self, tag, attrib):
+        nivel = self.nivel
+        self.nivel += 1
+        if tag.startswith(self._prefijo):
+            self.inicio(tag[len(self._prefijo):], attrib, nivel)
+
+    def end(self, tag):
+        self.nivel -= 1
+
+    def inicio(self, nombre, attrib, nivel):
+        raise NotImplementedError
+
+    def _fila(self, tabla, attrib, **extra):
+        fila = {campo: attrib.get(campo, "") for campo in self.tablas[tabla]["campos"]}
+        fila.update(extra)
+        self.filas[tabla].append(fila)
+        return fila
+
+
+@registrar_complemento
+class ExtractorPagos20(ExtractorComplemento):
+    # Complemento para recepción de pagos 2.0: un registro por Pago y uno por cada
+    # DoctoRelacionado que liquida (Pago es el número de pago dentro del CFDI)
+    namespace = "http://www.sat.gob.mx/Pagos20"
+    raiz = "Pagos"
+    tablas = {
+        "pagos": {
+            "titulo": "Pagos",
+            "campos": ["Pago", "FechaPago", "FormaDePagoP", "MonedaP", "TipoCambioP", "Monto", "NumOperacion"],
+            "montos": ["TipoCambioP", "Monto"],
+            "enteros": ["Pago"],
+            "fechas": ["FechaPago"],
+        },
+        "pagos_doctos": {
+            "titulo": "Documentos relacionados a pagos",
+            "campos": ["Pago", "IdDocumento", "Serie", "Folio", "MonedaDR", "EquivalenciaDR", "NumParcialidad",
+                       "ImpSaldoAnt", "ImpPagado", "ImpSaldoInsoluto", "ObjetoImpDR"],
+            "montos": ["EquivalenciaDR", "ImpSaldoAnt", "ImpPagado", "ImpSaldoInsoluto"],
+            "enteros": ["Pago", "NumParcialidad"],
+            "fechas": [],
+        },
+    }
+
+    def __init__(self):
+        super().__init__()
+        self.pago = 0
+
+    def inicio(self, nombre, attrib, nivel):
+        if nombre == "Pago" and nivel == 1:
+            self.pago += 1
+            self._fila("pagos", attrib, Pago=self.pago)
+        elif nombre == "DoctoRelacionado" and nivel == 2:
+            self._fila("pagos_doctos", attrib, Pago=self.pago)
+
+
+@registrar_complemento
+class ExtractorNomina12(ExtractorComplemento):
+    # Complemento de nómina 1.2: un registro por recibo (con los datos del Emisor y del
+    # Receptor de la nómina y los totales) y uno por percepción y por deducción
+    namespace = "http://www.sat.gob.mx/nomina12"
+    raiz = "Nomina"
+    tablas = {
+        "nomina": {
+            "titulo": "Nómina",
+            "campos": ["Nomina", "TipoNomina", "FechaPago", "FechaInicialPago", "FechaFinalPago", "NumDiasPagados",
+                       "TotalPercepciones", "TotalDeducciones", "TotalOtrosPagos", "RegistroPatronal", "Curp",
+                       "NumEmpleado", "Departamento", "Puesto", "TipoContrato", "TipoRegimen", "PeriodicidadPago",
+                       "SalarioBaseCotApor", "SalarioDiarioIntegrado", "ClaveEntFed", "TotalSueldos",
+                       "TotalGravado", "TotalExento", "TotalOtrasDeducciones", "TotalImpuestosRetenidos"],
+            "montos": ["NumDiasPagados", "TotalPercepciones", "TotalDeducciones", "TotalOtrosPagos",
+                       "SalarioBaseCotApor", "SalarioDiarioIntegrado", "TotalSueldos", "TotalGravado",
+                       "TotalExento", "TotalOtrasDeducciones", "TotalImpuestosRetenidos"],
+            "enteros": ["Nomina"],
+            "fechas": ["FechaPago", "FechaInicialPago", "FechaFinalPago"],
+        },
+        "nomina_percepciones": {
+            "titulo": "Percepciones de nómina",
+            "campos": ["Nomina", "TipoPercepcion", "Clave", "Concepto", "ImporteGravado", "ImporteExento"],
+            "montos": ["ImporteGravado", "ImporteExento"],
+            "enteros": ["Nomina"],
+            "fechas": [],
+        },
+        "nomina_deducciones": {
+            "titulo": "Deducciones de nómina",
+            "campos": ["Nomina", "TipoDeduccion", "Clave", "Concepto", "Importe"],
+            "montos": ["Importe"],
+            "enteros": ["Nomina"],
+            "fechas": [],
+        },
+    }
+    # Hijos directos de Nomina cuyos atributos completan el registro del recibo
+    _SECCIONES = {
+        "Emisor": ["RegistroPatronal"],
+        "Receptor": ["Curp", "NumEmpleado", "Departamento", "Puesto", "TipoContrato", "TipoRegimen",
+                     "PeriodicidadPago", "SalarioBaseCotApor", "SalarioDiarioIntegrado", "ClaveEntFed"],
+        "Percepciones": ["TotalSueldos", "TotalGravado", "TotalExento"],
+        "Deducciones": ["TotalOtrasDeducciones", "TotalImpuestosRetenidos"],
+    }
+
+    def __init__(self):
+        super().__init__()
+        self.nomina = 0
+        self.recibo = None
+
+    def inicio(self, nombre, attrib, nivel):
+        if nivel == 0:
+            self.nomina += 1
+            self.recibo = self._fila("nomina", attrib, Nomina=self.nomina)
+        elif nivel == 1 and nombre in self._SECCIONES:
+            for campo in self._SECCIONES[nombre]:
+                self.recibo[campo] = attrib.get(campo, "")
+        elif nombre == "Percepcion" and nivel == 2:
+            self._fila("nomina_percepciones", attrib, Nomina=self.nomina)
+        elif nombre == "Deduccion" and nivel == 2:
+            self._fila("nomina_deducciones", attrib, Nomina=self.nomina)
+
+
+def complemento_a_df(tabla, filas):
+    """
+    filas: lista de dicts de la tabla lateral (con UUID y XML). Regresa la tabla tipada
+    según su esquema: montos a float64, contadores a Int64 y fechas a datetime64.
+    """
+    esquema = ESQUEMAS_COMPLEMENTO[tabla]
+    df = pd.DataFrame(filas, columns=["UUID", "XML"] + esquema["campos"])
+    for col in esquema["montos"]:
+        df[col] = pd.to_numeric(df[col], errors="coerce").astype("float64")
+    for col in esquema["enteros"]:
+        df[col] = pd.to_numeric(df[col], errors="coerce").astype("Int64")
+    for col in esquema["fechas"]:
+        df[col] = pd.to_datetime(df[col], errors="coerce", format="ISO8601")
+    return df
+
+
+def complementos_a_df(complementos):
+    """
+    complementos: {tabla: [filas]} (ver procesar_zip). Regresa {tabla: df} sólo con las
+    tablas que tienen filas.
+    """
+    return {tabla: complemento_a_df(tabla, filas) for tabla, filas in complementos.items() if filas}
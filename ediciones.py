@@ -0,0 +1,123 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from indices import es_uuid_valido
+
+
+def claves_de_filas(df, posiciones):
+    """
+    Clave estable de cada fila: el UUID, o "XML:<archivo>" si no trae UUID. A diferencia
+    de la posición, sobrevive a eliminar filas o a volver a cargar la tabla.
+    """
+    uuids = df["UUID"].to_numpy()[posiciones] if "UUID" in df.columns else [None] * len(posiciones)
+    xmls = df["XML"].to_numpy()[posiciones] if "XML" in df.columns else [None] * len(posiciones)
+    return [uuid if es_uuid_valido(uuid) else f"XML:{xml}" for uuid, xml in zip(uuids, xmls)]
+
+
+def valor_json(valor):
+    if valor is None or (not isinstance(valor, str) and pd.isna(valor)):
+        return None
+    if isinstance(valor, pd.Timestamp):
+        return valor.isoformat()
+    if isinstance(valor, np.generic):
+        return valor.item()
+    return valor
+
+
+def convertir_a_tipo_de(valores, serie):
+    """
+    Convierte valores en tipos de JSON (de la grilla o de la bitácora) al tipo de la
+    columna original.
+    """
+    if pd.api.types.is_bool_dtype(serie):
+        return valores.map(lambda v: v in (True, 1, "true", "True"))
+    if pd.api.types.is_numeric_dtype(serie):
+        return pd.to_numeric(valores, errors="coerce")
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        fechas = pd.to_datetime(valores, errors="coerce", format="ISO8601", utc=True)
+        return fechas.dt.tz_localize(None)
+    return valores.map(lambda v: np.nan if v is None else str(v))
+
+
+class BitacoraEdiciones:
+    """
+    Bitácora de ediciones de celdas, sólo se le agregan entradas. Cada entrada guarda
+    la tabla, la clave y la posición de la fila, la columna y los valores anterior y
+    nuevo (en tipos de JSON). Las entradas de una misma aplicación comparten lote; deshacer
+    un lote agrega un lote nuevo con los valores invertidos y deshace=<lote>.
+
+    Los lotes vigentes de cada tabla (ni deshechos ni de deshacer) se mantienen al
+    agregar entradas, así que el último lote por deshacer y las entradas efectivas no
+    recorren toda la bitácora en cada rerun.
+    """
+    def __init__(self, entradas=None):
+        self.entradas = []
+        self._por_lote = {}
+        self._por_tabla = {}
+        self._deshechos = set()
+        # tabla -> {lote: [entradas]} en orden de lote; el último es el que se deshace
+        self._vigentes = {}
+        self._agregar(list(entradas or []))
+
+    def _agregar(self, entradas):
+        for e in entradas:
+            self.entradas.append(e)
+            self._por_lote.setdefault(e["lote"], []).append(e)
+            self._por_tabla.setdefault(e["tabla"], []).append(e)
+            if e["deshace"] is not None:
+                self._deshechos.add(e["deshace"])
+                self._vigentes.get(e["tabla"], {}).pop(e["deshace"], None)
+            elif e["lote"] not in self._deshechos:
+                self._vigentes.setdefault(e["tabla"], {}).setdefault(e["lote"], []).append(e)
+
+    def _siguiente_lote(self):
+        return self.entradas[-1]["lote"] + 1 if self.entradas else 1
+
+    def registrar(self, tabla, celdas, deshace=None):
+        """
+        celdas: [(clave, posición, columna, anterior, nuevo), ...]. Regresa el lote.
+        """
+        lote = self._siguiente_lote()
+        fecha = datetime.now().isoformat(timespec="seconds")
+        self._agregar([{
+            "lote": lote, "tabla": tabla, "clave": clave, "posicion": int(posicion),
+            "columna": columna, "anterior": valor_json(anterior), "nuevo": valor_json(nuevo),
+            "fecha": fecha, "deshace": deshace,
+        } for clave, posicion, columna, anterior, nuevo in celdas])
+        return lote
+
+    def ultimo_lote(self, tabla):
+        """
+        Último lote de ediciones de la tabla que no se ha deshecho (o None).
+        """
+        vigentes = self._vigentes.get(tabla)
+        return next(reversed(vigentes)) if vigentes else None
+
+    def entradas_de(self, lote):
+        return list(self._por_lote.get(lote, []))
+
+    def entradas_tabla(self, tabla):
+        return self._por_tabla.get(tabla, [])
+
+    def efectivas(self, tabla):
+        """
+        Entradas vigentes de la tabla, en orden: sin los lotes deshechos ni los de deshacer.
+        """
+        return [e for entradas in self._vigentes.get(tabla, {}).values() for e in entradas]
+
+    def importar(self, entradas):
+        """
+        Agrega las entradas de otra bitácora (p. ej. de un archivo de avance)
+        renumerando sus lotes después de los actuales. Regresa las entradas agregadas.
+        """
+        desplazamiento = self._siguiente_lote() - 1
+        agregadas = []
+        for e in entradas:
+            agregadas.append(dict(
+                e, lote=e["lote"] + desplazamiento,
+                deshace=None if e.get("deshace") is None else e["deshace"] + desplazamiento,
+            ))
+        self._agregar(agregadas)
+        return agregadas
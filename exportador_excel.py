@@ -0,0 +1,206 @@
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+import xlsxwriter
+
+from nucleo_cfdi import calcular_periodo, es_columna_impuesto
+
+# Motor único de exportación a Excel. Escribe fila por fila con el modo constant_memory
+# de xlsxwriter (cada hoja se vuelca a disco al avanzar de fila), así que la memoria no
+# crece con el número de filas. La forma de repartir las filas en hojas la decide una
+# estrategia: una función (df, indice_periodos, periodos) -> [(nombre_hoja, posiciones)].
+
+ANCHOS_COLUMNA = {
+    "Régimen Fiscal Emisor": 20,
+    "Rfc Receptor": 15,
+    "Nombre Receptor": 25,
+    "CP Receptor": 10,
+    "Régimen Receptor": 20,
+    "Uso Cfdi Receptor": 25,
+    "Tipo": 10,
+    "Serie": 10,
+    "Folio": 10,
+    "Fecha": 15,
+    "Sub Total": 12,
+    "Descuento": 12,
+    "Total impuesto Trasladado": 18,
+    "Nombre Impuesto": 25,
+    "Total impuesto Retenido": 18,
+    "Total": 15,
+    "UUID": 40,
+    "Método de Pago": 15,
+    "Forma de Pago": 20,
+    "Moneda": 10,
+    "Tipo de Cambio": 15,
+    "Versión": 10,
+    "Periodo": 10,
+    "Deducible": 10
+}
+ANCHO_DEFAULT = 12
+COLUMNAS_NUMERICAS = ["Sub Total", "Descuento",
+                      "Total impuesto Trasladado", "Total impuesto Retenido",
+                      "Total", "Tipo de Cambio"]
+FILAS_POR_BLOQUE = 5_000
+_MAX_NOMBRE_HOJA = 31
+_CARACTERES_INVALIDOS_HOJA = str.maketrans({c: "_" for c in "[]:*?/\\"})
+
+
+# Estrategias de división en hojas
+
+def hojas_por_periodo(df, indice_periodos, periodos):
+    return [(p, indice_periodos.filas(p)) for p in periodos]
+
+
+def hojas_por_deducible(df, indice_periodos, periodos):
+    deducible = df["Deducible"].to_numpy()
+    hojas = []
+    for p in periodos:
+        filas = indice_periodos.filas(p)
+        marcas = deducible[filas]
+        hojas.append((f"{p} - Deducibles", filas[marcas == True]))
+        hojas.append((f"{p} - No Deducibles", filas[marcas == False]))
+    return hojas
+
+
+def hojas_por_rfc_emisor(df, indice_periodos, periodos):
+    if not periodos:
+        return []
+    filas = np.sort(np.concatenate([indice_periodos.filas(p) for p in periodos]))
+    rfcs = pd.Series(df["Rfc Emisor"].to_numpy()[filas], dtype=object).fillna("")
+    grupos = rfcs.groupby(rfcs.to_numpy(), sort=True).indices
+    return [(rfc or "Sin RFC", filas[pos]) for rfc, pos in grupos.items()]
+
+
+ESTRATEGIAS_HOJAS = {
+    "Deducibles": hojas_por_deducible,
+    "Periodos": hojas_por_periodo,
+    "RFC Emisor": hojas_por_rfc_emisor,
+}
+
+
+# Motor
+
+def _nombre_hoja(nombre, usados):
+    base = str(nombre).translate(_CARACTERES_INVALIDOS_HOJA)[:_MAX_NOMBRE_HOJA] or "Hoja"
+    candidato, n = base, 1
+    while candidato.lower() in usados:
+        n += 1
+        sufijo = f" ({n})"
+        candidato = base[:_MAX_NOMBRE_HOJA - len(sufijo)] + sufijo
+    usados.add(candidato.lower())
+    return candidato
+
+
+def _columna_a_lista(serie):
+    """
+    Valores de la columna como objetos de Python, con None en los vacíos (NaN/NaT),
+    que no se escriben.
+    """
+    if pd.api.types.is_float_dtype(serie):
+        return [None if v != v else v for v in serie.tolist()]
+    if pd.api.types.is_bool_dtype(serie) or pd.api.types.is_integer_dtype(serie):
+        return serie.tolist()
+    return [None if pd.isna(v) else v for v in serie.astype(object).tolist()]
+
+
+def _es_numerica(col):
+    # Montos fijos más las columnas de la matriz de impuestos
+    return col in COLUMNAS_NUMERICAS or es_columna_impuesto(col)
+
+
+def _escritor_celda(worksheet, serie, formatos):
+    # Se elige el método de escritura una vez por columna y no por celda
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return lambda fila, col, v: worksheet.write_datetime(fila, col, v, formatos["fecha"])
+    if _es_numerica(serie.name):
+        return lambda fila, col, v: worksheet.write_number(fila, col, v, formatos["numero"])
+    if pd.api.types.is_bool_dtype(serie):
+        return worksheet.write_boolean
+    if pd.api.types.is_numeric_dtype(serie):
+        return worksheet.write_number
+    return worksheet.write
+
+
+def _escribir_hoja(worksheet, df, filas, formatos):
+    columnas = [col for col in df.columns if col != "Periodo"] + ["Periodo"]
+    ncols = len(columnas)
+    worksheet.write_row(0, 0, columnas, formatos["encabezado"])
+    for idx, col in enumerate(columnas):
+        if col == "Fecha":
+            worksheet.set_column(idx, idx, ANCHOS_COLUMNA.get(col, 15), formatos["fecha"])
+        elif _es_numerica(col):
+            worksheet.set_column(idx, idx, ANCHOS_COLUMNA.get(col, ANCHO_DEFAULT), formatos["numero"])
+        else:
+            worksheet.set_column(idx, idx, ANCHOS_COLUMNA.get(col, ANCHO_DEFAULT))
+
+    fila_excel = 1
+    for inicio in range(0, len(filas), FILAS_POR_BLOQUE):
+        bloque = df.iloc[filas[inicio:inicio + FILAS_POR_BLOQUE]]
+        bloque = bloque.assign(Periodo=calcular_periodo(bloque["Fecha"]) if "Fecha" in bloque.columns else "")
+        escritores = [_escritor_celda(worksheet, bloque[col], formatos) for col in columnas]
+        valores = [_columna_a_lista(bloque[col]) for col in columnas]
+        for fila in zip(*valores):
+            for idx, v in enumerate(fila):
+                if v is not None:
+                    escritores[idx](fila_excel, idx, v)
+            fila_excel += 1
+
+    nfilas = len(filas)
+    worksheet.autofilter(0, 0, nfilas, ncols - 1)
+    # Condicional: resaltar en rojo las filas donde "Deducible" sea FALSE
+    if "Deducible" in columnas and nfilas:
+        ded_letter = colnum_to_excel(columnas.index("Deducible") + 1)
+        worksheet.conditional_format(f"A2:{colnum_to_excel(ncols)}{nfilas + 1}",
+                                     {'type': 'formula',
+                                      'criteria': f'=NOT(${ded_letter}2)',
+                                      'format': formatos["rojo"]})
+
+
+def exportar_excel(df, indice_periodos, periodos, estrategia, destino):
+    """
+    Escribe en destino (ruta del archivo) un libro con las hojas que genera la estrategia.
+    """
+    workbook = xlsxwriter.Workbook(destino, {
+        "constant_memory": True,
+        "remove_timezone": True,
+        # Los textos se escriben tal cual, igual que con to_excel
+        "strings_to_formulas": False,
+        "strings_to_urls": False,
+    })
+    # Los formatos se crean una sola vez por libro
+    formatos = {
+        "encabezado": workbook.add_format({"bold": True, "border": 1, "align": "center", "valign": "top"}),
+        "fecha": workbook.add_format({'num_format': 'dd-mm-yyyy'}),
+        "numero": workbook.add_format({'num_format': '#,##0.00'}),
+        "rojo": workbook.add_format({'font_color': 'red'}),
+    }
+    usados = set()
+    try:
+        for nombre, filas in estrategia(df, indice_periodos, periodos):
+            worksheet = workbook.add_worksheet(_nombre_hoja(nombre, usados))
+            _escribir_hoja(worksheet, df, filas, formatos)
+    finally:
+        workbook.close()
+
+
+def exportar_excel_bytes(df, indice_periodos, periodos, estrategia):
+    """
+    Igual que exportar_excel pero a través de un archivo temporal; regresa los bytes del
+    libro terminado (ya comprimido) para st.download_button.
+    """
+    with tempfile.TemporaryDirectory(prefix="contabiliza2_") as directorio:
+        ruta = os.path.join(directorio, "exportacion.xlsx")
+        exportar_excel(df, indice_periodos, periodos, estrategia, ruta)
+        with open(ruta, "rb") as f:
+            return f.read()
+
+
+# Función auxiliar: convertir número de columna (1-indexado) a letra de Excel
+def colnum_to_excel(n):
+    string = ""
+    while n:
+        n, remainder = divmod(n - 1, 26)
+        string = chr(65 + remainder) + string
+    return string
@@ -1,76 +1,83 @@
 import streamlit as st
 import zipfile
 import io
-import xml.etree.ElementTree as ET
+import os
+import time
+from datetime import datetime
+import numpy as np
 import pandas as pd
-from st_aggrid import AgGrid, GridOptionsBuilder, DataReturnMode, GridUpdateMode
-
-# Mapea Forma de Pago
-codigo_map_forma_pago = {
-    "01": "Efectivo","02": "Cheque Nominativo","03": "Transferencia Electrónica de Fondos SPEI",
-    "04": "Tarjeta de Crédito","05": "Monedero Electrónico","06": "Dinero Electrónico",
-    "8": "Vales de Despensa","12": "Dación en Pago","13": "Pago por Subrogación",
-    "14": "Pago por Consignación","15": "Condonación","17": "Compensación","23": "Novación",
-    "24": "Confusión","25": "Remisión de Deuda","26": "Prescripción o Caducidad",
-    "27": "A Satisfacción del Acreedor","28": "Tarjeta de Débito","29": "Tarjeta de Servicios",
-    "30": "Aplicación de Anticipos","31": "Intermediario Pagos","99": "Por Definir",
-}
-
-# Mapea Uso de CFDI
-codigo_map_uso_cfdi = {
-    "G01": "Adquisición de mercancías","G02": "Devoluciones, descuentos o bonificaciones",
-    "G03": "Gastos en general","I01": "Construcciones","I02": "Mobiliario y equipo de oficina por inversiones",
-    "I03": "Equipo de transporte","I04": "Equipo de computo y accesorios","I05": "Dados, troqueles, moldes, matrices y herramental",
-    "I06": "Comunicaciones telefónicas","I07": "Comunicaciones satelitales","I08": "Otra maquinaria y equipo",
-    "D01": "Honorarios médicos, dentales y gastos hospitalarios","D02": "Gastos médicos por incapacidad o discapacidad",
-    "D03": "Gastos funerarios","D04": "Donativos","D05": "Intereses reales pagados por créditos hipotecarios (casa habitación)",
-    "D06": "Aportaciones voluntarias al SAR","D07": "Primas por seguros de gastos médicos",
-    "D08": "Gastos de transportación escolar obligatoria","D09": "Depósitos en cuentas para el ahorro, primas que tengan como base planes de pensiones",
-    "D10": "Pagos por servicios educativos (colegiaturas)","S01": "Sin efectos fiscales","CP01": "Pagos","CN01": "Nómina",
-}
-
-# Columnas para sumatorias
-resumen_cols = [
-    "Sub Total",
-    "Descuento",
-    "Total impuesto Trasladado",
-    "Total impuesto Retenido",
-    "Total",
-    "Traslado IVA 0.160000 %"
-]
-
-def filtrar_duplicados_por_uuid(nuevo_df, df_existente, uuid_col="UUID"):
-    if uuid_col not in df_existente.columns:
-        return nuevo_df
-    uuids_existentes = df_existente[uuid_col].unique()
-    return nuevo_df[~nuevo_df[uuid_col].isin(uuids_existentes)]
-
-def eliminar_duplicados_en_df(df, uuid_col="UUID"):
-    if uuid_col not in df.columns:
-        return df, 0
-    n_antes = len(df)
-    df_sin_dup = df.drop_duplicates(subset=[uuid_col], keep='first')
-    n_despues = len(df_sin_dup)
-    eliminados = n_antes - n_despues
-    return df_sin_dup, eliminados
-
-def mostrar_eliminar_duplicados_ui(df, nombre_tabla="Recibidos"):
+
+from cache_cfdi import clave_contenido
+from indices import IndiceUUID, es_uuid_valido
+from nucleo_cfdi import (
+    CLAVES_DUPLICADOS, COLUMNA_BANDERA, agregados_desde_df, aplicar_esquema, calcular_periodo, clasificar_por_rfc,
+    columnas_categoria_concepto, columnas_duplicados, columnas_resumen, complementos_de, concatenar_cfdis,
+    conceptos_a_df, conceptos_de, eliminar_duplicados_en_df, filtrar_duplicados_por_uuid, indice_duplicados_desde_df,
+    indice_periodos_desde_df, describir_error, obtener_cache, procesar_zip
+)
+from complementos import ESQUEMAS_COMPLEMENTO, complementos_a_df
+from relaciones import TIPOS_RELACION, GrafoRelaciones, aristas_de_filas, aristas_de_pagos
+from instrumentacion import RegistroInstrumentacion, activar, medir
+from ediciones import BitacoraEdiciones, claves_de_filas, convertir_a_tipo_de
+
+
+# Columnas que se muestran de cada CFDI al revisar duplicados
+_COLUMNAS_DUPLICADOS = ["XML", "UUID", "Fecha", "Serie", "Folio", "Rfc Emisor", "Nombre Emisor",
+                        "Rfc Receptor", "Nombre Receptor", "Total"]
+
+def grupos_duplicados(tabla, clave, tolerancia=0.0):
+    """
+    Grupos (listas de posiciones) de CFDIs duplicados de la tabla: por UUID repetido si
+    clave es "UUID", o casi duplicados según una de CLAVES_DUPLICADOS con el Total a lo
+    más a tolerancia de distancia.
+    """
+    df = st.session_state[tabla]
+    if clave != "UUID":
+        return obtener_indice_duplicados(tabla).grupos(df, clave, tolerancia)
+    indice = obtener_indice_uuid(tabla)
+    if not indice.repetidos:
+        return []
+    # Los UUIDs repetidos son raros (se filtran al ingerir): basta con buscarlos en la tabla
+    uuids = df["UUID"].to_numpy()
+    posiciones = np.flatnonzero(df["UUID"].isin(indice.repetidos).to_numpy())
+    return list(pd.Series(posiciones).groupby(uuids[posiciones], sort=False).apply(list))
+
+def mostrar_eliminar_duplicados_ui(tabla, nombre_tabla="Recibidos"):
+    """
+    Muestra los grupos de duplicados (UUID repetido o casi duplicados) en una grilla
+    para elegir cuáles eliminar. Regresa el número de CFDIs eliminados.
+    """
     from st_aggrid import GridOptionsBuilder, AgGrid, DataReturnMode, GridUpdateMode
 
-    st.subheader(f"Análisis de duplicados en {nombre_tabla}")
+    df = st.session_state[tabla]
     if "UUID" not in df.columns:
         st.info(f"No existe la columna 'UUID' en la tabla '{nombre_tabla}'.")
-        return None
+        return 0
+    # Sólo se buscan cuando se pide
+    if not st.toggle(f"Buscar duplicados en {nombre_tabla}", key=f"duplicados_{tabla}"):
+        return 0
 
-    df_dup = df.copy()
-    counts = df_dup["UUID"].value_counts()
-    uuids_duplicados = counts[counts > 1].index
-    df_duplicados = df_dup[df_dup["UUID"].isin(uuids_duplicados)]
-    if df_duplicados.empty:
-        st.info("No se encontraron CFDIs duplicados (mismo UUID).")
-        return None
-
-    st.markdown(f"Se encontraron **{len(df_duplicados)}** filas con UUID repetido.")
+    st.subheader(f"Análisis de duplicados en {nombre_tabla}")
+    col1, col2 = st.columns(2)
+    clave = col1.selectbox("Comparar por", ["UUID", *CLAVES_DUPLICADOS], key=f"clave_duplicados_{tabla}",
+                           help="Con UUID distinto: p. ej. una factura cancelada y vuelta a emitir.")
+    tolerancia = col2.number_input("Tolerancia en el Total", min_value=0.0, value=0.0, step=0.01,
+                                   key=f"tolerancia_duplicados_{tabla}", disabled=clave == "UUID")
+    if clave == "UUID" and obtener_indice_uuid(tabla).sin_uuid:
+        st.warning(f"Hay **{obtener_indice_uuid(tabla).sin_uuid}** CFDIs sin UUID en {nombre_tabla}; "
+                   f"no se comparan como duplicados.")
+    with medir(f"duplicados ({clave})") as span:
+        grupos = grupos_duplicados(tabla, clave, tolerancia)
+        span.filas = sum(len(grupo) for grupo in grupos)
+    if not grupos:
+        st.info(f"No se encontraron CFDIs duplicados por {clave}.")
+        return 0
+    posiciones = np.concatenate(grupos)
+    df_duplicados = df.iloc[posiciones, df.columns.get_indexer(
+        [col for col in _COLUMNAS_DUPLICADOS if col in df.columns])].reset_index(drop=True)
+    df_duplicados.insert(0, "Grupo", np.repeat(np.arange(1, len(grupos) + 1), [len(g) for g in grupos]))
+
+    st.markdown(f"Se encontraron **{len(grupos)}** grupos con **{len(posiciones)}** CFDIs.")
     st.info("Selecciona las filas que deseas **eliminar** de la tabla principal.")
 
     gb = GridOptionsBuilder.from_dataframe(df_duplicados)
@@ -84,144 +91,749 @@ def mostrar_eliminar_duplicados_ui(df, nombre_tabla="Recibidos"):
         update_mode=GridUpdateMode.SELECTION_CHANGED,
         height=400,
         width=2500,
+        key=f"grid_duplicados_{tabla}_{clave}",
     )
 
     filas_seleccionadas = grid_response["selected_rows"]
-    if st.button(f"Eliminar duplicados seleccionados en {nombre_tabla}"):
-        if not filas_seleccionadas:
+    if st.button(f"Eliminar duplicados seleccionados en {nombre_tabla}", key=f"eliminar_duplicados_{tabla}"):
+        if filas_seleccionadas is None or len(filas_seleccionadas) == 0:
             st.warning("No has seleccionado ningún CFDI para eliminar.")
-            return None
-        uuids_a_eliminar = [row["UUID"] for row in filas_seleccionadas]
-        df_sin_seleccion = df[~df["UUID"].isin(uuids_a_eliminar)]
-        st.success(f"Se han eliminado {len(filas_seleccionadas)} filas duplicadas en {nombre_tabla}.")
-        return df_sin_seleccion
-    return None
-
-def procesar_zip(uploaded_file):
-    # Este necesita la variable 'company_rfc', la inyectaremos vía import en main o se pasa por parámetro
-    zip_bytes = uploaded_file.read()
-    rows = []
-    with zipfile.ZipFile(io.BytesIO(zip_bytes)) as thezip:
-        ns = {'cfdi': 'http://www.sat.gob.mx/cfd/4','tfd': 'http://www.sat.gob.mx/TimbreFiscalDigital'}
-        for filename in thezip.namelist():
-            if filename.lower().endswith(".xml"):
-                with thezip.open(filename) as xml_file:
-                    try:
-                        tree = ET.parse(xml_file)
-                        root = tree.getroot()
-                    except ET.ParseError:
-                        st.warning(f"Error al parsear el archivo XML: {filename}")
-                        continue
-
-                    row = {
-                        "XML": filename, "Rfc Emisor": "","Nombre Emisor": "","Régimen Fiscal Emisor": "",
-                        "Rfc Receptor": "","Nombre Receptor": "","CP Receptor": "","Régimen Receptor": "",
-                        "Uso Cfdi Receptor": "","Tipo": "","Serie": "","Folio": "","Fecha": "",
-                        "Sub Total": "","Descuento": "","Total impuesto Trasladado": "","Nombre Impuesto": "",
-                        "Total impuesto Retenido": "","Total": "","UUID": "","Método de Pago": "",
-                        "Forma de Pago": "","Moneda": "","Tipo de Cambio": "","Versión": "","Estado": "",
-                        "Estatus": "","Validación EFOS": "","Fecha Consulta": "","Conceptos": "",
-                        "Relacionados": "","Tipo Relación": "","Traslado IVA 0.160000 %": ""
-                    }
-                    # Extraer datos
-                    comp = root
-                    row["Fecha"] = comp.attrib.get("Fecha", "")
-                    row["Sub Total"] = comp.attrib.get("SubTotal", "")
-                    row["Descuento"] = comp.attrib.get("Descuento", "")
-                    row["Total"] = comp.attrib.get("Total", "")
-                    row["Método de Pago"] = comp.attrib.get("MetodoPago", "")
-
-                    forma_pago_codigo = comp.attrib.get("FormaPago", "")
-                    forma_pago_desc = codigo_map_forma_pago.get(forma_pago_codigo, "")
-                    if forma_pago_desc:
-                        row["Forma de Pago"] = f"{forma_pago_codigo}-{forma_pago_desc}"
-                    else:
-                        row["Forma de Pago"] = forma_pago_codigo
-
-                    row["Moneda"] = comp.attrib.get("Moneda", "")
-                    row["Tipo de Cambio"] = comp.attrib.get("TipoCambio", "")
-                    row["Versión"] = comp.attrib.get("Version", "")
-                    row["Serie"] = comp.attrib.get("Serie", "")
-                    row["Folio"] = comp.attrib.get("Folio", "")
-                    row["Tipo"] = comp.attrib.get("TipoDeComprobante", "")
-
-                    emisor = comp.find("cfdi:Emisor", namespaces=ns)
-                    if emisor is not None:
-                        row["Rfc Emisor"] = emisor.attrib.get("Rfc", "")
-                        row["Nombre Emisor"] = emisor.attrib.get("Nombre", "")
-                        row["Régimen Fiscal Emisor"] = emisor.attrib.get("RegimenFiscal", "")
-
-                    receptor = comp.find("cfdi:Receptor", namespaces=ns)
-                    if receptor is not None:
-                        row["Rfc Receptor"] = receptor.attrib.get("Rfc", "")
-                        row["Nombre Receptor"] = receptor.attrib.get("Nombre", "")
-                        row["CP Receptor"] = receptor.attrib.get("DomicilioFiscalReceptor", "")
-                        row["Régimen Receptor"] = receptor.attrib.get("RegimenFiscalReceptor", "")
-                        uso_cfdi_codigo = receptor.attrib.get("UsoCFDI", "")
-                        uso_cfdi_desc = codigo_map_uso_cfdi.get(uso_cfdi_codigo, "")
-                        if uso_cfdi_desc:
-                            row["Uso Cfdi Receptor"] = f"{uso_cfdi_codigo}-{uso_cfdi_desc}"
-                        else:
-                            row["Uso Cfdi Receptor"] = uso_cfdi_codigo
-
-                    timbre = comp.find(".//tfd:TimbreFiscalDigital", namespaces=ns)
-                    if timbre is not None:
-                        row["UUID"] = timbre.attrib.get("UUID", "")
-
-                    # Impuestos
-                    impuestos_elem = comp.find("cfdi:Impuestos", namespaces=ns)
-                    total_trasladado = (impuestos_elem.attrib.get("TotalImpuestosTrasladados")
-                                        if impuestos_elem is not None else None)
-                    impuestos_nombres = set()
-                    traslado_iva_016 = ""
-
-                    if total_trasladado is None:
-                        total_trasladado = 0.0
-                        for traslado in comp.findall(".//cfdi:Traslado", namespaces=ns):
-                            try:
-                                total_trasladado += float(traslado.attrib.get("Importe", "0"))
-                            except:
-                                pass
-                            imp = traslado.attrib.get("Impuesto", "")
-                            if imp:
-                                impuestos_nombres.add(imp)
-                            if traslado.attrib.get("TasaOCuota") == "0.160000" and traslado.attrib.get("Impuesto") == "002":
-                                traslado_iva_016 = traslado.attrib.get("Importe", "")
-                    else:
-                        for traslado in comp.findall(".//cfdi:Traslado", namespaces=ns):
-                            imp = traslado.attrib.get("Impuesto", "")
-                            if imp:
-                                impuestos_nombres.add(imp)
-                            if traslado.attrib.get("TasaOCuota") == "0.160000" and traslado.attrib.get("Impuesto") == "002":
-                                traslado_iva_016 = traslado.attrib.get("Importe", "")
-
-                    total_retenido = 0.0
-                    for retencion in comp.findall(".//cfdi:Retencion", namespaces=ns):
-                        try:
-                            total_retenido += float(retencion.attrib.get("Importe", "0"))
-                        except:
-                            pass
-
-                    row["Total impuesto Trasladado"] = total_trasladado
-                    row["Nombre Impuesto"] = ", ".join(impuestos_nombres)
-                    row["Total impuesto Retenido"] = total_retenido
-                    row["Traslado IVA 0.160000 %"] = traslado_iva_016
-
-                    # Conceptos
-                    conceptos = comp.findall("cfdi:Conceptos/cfdi:Concepto", namespaces=ns)
-                    lista_conceptos = [f"{c.attrib.get('Descripcion','')}: {c.attrib.get('Importe','')}"
-                                       for c in conceptos]
-                    row["Conceptos"] = "; ".join(lista_conceptos)
-
-                    rows.append(row)
-    return rows
-
-
-def mostrar_sumatorias(df, columnas_sumar):
-    sumas = {}
-    for col in columnas_sumar:
-        sumas[col] = pd.to_numeric(df[col], errors='coerce').sum()
-    return sumas
+            return 0
+        # El índice de la respuesta es la posición de la fila dentro de df_duplicados
+        eliminadas = eliminar_cfdis(tabla, posiciones[filas_seleccionadas.index.astype(int)])
+        st.success(f"Se han eliminado {eliminadas} CFDIs duplicados en {nombre_tabla}.")
+        return eliminadas
+    return 0
+
+def eliminar_cfdis(tabla, posiciones):
+    """
+    Quita de la tabla las filas en las posiciones dadas, junto con sus conceptos y
+    complementos, y reconstruye los índices. Regresa el número de filas eliminadas.
+    """
+    df = st.session_state[tabla]
+    quedan = np.ones(len(df), dtype=bool)
+    quedan[posiciones] = False
+    st.session_state[tabla] = df[quedan].reset_index(drop=True)
+    st.session_state[CLAVES_CONCEPTOS[tabla]] = conceptos_de(obtener_conceptos(tabla), st.session_state[tabla])
+    st.session_state[CLAVES_COMPLEMENTOS[tabla]] = complementos_de(obtener_complementos(tabla),
+                                                                   st.session_state[tabla])
+    reconstruir_indices(tabla)
+    # Las posiciones cambiaron: la grilla paginada debe volver a leer la tabla
+    _nueva_version_ediciones(tabla)
+    return int(len(df) - quedan.sum())
+
+# Índices de la sesión por tabla (se guardan junto a df_recibidos / df_emitidos)
+_CLAVES_INDICE_UUID = {"df_recibidos": "indice_uuid_recibidos", "df_emitidos": "indice_uuid_emitidos"}
+_CLAVES_INDICE_PERIODOS = {"df_recibidos": "indice_periodos_recibidos", "df_emitidos": "indice_periodos_emitidos"}
+_CLAVES_AGREGADOS = {"df_recibidos": "agregados_recibidos", "df_emitidos": "agregados_emitidos"}
+_CLAVES_INDICE_DUPLICADOS = {"df_recibidos": "indice_duplicados_recibidos", "df_emitidos": "indice_duplicados_emitidos"}
+_CLAVES_GRAFO_RELACIONES = {"df_recibidos": "grafo_relaciones_recibidos", "df_emitidos": "grafo_relaciones_emitidos"}
+CLAVES_CONCEPTOS = {"df_recibidos": "conceptos_recibidos", "df_emitidos": "conceptos_emitidos"}
+CLAVES_COMPLEMENTOS = {"df_recibidos": "complementos_recibidos", "df_emitidos": "complementos_emitidos"}
+
+def obtener_indice_uuid(tabla):
+    clave = _CLAVES_INDICE_UUID[tabla]
+    if clave not in st.session_state:
+        st.session_state[clave] = IndiceUUID.desde_df(st.session_state[tabla])
+    return st.session_state[clave]
+
+def obtener_indice_periodos(tabla):
+    clave = _CLAVES_INDICE_PERIODOS[tabla]
+    if clave not in st.session_state:
+        st.session_state[clave] = indice_periodos_desde_df(st.session_state[tabla])
+    return st.session_state[clave]
+
+def obtener_indice_duplicados(tabla):
+    clave = _CLAVES_INDICE_DUPLICADOS[tabla]
+    if clave not in st.session_state:
+        st.session_state[clave] = indice_duplicados_desde_df(st.session_state[tabla])
+    return st.session_state[clave]
+
+def obtener_grafo_relaciones(tabla):
+    clave = _CLAVES_GRAFO_RELACIONES[tabla]
+    if clave not in st.session_state:
+        st.session_state[clave] = GrafoRelaciones.desde_df(st.session_state[tabla],
+                                                           obtener_complementos(tabla).get("pagos_doctos"))
+    return st.session_state[clave]
+
+def obtener_agregados(tabla):
+    clave = _CLAVES_AGREGADOS[tabla]
+    if clave not in st.session_state:
+        st.session_state[clave] = agregados_desde_df(st.session_state[tabla], tabla)
+    return st.session_state[clave]
+
+def reconstruir_indices(tabla):
+    # Necesario cuando la tabla se reemplaza, se editan fechas o se eliminan filas
+    df = st.session_state[tabla]
+    st.session_state[_CLAVES_INDICE_UUID[tabla]] = IndiceUUID.desde_df(df)
+    st.session_state[_CLAVES_INDICE_PERIODOS[tabla]] = indice_periodos_desde_df(df)
+    st.session_state[_CLAVES_AGREGADOS[tabla]] = agregados_desde_df(df, tabla)
+    st.session_state[_CLAVES_INDICE_DUPLICADOS[tabla]] = indice_duplicados_desde_df(df)
+    st.session_state[_CLAVES_GRAFO_RELACIONES[tabla]] = GrafoRelaciones.desde_df(
+        df, obtener_complementos(tabla).get("pagos_doctos"))
+
+def actualizar_bandera(tabla, posiciones, valores):
+    """
+    Asigna la bandera (Deducible/Seleccionar) a las filas en las posiciones dadas y
+    mueve sus montos en los agregados. Sólo se procesan las filas cuyo valor cambia.
+    Regresa el número de filas modificadas.
+    """
+    df = st.session_state[tabla]
+    columna = COLUMNA_BANDERA[tabla]
+    posiciones = np.asarray(posiciones, dtype=np.intp)
+    valores = np.asarray(valores, dtype=df[columna].dtype)
+    anteriores = df[columna].to_numpy()[posiciones]
+    cambia = anteriores != valores
+    if not cambia.any():
+        return 0
+    posiciones, anteriores, valores = posiciones[cambia], anteriores[cambia], valores[cambia]
+    filas = df.iloc[posiciones]
+    obtener_agregados(tabla).mover(filas, calcular_periodo(filas["Fecha"]), anteriores, valores)
+    df.iloc[posiciones, df.columns.get_loc(columna)] = valores
+    return len(posiciones)
+
+def obtener_conceptos(tabla):
+    clave = CLAVES_CONCEPTOS[tabla]
+    if clave not in st.session_state:
+        st.session_state[clave] = conceptos_a_df([])
+    return st.session_state[clave]
+
+def incorporar_conceptos(tabla, conceptos, incorporados):
+    """
+    Agrega a la tabla de conceptos los de los CFDIs que sí se incorporaron (los de CFDIs
+    descartados por UUID duplicado se descartan con ellos). Regresa los agregados.
+    """
+    if conceptos.empty or incorporados.empty:
+        return conceptos.iloc[0:0]
+    claves = set(claves_de_filas(incorporados, np.arange(len(incorporados))))
+    nuevos = conceptos[[c in claves for c in claves_de_filas(conceptos, np.arange(len(conceptos)))]]
+    existentes = obtener_conceptos(tabla)
+    if existentes.empty:
+        st.session_state[CLAVES_CONCEPTOS[tabla]] = nuevos.reset_index(drop=True)
+    else:
+        combinados = pd.concat([existentes, nuevos], ignore_index=True)
+        for col in columnas_categoria_concepto:
+            combinados[col] = combinados[col].astype("category")
+        st.session_state[CLAVES_CONCEPTOS[tabla]] = combinados
+    return nuevos
+
+def obtener_complementos(tabla):
+    # {tabla_lateral: df} (ver complementos.py); sólo las que ya recibieron filas
+    return st.session_state.setdefault(CLAVES_COMPLEMENTOS[tabla], {})
+
+def incorporar_complementos(tabla, complementos, incorporados):
+    """
+    complementos: {tabla_lateral: df}. Igual que incorporar_conceptos: sólo se agregan
+    las filas de los CFDIs que sí se incorporaron.
+    """
+    if incorporados.empty:
+        return
+    # Antes de agregar las filas: si el grafo no existe se arma con las que ya había
+    grafo = obtener_grafo_relaciones(tabla)
+    existentes = obtener_complementos(tabla)
+    for lateral, nuevos in complementos_de(complementos, incorporados).items():
+        if lateral == "pagos_doctos":
+            grafo.agregar(aristas_de_pagos(nuevos))
+        if lateral in existentes:
+            nuevos = pd.concat([existentes[lateral], nuevos], ignore_index=True)
+        existentes[lateral] = nuevos
+
+def mostrar_complementos(tabla, periodo):
+    complementos = obtener_complementos(tabla)
+    if not complementos:
+        return
+    if not st.toggle("Complementos de pago y nómina del periodo", key=f"complementos_{tabla}"):
+        return
+    uuids = uuids_periodo(tabla, periodo)
+    for lateral, df in complementos.items():
+        del_periodo = df[df["UUID"].isin(uuids)]
+        if del_periodo.empty:
+            continue
+        st.markdown(f"**{ESQUEMAS_COMPLEMENTO[lateral]['titulo']}: {len(del_periodo)} en {periodo}**")
+        st.dataframe(del_periodo.drop(columns="XML"), hide_index=True)
+
+def _tabla_aristas(aristas, columna_uuid):
+    return pd.DataFrame({
+        "UUID": [a[columna_uuid] for a in aristas],
+        "Relación": [TIPOS_RELACION.get(a["TipoRelacion"], a["TipoRelacion"]) for a in aristas],
+        "Monto": [a["Monto"] for a in aristas],
+        "Parcialidad": [a["Parcialidad"] for a in aristas],
+    })
+
+def mostrar_relaciones(tabla, periodo):
+    grafo = obtener_grafo_relaciones(tabla)
+    if not len(grafo):
+        return
+    # Sólo se consulta cuando se pide
+    if not st.toggle("Relaciones del periodo (pagos, notas de crédito y sustituciones)", key=f"relaciones_{tabla}"):
+        return
+    ppd = vista_periodo(tabla, periodo, columnas=["UUID", "Fecha", "Serie", "Folio", "Rfc Emisor", "Nombre Emisor",
+                                                  "Rfc Receptor", "Tipo", "Método de Pago", "Total"])
+    ppd = ppd[(ppd["Método de Pago"] == "PPD") & (ppd["Tipo"] == "I")]
+    if ppd.empty:
+        st.caption(f"No hay facturas PPD en {periodo}.")
+    else:
+        saldos = pd.concat([ppd.drop(columns=["Tipo", "Método de Pago"]), grafo.saldos(ppd)], axis=1)
+        pendiente = saldos.loc[saldos["Sustituida por"] == "", "Saldo"].sum()
+        st.markdown(f"**{len(ppd)} facturas PPD en {periodo}; saldo pendiente {pendiente:,.2f}** "
+                    f"(sin contar las sustituidas)")
+        st.dataframe(saldos, hide_index=True)
+    uuid = st.text_input("Consultar un UUID", key=f"uuid_relaciones_{tabla}").strip()
+    if uuid:
+        entrantes, salientes = grafo.de(uuid)
+        if not entrantes and not salientes:
+            st.caption("El UUID no tiene relaciones en esta tabla.")
+        if entrantes:
+            st.markdown("**Lo relacionan (pagos, notas de crédito, sustitutos):**")
+            st.dataframe(_tabla_aristas(entrantes, "UUID"), hide_index=True)
+        if salientes:
+            st.markdown("**Relaciona a:**")
+            st.dataframe(_tabla_aristas(salientes, "UUIDRelacionado"), hide_index=True)
+        cadena = grafo.cadena_sustitucion(uuid)
+        if len(cadena) > 1:
+            st.markdown("**Cadena de sustituciones:** " + " → ".join(cadena))
+
+def resumen_conceptos(conceptos, por="ClaveProdServ"):
+    return conceptos.groupby(por, observed=True).agg(
+        Conceptos=("Importe", "size"),
+        Cantidad=("Cantidad", "sum"),
+        Importe=("Importe", "sum"),
+        Descuento=("Descuento", "sum"),
+        Traslados=("Total Traslados", "sum"),
+        Retenciones=("Total Retenciones", "sum"),
+    ).sort_values("Importe", ascending=False)
+
+def mostrar_resumen_conceptos(tabla, periodo):
+    conceptos = obtener_conceptos(tabla)
+    if conceptos.empty:
+        return
+    # Sólo se calcula cuando se pide: recorre la tabla de conceptos
+    if not st.toggle("Resumen de conceptos del periodo", key=f"conceptos_{tabla}"):
+        return
+    por = st.selectbox("Agrupar por", ["ClaveProdServ", "Descripcion", "ClaveUnidad", "NoIdentificacion"],
+                       key=f"conceptos_por_{tabla}")
+    del_periodo = conceptos[conceptos["UUID"].isin(uuids_periodo(tabla, periodo))]
+    st.markdown(f"**{len(del_periodo)} conceptos en {periodo}**")
+    st.dataframe(resumen_conceptos(del_periodo, por))
+
+def aplicar_cambios(tabla, cambios):
+    """
+    cambios: {posición: {columna: valor}} (ver grilla_paginada). La bandera se mueve en
+    los agregados por diferencias; si cambia el UUID, la Fecha, un monto agregado, una
+    columna de las claves de duplicados o las relaciones se reconstruyen los índices. Regresa el número de celdas modificadas.
+    """
+    if not cambios:
+        return 0
+    df = st.session_state[tabla]
+    columna_bandera = COLUMNA_BANDERA[tabla]
+    por_columna = {}
+    for posicion, celdas in cambios.items():
+        for col, valor in celdas.items():
+            posiciones, valores = por_columna.setdefault(col, ([], []))
+            posiciones.append(posicion)
+            valores.append(valor)
+    modificadas = 0
+    reconstruir = False
+    # Columnas de los agregados: las del resumen más las de impuestos que traiga la tabla
+    columnas_agregadas = set(obtener_agregados(tabla).columnas)
+    for col, (posiciones, valores) in por_columna.items():
+        if col == columna_bandera:
+            modificadas += actualizar_bandera(tabla, posiciones, valores)
+            continue
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            nuevas = {v for v in valores if v is not None} - set(df[col].cat.categories)
+            if nuevas:
+                df[col] = df[col].cat.add_categories(sorted(nuevas))
+        df.iloc[posiciones, df.columns.get_loc(col)] = valores
+        modificadas += len(posiciones)
+        reconstruir = (reconstruir or col in ("UUID", "Fecha", "Relacionados", "Tipo Relación")
+                       or col in columnas_agregadas or col in columnas_duplicados)
+    if reconstruir:
+        reconstruir_indices(tabla)
+    return modificadas
+
+def obtener_bitacora_ediciones():
+    if "bitacora_ediciones" not in st.session_state:
+        st.session_state.bitacora_ediciones = BitacoraEdiciones()
+    return st.session_state.bitacora_ediciones
+
+def version_ediciones(tabla):
+    # Cambia cuando la tabla se modifica por fuera de la grilla (deshacer, reproducir)
+    return st.session_state.setdefault("version_ediciones", {}).get(tabla, 0)
+
+def _nueva_version_ediciones(tabla):
+    versiones = st.session_state.setdefault("version_ediciones", {})
+    versiones[tabla] = versiones.get(tabla, 0) + 1
+
+def editar_celdas(tabla, cambios):
+    """
+    Aplica los cambios de la grilla ({posición: {columna: valor}}) y los registra como
+    un lote en la bitácora de ediciones. El costo depende sólo de las celdas cambiadas.
+    """
+    if not cambios:
+        return 0
+    with medir("aplicar ediciones", filas=len(cambios)):
+        df = st.session_state[tabla]
+        posiciones = list(cambios)
+        celdas = [
+            (clave, posicion, col, df.iat[posicion, df.columns.get_loc(col)], nuevo)
+            for posicion, clave in zip(posiciones, claves_de_filas(df, posiciones))
+            for col, nuevo in cambios[posicion].items()
+        ]
+        modificadas = aplicar_cambios(tabla, cambios)
+        obtener_bitacora_ediciones().registrar(tabla, celdas)
+    return modificadas
+
+def _cambios_por_clave(tabla, celdas):
+    """
+    celdas: [(clave, posición registrada, columna, valor JSON), ...] -> cambios por
+    posición actual. Se usa la posición registrada si la fila sigue ahí; si no, se busca
+    la clave en toda la tabla. Las celdas posteriores ganan.
+    """
+    df = st.session_state[tabla]
+    if df.empty:
+        return {}
+    posiciones = np.array([c[1] for c in celdas], dtype=np.intp)
+    validas = posiciones < len(df)
+    claves_actuales = claves_de_filas(df, posiciones[validas])
+    claves_actuales = iter(claves_actuales)
+    mapa = None
+    por_columna = {}
+    for (clave, posicion, col, valor), valida in zip(celdas, validas):
+        if not (valida and next(claves_actuales) == clave):
+            if mapa is None:
+                mapa = dict(zip(claves_de_filas(df, np.arange(len(df))), range(len(df))))
+            posicion = mapa.get(clave)
+            if posicion is None:
+                continue
+        if col in df.columns:
+            por_columna.setdefault(col, {})[posicion] = valor
+    cambios = {}
+    for col, valores in por_columna.items():
+        convertidos = convertir_a_tipo_de(pd.Series(list(valores.values()), dtype=object), df[col])
+        for posicion, valor in zip(valores, convertidos):
+            cambios.setdefault(posicion, {})[col] = None if pd.isna(valor) else valor
+    return cambios
+
+def deshacer_edicion(tabla):
+    """
+    Revierte el último lote de ediciones de la tabla y lo registra como un lote nuevo.
+    Regresa el número de celdas revertidas.
+    """
+    bitacora = obtener_bitacora_ediciones()
+    lote = bitacora.ultimo_lote(tabla)
+    if lote is None:
+        return 0
+    entradas = bitacora.entradas_de(lote)
+    cambios = _cambios_por_clave(tabla, [(e["clave"], e["posicion"], e["columna"], e["anterior"])
+                                         for e in reversed(entradas)])
+    modificadas = aplicar_cambios(tabla, cambios)
+    bitacora.registrar(tabla, [(e["clave"], e["posicion"], e["columna"], e["nuevo"], e["anterior"])
+                               for e in entradas], deshace=lote)
+    _nueva_version_ediciones(tabla)
+    return modificadas
+
+def reproducir_ediciones(tabla, entradas):
+    """
+    Vuelve a aplicar entradas de la bitácora (p. ej. las de un avance cargado) sobre la
+    tabla actual, localizando las filas por clave. No registra lotes nuevos.
+    """
+    entradas = [e for e in entradas if e["tabla"] == tabla]
+    if not entradas:
+        return 0
+    cambios = _cambios_por_clave(tabla, [(e["clave"], e["posicion"], e["columna"], e["nuevo"])
+                                         for e in entradas])
+    modificadas = aplicar_cambios(tabla, cambios)
+    _nueva_version_ediciones(tabla)
+    return modificadas
+
+def importar_ediciones(entradas):
+    """
+    Agrega a la bitácora las ediciones de un avance cargado y reaplica las vigentes, por
+    si sus filas ya estaban en la sesión (las duplicadas no se vuelven a incorporar).
+    """
+    if not entradas:
+        return
+    bitacora = obtener_bitacora_ediciones()
+    lotes = {e["lote"] for e in bitacora.importar(entradas)}
+    for tabla in COLUMNA_BANDERA:
+        reproducir_ediciones(tabla, [e for e in bitacora.efectivas(tabla) if e["lote"] in lotes])
+
+def mostrar_bitacora_ediciones(tabla):
+    bitacora = obtener_bitacora_ediciones()
+    entradas = bitacora.entradas_tabla(tabla)
+    if not entradas:
+        return
+    # Se muestra antes de la grilla para que ésta ya refleje lo revertido
+    if bitacora.ultimo_lote(tabla) is not None and st.button("Deshacer última edición", key=f"deshacer_{tabla}"):
+        revertidas = deshacer_edicion(tabla)
+        st.success(f"Se revirtieron {revertidas} celdas.")
+    with st.expander(f"Historial de ediciones ({len(entradas)})"):
+        st.dataframe(pd.DataFrame(entradas[-200:]).drop(columns="tabla"))
+
+# Vistas de la sesión: se sirven por posiciones sobre st.session_state[tabla] y sólo se
+# materializan las filas y columnas que se van a mostrar o exportar; no se guardan.
+def posiciones_periodo(tabla, periodo, bandera=None):
+    """
+    Posiciones (iloc) de las filas del periodo; con bandera, sólo las que la tienen en
+    ese valor (Deducible/Seleccionar).
+    """
+    posiciones = obtener_indice_periodos(tabla).filas(periodo)
+    if bandera is not None:
+        banderas = st.session_state[tabla][COLUMNA_BANDERA[tabla]].to_numpy()
+        posiciones = posiciones[banderas[posiciones] == bandera]
+    return posiciones
+
+def vista_periodo(tabla, periodo, bandera=None, columnas=None):
+    df = st.session_state[tabla]
+    posiciones = posiciones_periodo(tabla, periodo, bandera)
+    if columnas is not None:
+        return df.iloc[posiciones, df.columns.get_indexer(columnas)]
+    vista = df.take(posiciones)
+    vista["Periodo"] = periodo
+    return vista
+
+def uuids_periodo(tabla, periodo):
+    return st.session_state[tabla]["UUID"].to_numpy()[posiciones_periodo(tabla, periodo)]
+
+def fijar_tabla_actual(tabla, periodo):
+    # La "Tabla Actual" de las exportaciones se guarda como el periodo en pantalla
+    st.session_state.setdefault("tabla_actual", {})[tabla] = periodo
+
+def tabla_actual(tabla):
+    """
+    Regresa las filas del periodo fijado con fijar_tabla_actual, o toda la tabla si no
+    hay uno (o ya no existe).
+    """
+    periodo = st.session_state.get("tabla_actual", {}).get(tabla)
+    if periodo is None or not len(posiciones_periodo(tabla, periodo)):
+        return st.session_state[tabla]
+    return vista_periodo(tabla, periodo)
+
+def incorporar_cfdis(tabla, nuevo_df):
+    """
+    Agrega a st.session_state[tabla] los CFDIs de nuevo_df cuyo UUID no existe todavía
+    y actualiza los índices de UUIDs y de periodos y los agregados por bandera.
+    Regresa las filas agregadas.
+    """
+    indice = obtener_indice_uuid(tabla)
+    indice_periodos = obtener_indice_periodos(tabla)
+    indice_duplicados = obtener_indice_duplicados(tabla)
+    grafo = obtener_grafo_relaciones(tabla)
+    agregados = obtener_agregados(tabla)
+    nuevo_df = filtrar_duplicados_por_uuid(nuevo_df, st.session_state[tabla], "UUID", indice)
+    if nuevo_df.empty:
+        return nuevo_df
+    sin_uuid = sum(not es_uuid_valido(u) for u in nuevo_df["UUID"])
+    if sin_uuid:
+        st.warning(f"{sin_uuid} CFDIs no tienen UUID; se agregan sin compararse como duplicados.")
+    desplazamiento = len(st.session_state[tabla])
+    st.session_state[tabla] = concatenar_cfdis(st.session_state[tabla], nuevo_df)
+    periodos = calcular_periodo(nuevo_df["Fecha"])
+    indice.agregar(nuevo_df["UUID"])
+    indice_periodos.agregar(periodos, desplazamiento)
+    indice_duplicados.agregar(nuevo_df, desplazamiento)
+    grafo.agregar(aristas_de_filas(nuevo_df))
+    if columnas_resumen(st.session_state[tabla]) != agregados.columnas:
+        # Llegó una combinación de impuestos nueva: los agregados se rehacen con su columna
+        st.session_state[_CLAVES_AGREGADOS[tabla]] = agregados_desde_df(st.session_state[tabla], tabla)
+    else:
+        agregados.agregar(nuevo_df, periodos, COLUMNA_BANDERA[tabla])
+    return nuevo_df
+
+def mostrar_errores_extraccion(errores, max_avisos=5):
+    # Pocos errores se muestran uno por uno; muchos, en una tabla
+    if len(errores) <= max_avisos:
+        for error in errores:
+            st.warning(f"Error al leer {describir_error(error)}")
+        return
+    st.warning(f"{len(errores)} archivos no se pudieron leer.")
+    with st.expander("Archivos con error"):
+        st.dataframe(pd.DataFrame([
+            {"Archivo": e["archivo"], "Motivo": e["motivo"],
+             "Línea": e["posicion"][0] if e["posicion"] else None,
+             "Columna": e["posicion"][1] if e["posicion"] else None}
+            for e in errores
+        ]))
+
+def describir_versiones(versiones):
+    # {"4.0": n, "3.3": n} -> "4.0: n, 3.3: n", la versión más reciente primero
+    return ", ".join(f"{version}: {n}" for version, n in sorted(versiones.items(), reverse=True))
+
+def mostrar_resumen_cache(resultado):
+    if resultado["aciertos_cache"] or resultado["fallos_cache"]:
+        st.caption(f"Caché de XMLs: {resultado['aciertos_cache']} aciertos, "
+                   f"{resultado['fallos_cache']} por parsear.")
+
+
+# Bitácora de ingesta: ZIPs ya incorporados en la sesión, por RFC y contenido (el reparto
+# depende del RFC). El file_id del uploader evita volver a calcular el hash del ZIP en
+# cada rerun.
+def _clave_ingesta(rfc, uploaded_file):
+    ids = st.session_state.setdefault("ids_ingesta", {})
+    if uploaded_file.file_id not in ids:
+        ids[uploaded_file.file_id] = clave_contenido(uploaded_file.getvalue())
+    return f"{rfc}:{ids[uploaded_file.file_id]}"
+
+def incorporar_por_tabla(tablas, conceptos, complementos):
+    """
+    tablas: {"df_recibidos": df, "df_emitidos": df} (ver clasificar_por_rfc). Incorpora
+    cada parte a su tabla con la bandera encendida, junto con sus conceptos y sus
+    complementos ({tabla_lateral: df}). Regresa los CFDIs agregados por tabla.
+    """
+    agregados = {}
+    for tabla, df in tablas.items():
+        agregados[tabla] = 0
+        if df.empty:
+            continue
+        df = df.assign(**{COLUMNA_BANDERA[tabla]: True})
+        nuevos = incorporar_cfdis(tabla, df)
+        incorporar_conceptos(tabla, conceptos, nuevos)
+        incorporar_complementos(tabla, complementos, nuevos)
+        agregados[tabla] = len(nuevos)
+    return agregados
+
+# Cuarentena: CFDIs en los que la empresa no es emisor ni receptor. No entran a ninguna
+# tabla; se pueden reclasificar (p. ej. si el RFC estaba mal escrito) o descartar.
+def obtener_cuarentena():
+    if "cuarentena" not in st.session_state:
+        descartar_cuarentena()
+    return st.session_state.cuarentena
+
+def poner_en_cuarentena(ajenos, conceptos, complementos):
+    # Regresa cuántos CFDIs entraron (los UUIDs que ya estaban no se repiten)
+    cuarentena = obtener_cuarentena()
+    ajenos, _ = eliminar_duplicados_en_df(ajenos, "UUID")
+    ajenos = filtrar_duplicados_por_uuid(ajenos, cuarentena, "UUID")
+    if ajenos.empty:
+        return 0
+    nuevos = conceptos_de(conceptos, ajenos)
+    if cuarentena.empty:
+        st.session_state.conceptos_cuarentena = nuevos
+    else:
+        combinados = pd.concat([st.session_state.conceptos_cuarentena, nuevos], ignore_index=True)
+        for col in columnas_categoria_concepto:
+            combinados[col] = combinados[col].astype("category")
+        st.session_state.conceptos_cuarentena = combinados
+    for lateral, filas in complementos_de(complementos, ajenos).items():
+        anteriores = st.session_state.complementos_cuarentena.get(lateral)
+        if anteriores is not None:
+            filas = pd.concat([anteriores, filas], ignore_index=True)
+        st.session_state.complementos_cuarentena[lateral] = filas
+    st.session_state.cuarentena = concatenar_cfdis(cuarentena, ajenos)
+    return len(ajenos)
+
+def reclasificar_cuarentena(rfc):
+    """
+    Vuelve a repartir la cuarentena con el RFC dado; los CFDIs que siguen siendo ajenos
+    se quedan en ella. Regresa los CFDIs agregados por tabla.
+    """
+    tablas, ajenos = clasificar_por_rfc(obtener_cuarentena(), rfc)
+    conceptos = st.session_state.conceptos_cuarentena
+    complementos = st.session_state.complementos_cuarentena
+    agregados = incorporar_por_tabla(tablas, conceptos, complementos)
+    st.session_state.cuarentena = ajenos
+    st.session_state.conceptos_cuarentena = conceptos_de(conceptos, ajenos)
+    st.session_state.complementos_cuarentena = complementos_de(complementos, ajenos)
+    return agregados
+
+def descartar_cuarentena():
+    st.session_state.cuarentena = pd.DataFrame()
+    st.session_state.conceptos_cuarentena = conceptos_a_df([])
+    st.session_state.complementos_cuarentena = {}
+
+def mostrar_cuarentena(company_rfc):
+    cuarentena = obtener_cuarentena()
+    if cuarentena.empty:
+        return
+    with st.expander(f"CFDIs en cuarentena ({len(cuarentena)})"):
+        st.caption("La empresa no es emisor ni receptor de estos CFDIs; no se agregaron a ninguna tabla.")
+        col1, col2 = st.columns(2)
+        if col1.button(f"Reclasificar con el RFC {company_rfc.strip().upper()}", key="reclasificar_cuarentena"):
+            agregados = reclasificar_cuarentena(company_rfc)
+            st.success(f"{agregados['df_recibidos']} CFDIs pasaron a Recibidos y "
+                       f"{agregados['df_emitidos']} a Emitidos.")
+        if col2.button("Descartar la cuarentena", key="descartar_cuarentena"):
+            descartar_cuarentena()
+        cuarentena = obtener_cuarentena()
+        if not cuarentena.empty:
+            st.dataframe(cuarentena[["XML", "UUID", "Fecha", "Rfc Emisor", "Nombre Emisor",
+                                     "Rfc Receptor", "Nombre Receptor", "Total"]], hide_index=True)
+
+def ingerir_zip(uploaded_file, company_rfc):
+    """
+    Procesa el ZIP subido una sola vez y reparte sus CFDIs por RFC: los que emite la
+    empresa van a Emitidos, los que recibe a Recibidos y los demás a la cuarentena.
+    Mientras el archivo siga en el uploader, los reruns consultan la bitácora y no
+    vuelven a leerlo.
+    """
+    rfc = company_rfc.strip().upper()
+    bitacora = st.session_state.setdefault("bitacora_ingesta", {})
+    clave = _clave_ingesta(rfc, uploaded_file)
+    registro = bitacora.get(clave)
+    if registro is not None:
+        st.caption(f"{registro['archivo']} ya se procesó en {registro['segundos']:.1f} s: "
+                   f"{registro['Recibidos']} CFDIs a Recibidos, {registro['Emitidos']} a Emitidos y "
+                   f"{registro['Cuarentena']} en cuarentena de {registro['xml']} XMLs.")
+        if not st.button("Volver a procesar el ZIP", key="reprocesar_zip"):
+            return
+        del bitacora[clave]
+
+    inicio = time.perf_counter()
+    conteos = {"Recibidos": 0, "Emitidos": 0, "Cuarentena": 0}
+    with medir("ingesta ZIP") as span:
+        uploaded_file.seek(0)
+        resultado = procesar_zip(uploaded_file, st.session_state.get("num_procesos", 1), cache=obtener_cache())
+        mostrar_errores_extraccion(resultado["errores"])
+        mostrar_resumen_cache(resultado)
+        rows = resultado["filas"]
+        if resultado["versiones"]:
+            st.caption(f"CFDIs por versión: {describir_versiones(resultado['versiones'])}")
+        if rows:
+            with medir("aplicar_esquema", filas=len(rows)):
+                new_df = aplicar_esquema(pd.DataFrame(rows))
+                conceptos = conceptos_a_df(resultado["conceptos"])
+                complementos = complementos_a_df(resultado["complementos"])
+            with medir("clasificar por RFC", filas=len(rows)):
+                tablas, ajenos = clasificar_por_rfc(new_df, rfc)
+            with medir("incorporar_cfdis", filas=len(rows)):
+                agregados = incorporar_por_tabla(tablas, conceptos, complementos)
+                conteos["Recibidos"] = agregados["df_recibidos"]
+                conteos["Emitidos"] = agregados["df_emitidos"]
+                conteos["Cuarentena"] = poner_en_cuarentena(ajenos, conceptos, complementos)
+            if conteos["Recibidos"] or conteos["Emitidos"]:
+                st.success(f"Se han cargado {conteos['Recibidos']} CFDIs Recibidos y "
+                           f"{conteos['Emitidos']} CFDIs Emitidos.")
+            elif not len(ajenos):
+                st.info("Todos los CFDIs en el ZIP ya existen (UUIDs duplicados).")
+            if len(ajenos):
+                st.warning(f"{len(ajenos)} CFDIs no tienen a {rfc} como emisor ni receptor; "
+                           f"quedaron en cuarentena.")
+        else:
+            st.info("No se encontraron archivos XML en el ZIP.")
+        span.filas = len(rows)
+    bitacora[clave] = {
+        "archivo": uploaded_file.name, "rfc": rfc, "xml": len(rows),
+        "versiones": describir_versiones(resultado["versiones"]), **conteos,
+        "segundos": time.perf_counter() - inicio, "fecha": datetime.now().isoformat(timespec="seconds"),
+    }
+
+def mostrar_carga_zip(company_rfc):
+    # Un solo uploader para las dos secciones: el ZIP puede traer emitidos y recibidos
+    uploaded_file = st.file_uploader("Cargar archivo ZIP con XMLs (emitidos y recibidos)", type=["zip"],
+                                     key="zip_cfdis")
+    if uploaded_file is not None:
+        ingerir_zip(uploaded_file, company_rfc)
+    mostrar_bitacora_ingesta()
+    mostrar_cuarentena(company_rfc)
+
+# Diagnóstico: spans de instrumentación de la sesión (ver instrumentacion.py)
+def obtener_registro_instrumentacion():
+    if "registro_instrumentacion" not in st.session_state:
+        st.session_state.registro_instrumentacion = RegistroInstrumentacion()
+    return st.session_state.registro_instrumentacion
+
+def iniciar_instrumentacion():
+    """
+    Se llama al inicio de cada corrida del script: activa el registro sólo si el panel
+    de diagnóstico está encendido.
+    """
+    if st.sidebar.toggle("Diagnóstico de rendimiento", key="diagnostico"):
+        registro = obtener_registro_instrumentacion()
+        registro.nueva_corrida()
+        activar(registro)
+    else:
+        activar(None)
+
+def mostrar_panel_diagnostico():
+    # Al final de la corrida, para que incluya sus spans
+    if not st.session_state.get("diagnostico"):
+        return
+    registro = obtener_registro_instrumentacion()
+    with st.sidebar.expander("Diagnóstico", expanded=True):
+        spans = registro.de_corrida()
+        if spans:
+            st.dataframe(pd.DataFrame([{
+                "Etapa": " " * s.nivel + s.etapa,
+                "Segundos": round(s.segundos, 3),
+                "Filas": s.filas,
+                "Memoria (MiB)": None if s.memoria_mib is None else round(s.memoria_mib, 1),
+                "Detalle": ", ".join(f"{k} {v:.3f} s" for k, v in s.detalle.items()),
+            } for s in spans]), hide_index=True)
+        else:
+            st.caption("Sin etapas medidas en esta corrida.")
+        st.caption(f"Corrida {registro.corrida} · {len(registro.spans)} spans guardados")
+        st.download_button("Descargar JSON", data=registro.a_json(), file_name="diagnostico.json",
+                           mime="application/json")
+        if st.button("Limpiar", key="limpiar_diagnostico"):
+            registro.limpiar()
+
+# Memoria de la sesión: lo que ocupan sus DataFrames contra un presupuesto en MiB
+PRESUPUESTO_MEMORIA_MIB_DEFAULT = int(os.environ.get("CONTABILIZA2_PRESUPUESTO_MIB", 1024))
+
+def _dataframes_sesion():
+    # componente -> DataFrames que lo forman
+    componentes = {}
+    for tabla, nombre in [("df_recibidos", "Recibidos"), ("df_emitidos", "Emitidos")]:
+        componentes[nombre] = [st.session_state[tabla]]
+        componentes[f"Conceptos {nombre}"] = [obtener_conceptos(tabla)]
+        componentes[f"Complementos {nombre}"] = list(obtener_complementos(tabla).values())
+    componentes["Cuarentena"] = [obtener_cuarentena(), st.session_state.conceptos_cuarentena,
+                                 *st.session_state.complementos_cuarentena.values()]
+    return componentes
+
+def memoria_sesion():
+    """
+    Regresa {componente: bytes} de los DataFrames de la sesión. memory_usage(deep=True)
+    recorre las cadenas, así que el resultado de cada DataFrame se recuerda mientras sea
+    el mismo objeto, con la misma forma y sin ediciones nuevas.
+    """
+    anteriores = st.session_state.get("memoria_dataframes", {})
+    ediciones = len(obtener_bitacora_ediciones().entradas)
+    medidos = {}
+    resultado = {}
+    for componente, dfs in _dataframes_sesion().items():
+        total = 0
+        for df in dfs:
+            firma = (df.shape, ediciones)
+            previo = anteriores.get(id(df))
+            if previo is None or previo[0] != firma:
+                previo = (firma, int(df.memory_usage(deep=True).sum()))
+            medidos[id(df)] = previo
+            total += previo[1]
+        resultado[componente] = total
+    st.session_state.memoria_dataframes = medidos
+    return resultado
+
+def mostrar_memoria_sesion():
+    presupuesto = st.sidebar.number_input("Presupuesto de memoria por sesión (MiB)", min_value=64, max_value=65536,
+                                          value=PRESUPUESTO_MEMORIA_MIB_DEFAULT, step=64, key="presupuesto_memoria")
+    with medir("memoria de la sesión"):
+        componentes = memoria_sesion()
+    total = sum(componentes.values()) / 2**20
+    mensaje = f"Memoria de la sesión: {total:,.1f} de {presupuesto:,} MiB"
+    if total > presupuesto:
+        st.sidebar.warning(f"{mensaje}. Guarde el avance y descarte la cuarentena o cargue menos periodos.")
+    else:
+        st.sidebar.caption(mensaje)
+    with st.sidebar.expander("Memoria por componente"):
+        st.dataframe(pd.DataFrame({
+            "Componente": list(componentes),
+            "MiB": [round(b / 2**20, 1) for b in componentes.values()],
+        }), hide_index=True)
+
+def mostrar_bitacora_ingesta():
+    registros = list(st.session_state.get("bitacora_ingesta", {}).values())
+    if registros:
+        with st.expander("Historial de cargas"):
+            st.dataframe(pd.DataFrame(registros))
+
+
+def mostrar_sumatorias(df, columnas_sumar=None):
+    # Las columnas de montos ya son float64 (ver aplicar_esquema)
+    if columnas_sumar is None:
+        columnas_sumar = columnas_resumen(df)
+    return df[columnas_sumar].sum().to_dict()
 
 def mostrar_tabla_seccion(df, titulo, ancho=2500):
     st.subheader(titulo)
@@ -271,11 +883,10 @@ def exportar_datos(df_recibidos, df_emitidos, formato="Excel"):
         file_name = "CFDIs_Fiscales.xlsx"
 
     elif formato == "CSV":
-        df_recibidos_export = df_recibidos.copy()
-        df_emitidos_export = df_emitidos.copy()
-        df_recibidos_export.insert(0, "Tipo", "Recibidos")
-        df_emitidos_export.insert(0, "Tipo", "Emitidos")
-        df_combined = pd.concat([df_recibidos_export, df_emitidos_export])
+        # La columna Tabla sale de las claves del concat (sin copias previas de cada tabla);
+        # no se llama Tipo para no chocar con el TipoDeComprobante de las filas
+        df_combined = pd.concat({"Recibidos": df_recibidos, "Emitidos": df_emitidos},
+                                names=["Tabla"]).reset_index(level=0)
         output.write(df_combined.to_csv(index=False).encode("utf-8"))
         mime = "text/csv"
         file_name = "CFDIs_Fiscales.csv"
@@ -0,0 +1,147 @@
+import numpy as np
+import pandas as pd
+import streamlit as st
+from st_aggrid import AgGrid, GridOptionsBuilder, DataReturnMode, GridUpdateMode
+
+from ediciones import convertir_a_tipo_de
+from instrumentacion import medir
+
+# Grilla paginada: el orden y el filtro se resuelven aquí sobre el DataFrame y al
+# navegador sólo viaja la página visible. Cada fila lleva su posición en la tabla
+# (columna oculta COLUMNA_FILA) para que las ediciones regresen como cambios por fila.
+
+COLUMNA_FILA = "__fila"
+TAMANOS_PAGINA = [50, 100, 250, 500]
+_SIN_ORDEN = "(orden original)"
+_TODAS = "(todas)"
+
+
+def ordenar_y_filtrar(df, filas, columna_orden=None, descendente=False, columna_filtro=None, texto=""):
+    """
+    filas: posiciones (iloc) del periodo. Regresa las posiciones que pasan el filtro,
+    en el orden pedido. El filtro es "contiene" sin distinguir mayúsculas; sin
+    columna_filtro se busca en todas las columnas de texto.
+    """
+    filas = np.asarray(filas, dtype=np.intp)
+    if texto:
+        vista = df.iloc[filas]
+        columnas = [columna_filtro] if columna_filtro else [
+            col for col in vista.columns
+            if pd.api.types.is_object_dtype(vista[col]) or isinstance(vista[col].dtype, pd.CategoricalDtype)
+        ]
+        mascara = np.zeros(len(filas), dtype=bool)
+        for col in columnas:
+            mascara |= vista[col].astype(str).str.contains(texto, case=False, regex=False).to_numpy()
+        filas = filas[mascara]
+    if columna_orden:
+        valores = df[columna_orden].iloc[filas]
+        if isinstance(valores.dtype, pd.CategoricalDtype):
+            valores = valores.astype(object)
+        # sort_values deja los vacíos al final y es estable
+        orden = valores.reset_index(drop=True).sort_values(ascending=not descendente, kind="stable").index
+        filas = filas[orden.to_numpy()]
+    return filas
+
+
+def diferencias_pagina(pagina, datos_grid):
+    """
+    Compara lo que regresó la grilla contra la página enviada. Regresa
+    {posición en la tabla: {columna: valor nuevo}} sólo con las celdas que cambiaron.
+    """
+    # Sin ediciones AgGrid regresa el mismo DataFrame que se le envió
+    if datos_grid is None or datos_grid is pagina or datos_grid.empty or COLUMNA_FILA not in datos_grid.columns:
+        return {}
+    datos_grid = datos_grid.set_index(pd.to_numeric(datos_grid[COLUMNA_FILA]).astype(np.intp))
+    origen = pagina.set_index(COLUMNA_FILA).reindex(datos_grid.index)
+    cambios = {}
+    for col in origen.columns:
+        if col not in datos_grid.columns:
+            continue
+        nuevos = convertir_a_tipo_de(datos_grid[col], origen[col])
+        anteriores = origen[col]
+        if isinstance(anteriores.dtype, pd.CategoricalDtype):
+            anteriores = anteriores.astype(object)
+        if pd.api.types.is_float_dtype(anteriores):
+            # Los flotantes viajan en JSON con 10 decimales
+            iguales = np.isclose(nuevos.to_numpy(dtype=float), anteriores.to_numpy(dtype=float),
+                                 rtol=1e-12, atol=1e-9, equal_nan=True)
+        else:
+            iguales = (nuevos == anteriores) | (nuevos.isna() & anteriores.isna())
+        distintos = ~np.asarray(iguales, dtype=bool)
+        for fila, valor in nuevos[distintos].items():
+            cambios.setdefault(int(fila), {})[col] = None if pd.isna(valor) else valor
+    return cambios
+
+
+def mostrar_grilla_paginada(df, filas, columna_bandera, key, version=0):
+    """
+    Muestra las filas (posiciones iloc de df) en una grilla paginada con orden y filtro
+    del lado del servidor. Regresa {"cambios", "filas", "pagina"}: los cambios por fila,
+    las posiciones que pasan el filtro (en orden) y las de la página visible.
+
+    version se incrementa cuando la tabla cambia por fuera de la grilla (p. ej. al
+    deshacer): así la grilla se vuelve a crear y no reenvía sus ediciones anteriores.
+    """
+    columnas = [col for col in df.columns if col != COLUMNA_FILA]
+    c1, c2, c3, c4 = st.columns([2, 1, 2, 2])
+    with c1:
+        columna_orden = st.selectbox("Ordenar por", [_SIN_ORDEN] + columnas, key=f"{key}_orden")
+    with c2:
+        descendente = st.checkbox("Descendente", key=f"{key}_desc")
+    with c3:
+        columna_filtro = st.selectbox("Filtrar en", [_TODAS] + columnas, key=f"{key}_col_filtro")
+    with c4:
+        texto = st.text_input("Contiene", key=f"{key}_texto")
+    visibles = st.multiselect("Columnas visibles", columnas, default=columnas, key=f"{key}_visibles")
+    if columna_bandera in columnas and columna_bandera not in visibles:
+        visibles = [columna_bandera] + visibles
+
+    with medir("grilla: orden y filtro", filas=len(filas)):
+        filtradas = ordenar_y_filtrar(
+            df, filas,
+            columna_orden=None if columna_orden == _SIN_ORDEN else columna_orden,
+            descendente=descendente,
+            columna_filtro=None if columna_filtro == _TODAS else columna_filtro,
+            texto=texto,
+        )
+
+    c1, c2, c3 = st.columns([1, 1, 4])
+    with c1:
+        tamano = st.selectbox("Filas por página", TAMANOS_PAGINA, index=1, key=f"{key}_tamano")
+    total_paginas = max(1, -(-len(filtradas) // tamano))
+    with c2:
+        numero = st.number_input("Página", min_value=1, max_value=total_paginas, value=1, step=1,
+                                 key=f"{key}_pagina")
+    with c3:
+        st.caption(f"{len(filtradas)} filas · página {numero} de {total_paginas}")
+    numero = min(int(numero), total_paginas)
+    posiciones = filtradas[(numero - 1) * tamano:numero * tamano]
+
+    pagina = df.iloc[posiciones][visibles].assign(**{COLUMNA_FILA: posiciones})
+    gb = GridOptionsBuilder.from_dataframe(pagina)
+    gb.configure_default_column(editable=True, resizable=True, sortable=False, filter=False)
+    if columna_bandera in visibles:
+        gb.configure_column(columna_bandera, editable=True, cellEditor='agCheckboxCellEditor', pinned=True)
+    gb.configure_column(COLUMNA_FILA, hide=True, editable=False)
+    gridOptions = gb.build()
+
+    # La key cambia con la página, el orden y el filtro: una grilla nueva no arrastra
+    # ediciones de otra página
+    firma = hash((columna_orden, descendente, columna_filtro, texto, tamano, numero, tuple(visibles), version))
+    with medir("grilla: AgGrid", filas=len(pagina)):
+        grid_response = AgGrid(
+            pagina,
+            gridOptions=gridOptions,
+            data_return_mode=DataReturnMode.AS_INPUT,
+            update_mode=GridUpdateMode.VALUE_CHANGED,
+            height=600,
+            width=2500,
+            key=f"{key}_grilla_{firma}"
+        )
+    with medir("grilla: diferencias", filas=len(pagina)):
+        cambios = diferencias_pagina(pagina, grid_response["data"])
+    return {
+        "cambios": cambios,
+        "filas": filtradas,
+        "pagina": posiciones,
+    }
@@ -0,0 +1,261 @@
+import numpy as np
+import pandas as pd
+
+
+def es_uuid_valido(uuid):
+    return isinstance(uuid, str) and uuid != ""
+
+
+class IndiceUUID:
+    """
+    Conteo de UUIDs de una tabla de CFDIs, actualizado al agregar o eliminar filas
+    para que revisar un lote nuevo cueste lo que mide el lote y no todo el historial.
+
+    Las filas sin UUID no se indexan: nunca se consideran duplicadas entre sí.
+    """
+    def __init__(self):
+        self.conteos = {}
+        self.repetidos = set()
+        self.sin_uuid = 0
+
+    @classmethod
+    def desde_df(cls, df, uuid_col="UUID"):
+        indice = cls()
+        if uuid_col in df.columns:
+            indice.agregar(df[uuid_col])
+        return indice
+
+    def __contains__(self, uuid):
+        return uuid in self.conteos
+
+    def __len__(self):
+        return len(self.conteos)
+
+    def agregar(self, uuids):
+        conteos = self.conteos
+        for uuid in uuids:
+            if not es_uuid_valido(uuid):
+                self.sin_uuid += 1
+                continue
+            n = conteos.get(uuid, 0) + 1
+            conteos[uuid] = n
+            if n == 2:
+                self.repetidos.add(uuid)
+
+    def quitar(self, uuids):
+        conteos = self.conteos
+        for uuid in uuids:
+            if not es_uuid_valido(uuid):
+                self.sin_uuid -= 1
+                continue
+            n = conteos.get(uuid, 0) - 1
+            if n <= 0:
+                conteos.pop(uuid, None)
+            else:
+                conteos[uuid] = n
+            if n < 2:
+                self.repetidos.discard(uuid)
+
+    def mascara_nuevos(self, uuids):
+        """
+        Lista de bool: True para los UUID que no están en el índice (o que no traen UUID).
+        """
+        conteos = self.conteos
+        return [not es_uuid_valido(uuid) or uuid not in conteos for uuid in uuids]
+
+
+class IndicePeriodos:
+    """
+    Periodo ("AAAA-MM") -> posiciones de las filas de ese periodo en la tabla.
+
+    Se construye una vez al ingerir y se extiende al agregar filas, de modo que
+    seleccionar un periodo cuesta lo que mide el periodo y no todo el historial.
+    Las posiciones son de iloc: si la tabla se reordena o se eliminan filas hay
+    que reconstruirlo.
+    """
+    def __init__(self):
+        self.posiciones = {}
+        self._ordenados = None
+
+    @classmethod
+    def desde_periodos(cls, periodos):
+        indice = cls()
+        indice.agregar(periodos, 0)
+        return indice
+
+    def agregar(self, periodos, desplazamiento):
+        """
+        periodos: Series con el periodo de cada fila nueva; desplazamiento: número de
+        filas que ya tenía la tabla.
+        """
+        if len(periodos) == 0:
+            return
+        grupos = periodos.groupby(periodos.to_numpy(), sort=False).indices
+        for periodo, pos in grupos.items():
+            pos = pos + desplazamiento
+            previas = self.posiciones.get(periodo)
+            self.posiciones[periodo] = pos if previas is None else np.concatenate([previas, pos])
+        self._ordenados = None
+
+    def periodos(self):
+        if self._ordenados is None:
+            self._ordenados = sorted(self.posiciones)
+        return self._ordenados
+
+    def filas(self, periodo):
+        return self.posiciones.get(periodo, np.empty(0, dtype=np.intp))
+
+
+class AgregadosPorBandera:
+    """
+    (periodo, valor de la bandera Deducible/Seleccionar) -> número de filas y suma de
+    cada columna de resumen. Se actualiza por diferencias al ingerir filas o al
+    cambiar la bandera, sin volver a recorrer la tabla.
+    """
+    def __init__(self, columnas):
+        self.columnas = list(columnas)
+        self.sumas = {}
+        self.conteos = {}
+
+    @classmethod
+    def desde_df(cls, df, periodos, columna_bandera, columnas):
+        agregados = cls(columnas)
+        agregados.agregar(df, periodos, columna_bandera)
+        return agregados
+
+    def _valores(self, df):
+        # Las columnas que no existen en df cuentan como 0
+        return df.reindex(columns=self.columnas)
+
+    def _acumular(self, periodo, bandera, valores, n):
+        if pd.isna(bandera):
+            return
+        clave = (periodo, bool(bandera))
+        previas = self.sumas.get(clave)
+        self.sumas[clave] = valores.copy() if previas is None else previas + valores
+        self.conteos[clave] = self.conteos.get(clave, 0) + n
+
+    def agregar(self, df, periodos, columna_bandera):
+        if df.empty or columna_bandera not in df.columns:
+            return
+        grupos = self._valores(df).groupby([periodos.to_numpy(), df[columna_bandera].to_numpy()], sort=False)
+        sumas = grupos.sum()
+        tamanos = grupos.size()
+        for (periodo, bandera), valores, n in zip(sumas.index, sumas.to_numpy(), tamanos.to_numpy()):
+            self._acumular(periodo, bandera, valores, int(n))
+
+    def mover(self, filas, periodos, anteriores, nuevos):
+        """
+        Pasa las filas de (periodo, anterior) a (periodo, nuevo); sólo recorre las filas
+        cuya bandera cambió.
+        """
+        valores = self._valores(filas).fillna(0.0).to_numpy()
+        for i, (periodo, anterior, nuevo) in enumerate(zip(periodos, anteriores, nuevos)):
+            self._acumular(periodo, anterior, -valores[i], -1)
+            self._acumular(periodo, nuevo, valores[i], 1)
+
+    def conteo(self, periodo, bandera):
+        return self.conteos.get((periodo, bandera), 0)
+
+    def sumas_de(self, periodo, bandera):
+        valores = self.sumas.get((periodo, bandera))
+        if valores is None:
+            return {col: 0.0 for col in self.columnas}
+        return dict(zip(self.columnas, valores.tolist()))
+
+
+def valores_clave(serie):
+    # Valores de una columna para las claves de duplicados: texto sin espacios a los
+    # lados y en mayúsculas (vacío si falta); las fechas cuentan por día
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        serie = serie.dt.strftime("%Y-%m-%d")
+    return serie.astype("string").fillna("").str.strip().str.upper().tolist()
+
+
+class IndiceDuplicados:
+    """
+    Cubetas de filas por el hash de claves compuestas (p. ej. Rfc Emisor + Serie +
+    Folio), para encontrar CFDIs casi duplicados con UUID distinto, como una factura
+    cancelada y vuelta a emitir.
+
+    claves: {nombre: {"columnas": [...], "opcionales": [...]}}. Una fila entra en la
+    clave sólo si trae valor en todas sus columnas no opcionales. Cada cubeta guarda
+    las posiciones (iloc) de sus filas; al agregar filas sólo se recorre el lote, y
+    grupos() sólo visita las cubetas con dos o más filas. Si se eliminan filas o se
+    reordena la tabla hay que reconstruirlo.
+    """
+    def __init__(self, claves):
+        self.claves = claves
+        self.cubetas = {nombre: {} for nombre in claves}
+        self.candidatas = {nombre: set() for nombre in claves}
+
+    @classmethod
+    def desde_df(cls, df, claves):
+        indice = cls(claves)
+        indice.agregar(df, 0)
+        return indice
+
+    def agregar(self, df, desplazamiento):
+        """
+        df: filas nuevas; desplazamiento: número de filas que ya tenía la tabla.
+        """
+        for nombre, clave in self.claves.items():
+            columnas = clave["columnas"]
+            if df.empty or any(col not in df.columns for col in columnas):
+                continue
+            obligatorias = [i for i, col in enumerate(columnas) if col not in clave.get("opcionales", ())]
+            cubetas = self.cubetas[nombre]
+            candidatas = self.candidatas[nombre]
+            valores = zip(*(valores_clave(df[col]) for col in columnas))
+            for pos, tupla in enumerate(valores, desplazamiento):
+                if any(tupla[i] == "" for i in obligatorias):
+                    continue
+                h = hash(tupla)
+                filas = cubetas.get(h)
+                if filas is None:
+                    cubetas[h] = [pos]
+                else:
+                    filas.append(pos)
+                    candidatas.add(h)
+
+    def candidatos(self, nombre):
+        return sum(len(self.cubetas[nombre][h]) for h in self.candidatas[nombre])
+
+    def grupos(self, df, nombre, tolerancia=0.0, columna_monto="Total"):
+        """
+        Regresa una lista de grupos (listas de posiciones) de filas con la misma clave
+        cuyo monto difiere a lo más en tolerancia (encadenado: ordenados por monto, dos
+        vecinos a más de la tolerancia parten el grupo). El costo depende del número de
+        filas candidatas, no del tamaño de la tabla.
+        """
+        candidatas = [self.cubetas[nombre][h] for h in self.candidatas[nombre]]
+        if not candidatas:
+            return []
+        posiciones = np.fromiter((p for filas in candidatas for p in filas), dtype=np.intp)
+        filas_df = df.iloc[posiciones]
+        # Dos claves distintas pueden compartir hash: se separan por sus valores reales
+        reales = dict(zip(posiciones.tolist(),
+                          zip(*(valores_clave(filas_df[col]) for col in self.claves[nombre]["columnas"]))))
+        montos = filas_df[columna_monto].to_numpy(dtype=float, na_value=np.nan)
+        # Sin monto no se agrupa (inf - inf es NaN), pero se ordena sin romper el orden
+        montos = dict(zip(posiciones.tolist(), np.where(np.isnan(montos), np.inf, montos)))
+        grupos = []
+        for filas in candidatas:
+            por_clave = {}
+            for pos in filas:
+                por_clave.setdefault(reales[pos], []).append(pos)
+            for misma_clave in por_clave.values():
+                if len(misma_clave) < 2:
+                    continue
+                misma_clave.sort(key=montos.__getitem__)
+                grupo = misma_clave[:1]
+                for anterior, pos in zip(misma_clave, misma_clave[1:]):
+                    if abs(montos[pos] - montos[anterior]) <= tolerancia:
+                        grupo.append(pos)
+                        continue
+                    if len(grupo) > 1:
+                        grupos.append(grupo)
+                    grupo = [pos]
+                if len(grupo) > 1:
+                    grupos.append(grupo)
+        return grupos
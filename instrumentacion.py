@@ -0,0 +1,157 @@
+import json
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+
+# Instrumentación ligera por etapas. medir() abre un span (tiempo, filas y cambio de
+# memoria) y tramo() suma el tiempo de una sub-etapa repetida (p. ej. cada lote) al span
+# abierto. Sin un registro activo ambas regresan un objeto vacío ya creado, así que
+# dejarlas en el código casi no cuesta. El registro activo se guarda en una ContextVar:
+# cada sesión de Streamlit (un hilo por corrida) activa el suyo y los procesos del pool
+# no registran nada.
+
+MAX_SPANS = 2_000
+_registro_actual = ContextVar("registro_instrumentacion", default=None)
+_span_actual = ContextVar("span_instrumentacion", default=None)
+
+try:
+    _TAMANO_PAGINA = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    _TAMANO_PAGINA = 4096
+
+
+def memoria_mib():
+    """
+    Memoria residente (RSS) actual del proceso en MiB, o None si el sistema no la expone.
+    """
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _TAMANO_PAGINA / 2**20
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class Span:
+    __slots__ = ("etapa", "nivel", "corrida", "inicio", "segundos", "filas", "memoria_mib", "detalle")
+
+    def __init__(self, etapa, nivel, corrida, inicio, filas):
+        self.etapa = etapa
+        self.nivel = nivel
+        self.corrida = corrida
+        self.inicio = inicio
+        self.segundos = None
+        self.filas = filas
+        self.memoria_mib = None
+        self.detalle = {}
+
+    def como_dict(self):
+        return {
+            "etapa": self.etapa, "nivel": self.nivel, "corrida": self.corrida,
+            "inicio": round(self.inicio, 6), "segundos": round(self.segundos, 6),
+            "filas": self.filas,
+            "memoria_mib": None if self.memoria_mib is None else round(self.memoria_mib, 2),
+            "detalle": {etapa: round(s, 6) for etapa, s in self.detalle.items()},
+        }
+
+
+class _SpanNulo:
+    # Lo que regresan medir()/tramo() sin registro activo: acepta y descarta todo
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setattr__(self, nombre, valor):
+        pass
+
+
+_SPAN_NULO = _SpanNulo()
+
+
+class RegistroInstrumentacion:
+    """
+    Últimos MAX_SPANS spans terminados. corrida agrupa los de una misma ejecución del
+    script (ver nueva_corrida); inicio es relativo a la creación del registro.
+    """
+    def __init__(self, max_spans=MAX_SPANS):
+        self.spans = deque(maxlen=max_spans)
+        self.corrida = 0
+        self.origen = time.perf_counter()
+        self.creado = datetime.now().isoformat(timespec="seconds")
+
+    def nueva_corrida(self):
+        self.corrida += 1
+
+    def limpiar(self):
+        self.spans.clear()
+
+    def de_corrida(self, corrida=None):
+        corrida = self.corrida if corrida is None else corrida
+        return sorted((s for s in self.spans if s.corrida == corrida), key=lambda s: s.inicio)
+
+    def a_json(self):
+        return json.dumps({
+            "creado": self.creado,
+            "spans": [s.como_dict() for s in sorted(self.spans, key=lambda s: s.inicio)],
+        }, ensure_ascii=False, indent=2)
+
+
+def activar(registro):
+    """
+    Activa el registro para el contexto actual (None desactiva la instrumentación).
+    """
+    _registro_actual.set(registro)
+
+
+def medir(etapa, filas=None):
+    """
+    with medir("etapa", filas=n) as span: ...  — span.filas se puede asignar adentro.
+    """
+    registro = _registro_actual.get()
+    if registro is None:
+        return _SPAN_NULO
+    return _medir(registro, etapa, filas)
+
+
+@contextmanager
+def _medir(registro, etapa, filas):
+    padre = _span_actual.get()
+    inicio = time.perf_counter()
+    span = Span(etapa, 0 if padre is None else padre.nivel + 1, registro.corrida,
+                inicio - registro.origen, filas)
+    token = _span_actual.set(span)
+    memoria = memoria_mib()
+    try:
+        yield span
+    finally:
+        span.segundos = time.perf_counter() - inicio
+        memoria_final = memoria_mib()
+        if memoria is not None and memoria_final is not None:
+            span.memoria_mib = memoria_final - memoria
+        _span_actual.reset(token)
+        registro.spans.append(span)
+
+
+def tramo(etapa):
+    """
+    Suma el tiempo del bloque a span.detalle[etapa] del span abierto.
+    """
+    span = _span_actual.get()
+    if span is None:
+        return _SPAN_NULO
+    return _tramo(span, etapa)
+
+
+@contextmanager
+def _tramo(span, etapa):
+    inicio = time.perf_counter()
+    try:
+        yield span
+    finally:
+        span.detalle[etapa] = span.detalle.get(etapa, 0.0) + time.perf_counter() - inicio
@@ -0,0 +1,792 @@
+import io
+import itertools
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import tempfile
+import zipfile
+import zlib
+from collections import deque
+from contextlib import ExitStack
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import xml.etree.ElementTree as ET
+from xml.parsers.expat import ErrorString
+import pandas as pd
+
+from cache_cfdi import cache_desde_entorno, clave_contenido
+from complementos import RAICES_COMPLEMENTO
+from indices import AgregadosPorBandera, IndiceDuplicados, IndicePeriodos, es_uuid_valido
+from instrumentacion import medir, tramo
+
+# Núcleo de extracción de CFDIs, sin interfaz: no importa Streamlit ni AgGrid para que
+# se pueda usar desde procesos del pool, la línea de comandos o servicios. Los
+# problemas se regresan como datos ({archivo, motivo, posicion}) y quien llama decide
+# cómo mostrarlos.
+
+# Mapea Forma de Pago
+codigo_map_forma_pago = {
+    "01": "Efectivo","02": "Cheque Nominativo","03": "Transferencia Electrónica de Fondos SPEI",
+    "04": "Tarjeta de Crédito","05": "Monedero Electrónico","06": "Dinero Electrónico",
+    "8": "Vales de Despensa","12": "Dación en Pago","13": "Pago por Subrogación",
+    "14": "Pago por Consignación","15": "Condonación","17": "Compensación","23": "Novación",
+    "24": "Confusión","25": "Remisión de Deuda","26": "Prescripción o Caducidad",
+    "27": "A Satisfacción del Acreedor","28": "Tarjeta de Débito","29": "Tarjeta de Servicios",
+    "30": "Aplicación de Anticipos","31": "Intermediario Pagos","99": "Por Definir",
+}
+
+# Mapea Uso de CFDI
+codigo_map_uso_cfdi = {
+    "G01": "Adquisición de mercancías","G02": "Devoluciones, descuentos o bonificaciones",
+    "G03": "Gastos en general","I01": "Construcciones","I02": "Mobiliario y equipo de oficina por inversiones",
+    "I03": "Equipo de transporte","I04": "Equipo de computo y accesorios","I05": "Dados, troqueles, moldes, matrices y herramental",
+    "I06": "Comunicaciones telefónicas","I07": "Comunicaciones satelitales","I08": "Otra maquinaria y equipo",
+    "D01": "Honorarios médicos, dentales y gastos hospitalarios","D02": "Gastos médicos por incapacidad o discapacidad",
+    "D03": "Gastos funerarios","D04": "Donativos","D05": "Intereses reales pagados por créditos hipotecarios (casa habitación)",
+    "D06": "Aportaciones voluntarias al SAR","D07": "Primas por seguros de gastos médicos",
+    "D08": "Gastos de transportación escolar obligatoria","D09": "Depósitos en cuentas para el ahorro, primas que tengan como base planes de pensiones",
+    "D10": "Pagos por servicios educativos (colegiaturas)","S01": "Sin efectos fiscales","CP01": "Pagos","CN01": "Nómina",
+}
+
+# Columnas para sumatorias
+resumen_cols = [
+    "Sub Total",
+    "Descuento",
+    "Total impuesto Trasladado",
+    "Total impuesto Retenido",
+    "Total",
+    "Traslado IVA 0.160000 %"
+]
+
+# Matriz de impuestos del comprobante: una columna por combinación de tipo, impuesto,
+# TipoFactor y TasaOCuota encontrada ("Traslado IVA 0.160000 %", "Traslado IEPS Cuota
+# 1.500000", "Traslado IVA Exento Base", "Retención ISR", ...). El esquema es dinámico.
+PREFIJOS_IMPUESTO = ("Traslado ", "Retención ")
+
+def es_columna_impuesto(col):
+    return isinstance(col, str) and col.startswith(PREFIJOS_IMPUESTO)
+
+def columnas_impuesto(df):
+    return sorted(col for col in df.columns if es_columna_impuesto(col))
+
+def columnas_resumen(df):
+    # resumen_cols con la matriz de impuestos que tenga df en lugar del IVA 16% fijo
+    return [col for col in resumen_cols if not es_columna_impuesto(col)] + columnas_impuesto(df)
+
+# Esquema de la tabla de CFDIs: se aplica una sola vez al construir el DataFrame
+columnas_monto = [
+    "Sub Total",
+    "Descuento",
+    "Total impuesto Trasladado",
+    "Total impuesto Retenido",
+    "Total",
+    "Tipo de Cambio",
+    "Traslado IVA 0.160000 %"
+]
+columnas_categoria = [
+    "Rfc Emisor",
+    "Rfc Receptor",
+    "Moneda",
+    "Tipo",
+    "Método de Pago",
+    "Forma de Pago",
+    "Uso Cfdi Receptor"
+]
+
+# Tabla de conceptos: una fila por Concepto de cada CFDI, ligada por UUID (y XML)
+campos_concepto = [
+    "ClaveProdServ",
+    "NoIdentificacion",
+    "Cantidad",
+    "ClaveUnidad",
+    "Unidad",
+    "Descripcion",
+    "ValorUnitario",
+    "Importe",
+    "Descuento",
+    "ObjetoImp"
+]
+nombres_impuesto = {"001": "ISR", "002": "IVA", "003": "IEPS"}
+columnas_impuesto_concepto = [
+    "Traslado IVA",
+    "Traslado IEPS",
+    "Retención ISR",
+    "Retención IVA",
+    "Retención IEPS"
+]
+columnas_concepto = ["UUID", "XML"] + campos_concepto + columnas_impuesto_concepto + ["Total Traslados", "Total Retenciones"]
+columnas_monto_concepto = ["Cantidad", "ValorUnitario", "Importe", "Descuento"] + columnas_impuesto_concepto + [
+    "Total Traslados", "Total Retenciones"
+]
+columnas_categoria_concepto = ["ClaveProdServ", "ClaveUnidad", "Unidad", "ObjetoImp"]
+
+# Procesamiento en paralelo de los XML del ZIP
+NUM_PROCESOS_DEFAULT = os.cpu_count() or 1
+TAM_LOTE_XML = 200
+
+# Límites al recorrer el ZIP (y los ZIPs que trae adentro). Los tamaños se revisan con
+# lo que declara el ZIP y otra vez al descomprimir, por si el encabezado miente.
+LIMITES_ZIP = {
+    "profundidad": 4,                  # niveles de ZIPs anidados
+    "tamano_xml": 64 * 2**20,          # bytes descomprimidos de un XML
+    "tamano_zip": 8 * 2**30,           # bytes descomprimidos de un ZIP anidado
+    "razon_compresion": 200,           # descomprimido / comprimido
+}
+_MIN_TAMANO_RAZON = 2**20              # debajo de esto no se revisa la razón
+UMBRAL_SPOOL = 32 * 2**20              # ZIPs anidados más grandes se pasan a disco
+
+def aplicar_esquema(df):
+    """
+    Convierte montos (incluida la matriz de impuestos) a float64, Fecha a datetime64 y
+    los catálogos a categóricos. Las columnas que ya tienen el tipo correcto no se
+    vuelven a convertir.
+    """
+    for col in columnas_monto + columnas_impuesto(df):
+        if col in df.columns and df[col].dtype != "float64":
+            df[col] = pd.to_numeric(df[col], errors="coerce").astype("float64")
+    if "Fecha" in df.columns and not pd.api.types.is_datetime64_any_dtype(df["Fecha"]):
+        df["Fecha"] = pd.to_datetime(df["Fecha"], errors="coerce", format="ISO8601")
+    for col in columnas_categoria:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype("category")
+    return df
+
+def conceptos_a_df(conceptos):
+    """
+    conceptos: lista de dicts (ver _LectorCFDI). Regresa la tabla de conceptos tipada;
+    los impuestos que un concepto no trae quedan en 0.
+    """
+    df = pd.DataFrame(conceptos, columns=columnas_concepto)
+    for col in columnas_monto_concepto:
+        df[col] = pd.to_numeric(df[col], errors="coerce").astype("float64")
+    df[columnas_impuesto_concepto] = df[columnas_impuesto_concepto].fillna(0.0)
+    df["Total Traslados"] = df[[c for c in columnas_impuesto_concepto if c.startswith("Traslado")]].sum(axis=1)
+    df["Total Retenciones"] = df[[c for c in columnas_impuesto_concepto if c.startswith("Retención")]].sum(axis=1)
+    for col in columnas_categoria_concepto:
+        df[col] = df[col].astype("category")
+    return df
+
+def concatenar_cfdis(df_existente, nuevo_df):
+    if df_existente.empty:
+        return nuevo_df.reset_index(drop=True)
+    # concat pierde el tipo categórico cuando las categorías difieren
+    return aplicar_esquema(pd.concat([df_existente, nuevo_df], ignore_index=True))
+
+def calcular_periodo(fechas):
+    # "AAAA-MM"; se formatea una vez por mes distinto y no una vez por fila
+    claves = fechas.dt.year * 100 + fechas.dt.month
+    etiquetas = {c: f"{int(c) // 100:04d}-{int(c) % 100:02d}" for c in claves.dropna().unique()}
+    return claves.map(etiquetas).fillna("")
+
+def filtrar_duplicados_por_uuid(nuevo_df, df_existente, uuid_col="UUID", indice=None):
+    """
+    Quita de nuevo_df los CFDIs cuyo UUID ya existe. Con un IndiceUUID el costo depende
+    sólo del tamaño de nuevo_df. Las filas sin UUID siempre se conservan.
+    """
+    if indice is not None:
+        return nuevo_df[indice.mascara_nuevos(nuevo_df[uuid_col])]
+    if uuid_col not in df_existente.columns:
+        return nuevo_df
+    uuids_existentes = [u for u in df_existente[uuid_col].unique() if es_uuid_valido(u)]
+    return nuevo_df[~nuevo_df[uuid_col].isin(uuids_existentes)]
+
+def eliminar_duplicados_en_df(df, uuid_col="UUID", indice=None):
+    if uuid_col not in df.columns:
+        return df, 0
+    if indice is not None:
+        if not indice.repetidos:
+            return df, 0
+        candidatos = df[uuid_col].isin(indice.repetidos)
+    else:
+        candidatos = df[uuid_col].map(es_uuid_valido)
+    # Sólo se comparan filas con UUID: las que no traen uno no son duplicadas entre sí
+    duplicadas = df[candidatos].duplicated(subset=[uuid_col], keep='first')
+    etiquetas = duplicadas.index[duplicadas]
+    if indice is not None:
+        indice.quitar(df.loc[etiquetas, uuid_col])
+    return df.drop(index=etiquetas), len(etiquetas)
+# Bandera de cada tabla de CFDIs
+COLUMNA_BANDERA = {"df_recibidos": "Deducible", "df_emitidos": "Seleccionar"}
+
+def indice_periodos_desde_df(df):
+    if "Fecha" not in df.columns:
+        return IndicePeriodos()
+    return IndicePeriodos.desde_periodos(calcular_periodo(df["Fecha"]))
+
+# Claves para detectar casi duplicados (UUID distinto); el Total se compara aparte con
+# una tolerancia (ver IndiceDuplicados.grupos)
+CLAVES_DUPLICADOS = {
+    "Emisor, Serie y Folio": {"columnas": ["Rfc Emisor", "Serie", "Folio"], "opcionales": ["Serie"]},
+    "Emisor, Receptor y día": {"columnas": ["Rfc Emisor", "Rfc Receptor", "Fecha"]},
+}
+columnas_duplicados = {col for clave in CLAVES_DUPLICADOS.values() for col in clave["columnas"]}
+
+def indice_duplicados_desde_df(df):
+    return IndiceDuplicados.desde_df(df, CLAVES_DUPLICADOS)
+
+def agregados_desde_df(df, tabla):
+    if "Fecha" not in df.columns:
+        return AgregadosPorBandera(columnas_resumen(df))
+    return AgregadosPorBandera.desde_df(df, calcular_periodo(df["Fecha"]), COLUMNA_BANDERA[tabla],
+                                        columnas_resumen(df))
+
+def clasificar_por_rfc(df, rfc):
+    """
+    Reparte los CFDIs según el papel de la empresa: si es el emisor van a df_emitidos y
+    si es el receptor a df_recibidos (uno de la empresa a sí misma va a Emitidos).
+    Regresa ({"df_emitidos": df, "df_recibidos": df}, ajenos), donde ajenos son los
+    CFDIs en los que la empresa no es emisor ni receptor.
+    """
+    rfc = rfc.strip().upper()
+    emisor = df["Rfc Emisor"].astype(str).str.strip().str.upper() == rfc
+    receptor = df["Rfc Receptor"].astype(str).str.strip().str.upper() == rfc
+    tablas = {
+        "df_emitidos": df[emisor].reset_index(drop=True),
+        "df_recibidos": df[receptor & ~emisor].reset_index(drop=True),
+    }
+    return tablas, df[~emisor & ~receptor].reset_index(drop=True)
+
+def conceptos_de(conceptos, df):
+    # Sólo los conceptos de los CFDIs de df
+    if conceptos.empty or df.empty:
+        return conceptos.iloc[0:0]
+    claves = set(zip(df["UUID"], df["XML"]))
+    return conceptos[[c in claves for c in zip(conceptos["UUID"], conceptos["XML"])]].reset_index(drop=True)
+
+def complementos_de(complementos, df):
+    # {tabla_lateral: df} con sólo las filas de los CFDIs de df; se omiten las vacías
+    laterales = {lateral: conceptos_de(filas, df) for lateral, filas in complementos.items()}
+    return {lateral: filas for lateral, filas in laterales.items() if not filas.empty}
+
+# Versiones del CFDI que reconoce el lector, por namespace del elemento raíz. 3.3 y 4.0
+# usan los mismos nombres de elementos y atributos; 4.0 agrega algunos (Exportacion,
+# ObjetoImp, DomicilioFiscalReceptor, RegimenFiscalReceptor) que en 3.3 quedan vacíos.
+VERSIONES_CFDI = {
+    "http://www.sat.gob.mx/cfd/4": "4.0",
+    "http://www.sat.gob.mx/cfd/3": "3.3",
+}
+NS_TFD = "{http://www.sat.gob.mx/TimbreFiscalDigital}"
+_TAG_TIMBRE = NS_TFD + "TimbreFiscalDigital"
+
+class _EtiquetasCFDI:
+    # Etiquetas (con namespace) que recorre el lector para una versión del CFDI
+    __slots__ = ("version", "comprobante", "emisor", "receptor", "impuestos", "traslado", "retencion",
+                 "conceptos", "concepto", "cfdi_relacionados", "cfdi_relacionado")
+
+    def __init__(self, namespace, version):
+        ns = f"{{{namespace}}}"
+        self.version = version
+        self.comprobante = ns + "Comprobante"
+        self.emisor = ns + "Emisor"
+        self.receptor = ns + "Receptor"
+        self.impuestos = ns + "Impuestos"
+        self.traslado = ns + "Traslado"
+        self.retencion = ns + "Retencion"
+        self.conceptos = ns + "Conceptos"
+        self.concepto = ns + "Concepto"
+        self.cfdi_relacionados = ns + "CfdiRelacionados"
+        self.cfdi_relacionado = ns + "CfdiRelacionado"
+
+# Se arman una sola vez; el lector elige el juego al ver el elemento raíz
+_ETIQUETAS_POR_RAIZ = {f"{{{ns}}}Comprobante": _EtiquetasCFDI(ns, v) for ns, v in VERSIONES_CFDI.items()}
+
+class DocumentoNoSoportado(ValueError):
+    # El XML está bien formado pero no es un CFDI de una versión reconocida
+    pass
+TAM_BLOQUE_XML = 64 * 1024
+# Incrementar al cambiar lo que extrae _LectorCFDI: invalida las filas en caché
+VERSION_EXTRACTOR = 7
+
+class _LectorCFDI:
+    """
+    Destino de XMLParser que llena la fila de un CFDI en una sola pasada sobre los
+    eventos de apertura y cierre, sin construir el árbol del documento.
+    """
+    def __init__(self, row):
+        self.row = row
+        self.nivel = 0
+        self.etiquetas = None
+        self.en_conceptos = False
+        self.vistos = set()
+        self.total_trasladado = None
+        self.suma_trasladado = 0.0
+        self.total_retenido = 0.0
+        # dict y no set: el orden de aparición no depende de la semilla de hash del proceso
+        self.impuestos_nombres = {}
+        self.en_impuestos = False
+        self.matriz_impuestos = {}
+        self.lista_conceptos = []
+        self.conceptos = []
+        self.concepto = None
+        # CfdiRelacionados: (TipoRelacion, UUID) por cada CfdiRelacionado; 4.0 admite
+        # varios nodos CfdiRelacionados, uno por tipo de relación
+        self.relaciones = []
+        self.tipo_relacion = ""
+        # Complementos con extractor registrado: uno por clase, creado al encontrar su raíz
+        self.complementos = {}
+        self.complemento = None
+        self.nivel_complemento = None
+
+    def start(self, tag, attrib):
+        nivel = self.nivel
+        self.nivel += 1
+        if self.complemento is not None:
+            # Dentro de un complemento, todos los eventos son de su extractor
+            self.complemento.start(tag, attrib)
+            return
+        row = self.row
+        e = self.etiquetas
+        if nivel == 0:
+            self._comprobante(tag, attrib)
+        elif tag == e.traslado:
+            try:
+                self.suma_trasladado += float(attrib.get("Importe", "0"))
+            except ValueError:
+                pass
+            imp = attrib.get("Impuesto", "")
+            if imp:
+                self.impuestos_nombres[imp] = None
+            if self.en_impuestos and nivel == 3:
+                self._impuesto_comprobante("Traslado", attrib)
+            if self.concepto is not None:
+                self._impuesto_concepto("Traslado", attrib)
+        elif tag == e.retencion:
+            try:
+                self.total_retenido += float(attrib.get("Importe", "0"))
+            except ValueError:
+                pass
+            if self.en_impuestos and nivel == 3:
+                self._impuesto_comprobante("Retención", attrib)
+            if self.concepto is not None:
+                self._impuesto_concepto("Retención", attrib)
+        elif tag == e.concepto and nivel == 2 and self.en_conceptos:
+            self.lista_conceptos.append(f"{attrib.get('Descripcion','')}: {attrib.get('Importe','')}")
+            self.concepto = {campo: attrib.get(campo, "") for campo in campos_concepto}
+            self.conceptos.append(self.concepto)
+        elif tag == e.conceptos and nivel == 1:
+            self.en_conceptos = True
+        elif tag == e.cfdi_relacionado and nivel == 2:
+            self.relaciones.append((self.tipo_relacion, attrib.get("UUID", "")))
+        elif tag == e.cfdi_relacionados and nivel == 1:
+            self.tipo_relacion = attrib.get("TipoRelacion", "")
+        elif tag in self.vistos:
+            # Como find(): sólo cuenta la primera aparición
+            return
+        elif tag == e.emisor and nivel == 1:
+            self.vistos.add(tag)
+            row["Rfc Emisor"] = attrib.get("Rfc", "")
+            row["Nombre Emisor"] = attrib.get("Nombre", "")
+            row["Régimen Fiscal Emisor"] = attrib.get("RegimenFiscal", "")
+        elif tag == e.receptor and nivel == 1:
+            self.vistos.add(tag)
+            row["Rfc Receptor"] = attrib.get("Rfc", "")
+            row["Nombre Receptor"] = attrib.get("Nombre", "")
+            row["CP Receptor"] = attrib.get("DomicilioFiscalReceptor", "")
+            row["Régimen Receptor"] = attrib.get("RegimenFiscalReceptor", "")
+            uso_cfdi_codigo = attrib.get("UsoCFDI", "")
+            uso_cfdi_desc = codigo_map_uso_cfdi.get(uso_cfdi_codigo, "")
+            if uso_cfdi_desc:
+                row["Uso Cfdi Receptor"] = f"{uso_cfdi_codigo}-{uso_cfdi_desc}"
+            else:
+                row["Uso Cfdi Receptor"] = uso_cfdi_codigo
+        elif tag == e.impuestos and nivel == 1:
+            self.vistos.add(tag)
+            self.en_impuestos = True
+            self.total_trasladado = attrib.get("TotalImpuestosTrasladados")
+        elif tag == _TAG_TIMBRE:
+            self.vistos.add(tag)
+            row["UUID"] = attrib.get("UUID", "")
+        elif tag in RAICES_COMPLEMENTO:
+            clase = RAICES_COMPLEMENTO[tag]
+            if clase not in self.complementos:
+                self.complementos[clase] = clase()
+            self.complemento = self.complementos[clase]
+            self.nivel_complemento = nivel
+            self.complemento.start(tag, attrib)
+
+    def end(self, tag):
+        self.nivel -= 1
+        if self.complemento is not None:
+            self.complemento.end(tag)
+            if self.nivel == self.nivel_complemento:
+                self.complemento = None
+            return
+        e = self.etiquetas
+        if tag == e.conceptos and self.nivel == 1:
+            self.en_conceptos = False
+        elif tag == e.concepto and self.nivel == 2:
+            self.concepto = None
+        elif tag == e.impuestos and self.nivel == 1:
+            self.en_impuestos = False
+
+    def close(self):
+        row = self.row
+        # Si el nodo Impuestos no trae el total, se suman los traslados
+        if self.total_trasladado is None:
+            row["Total impuesto Trasladado"] = self.suma_trasladado
+        else:
+            row["Total impuesto Trasladado"] = self.total_trasladado
+        row["Nombre Impuesto"] = ", ".join(self.impuestos_nombres)
+        row["Total impuesto Retenido"] = self.total_retenido
+        row.update(self.matriz_impuestos)
+        row["Traslado IVA 0.160000 %"] = self.matriz_impuestos.get("Traslado IVA 0.160000 %", "")
+        row["Conceptos"] = "; ".join(self.lista_conceptos)
+        if self.relaciones:
+            tipos = [tipo for tipo, _ in self.relaciones]
+            row["Relacionados"] = ", ".join(uuid for _, uuid in self.relaciones)
+            # Un solo tipo si todos coinciden; si no, uno por UUID (ver relaciones.py)
+            row["Tipo Relación"] = tipos[0] if len(set(tipos)) == 1 else ", ".join(tipos)
+        # Los conceptos y los complementos viajan con la fila (y en la caché);
+        # procesar_zip los separa
+        row["_conceptos"] = self.conceptos
+        if self.complementos:
+            row["_complementos"] = {tabla: filas for extractor in self.complementos.values()
+                                    for tabla, filas in extractor.filas.items() if filas}
+        return row
+
+    def _impuesto_comprobante(self, tipo, attrib):
+        impuesto = attrib.get("Impuesto", "")
+        nombre = nombres_impuesto.get(impuesto, impuesto)
+        factor = attrib.get("TipoFactor", "")
+        campo = "Importe"
+        if factor == "Tasa":
+            columna = f"{tipo} {nombre} {attrib.get('TasaOCuota', '')} %"
+        elif factor == "Cuota":
+            columna = f"{tipo} {nombre} Cuota {attrib.get('TasaOCuota', '')}"
+        elif factor == "Exento":
+            # Los exentos no causan impuesto: se acumula la base
+            columna = f"{tipo} {nombre} Exento Base"
+            campo = "Base"
+        else:
+            # Las retenciones del comprobante sólo traen Impuesto e Importe
+            columna = f"{tipo} {nombre}"
+        try:
+            importe = float(attrib.get(campo, ""))
+        except ValueError:
+            return
+        self.matriz_impuestos[columna] = self.matriz_impuestos.get(columna, 0.0) + importe
+
+    def _impuesto_concepto(self, tipo, attrib):
+        # Los traslados exentos no traen Importe
+        try:
+            importe = float(attrib.get("Importe", ""))
+        except ValueError:
+            return
+        impuesto = attrib.get("Impuesto", "")
+        columna = f"{tipo} {nombres_impuesto.get(impuesto, impuesto)}"
+        self.concepto[columna] = self.concepto.get(columna, 0.0) + importe
+
+    def _comprobante(self, tag, attrib):
+        # La versión sale del namespace del elemento raíz
+        self.etiquetas = _ETIQUETAS_POR_RAIZ.get(tag)
+        if "version" in attrib and "Version" not in attrib:
+            # CFDI 3.2 y anteriores: mismo namespace que 3.3 pero atributos en minúsculas
+            raise DocumentoNoSoportado(f"CFDI {attrib['version']} no soportado (sólo 3.3 y 4.0)")
+        if self.etiquetas is None:
+            raise DocumentoNoSoportado(f"No es un CFDI 3.3 ni 4.0 (elemento raíz {tag})")
+        row = self.row
+        row["Fecha"] = attrib.get("Fecha", "")
+        row["Sub Total"] = attrib.get("SubTotal", "")
+        row["Descuento"] = attrib.get("Descuento", "")
+        row["Total"] = attrib.get("Total", "")
+        row["Método de Pago"] = attrib.get("MetodoPago", "")
+
+        forma_pago_codigo = attrib.get("FormaPago", "")
+        forma_pago_desc = codigo_map_forma_pago.get(forma_pago_codigo, "")
+        if forma_pago_desc:
+            row["Forma de Pago"] = f"{forma_pago_codigo}-{forma_pago_desc}"
+        else:
+            row["Forma de Pago"] = forma_pago_codigo
+
+        row["Moneda"] = attrib.get("Moneda", "")
+        row["Tipo de Cambio"] = attrib.get("TipoCambio", "")
+        row["Versión"] = attrib.get("Version", "") or self.etiquetas.version
+        row["Serie"] = attrib.get("Serie", "")
+        row["Folio"] = attrib.get("Folio", "")
+        row["Tipo"] = attrib.get("TipoDeComprobante", "")
+
+def error_extraccion(archivo, motivo, posicion=None):
+    """
+    Error de extracción: archivo (XML dentro del ZIP, o el ZIP mismo), motivo y
+    posicion (línea, columna) en el XML cuando el parser la conoce.
+    """
+    return {"archivo": archivo, "motivo": motivo, "posicion": posicion}
+
+def describir_error(error):
+    texto = f"{error['archivo']}: {error['motivo']}"
+    if error["posicion"] is not None:
+        linea, columna = error["posicion"]
+        texto += f" (línea {linea}, columna {columna})"
+    return texto
+
+def _extraer_fila(filename, xml_file):
+    """
+    Extrae la fila de un CFDI leyendo el XML por bloques. Regresa (fila, None), o
+    (None, error) si el XML no se puede parsear.
+    """
+    row = {
+        "XML": filename, "Rfc Emisor": "","Nombre Emisor": "","Régimen Fiscal Emisor": "",
+        "Rfc Receptor": "","Nombre Receptor": "","CP Receptor": "","Régimen Receptor": "",
+        "Uso Cfdi Receptor": "","Tipo": "","Serie": "","Folio": "","Fecha": "",
+        "Sub Total": "","Descuento": "","Total impuesto Trasladado": "","Nombre Impuesto": "",
+        "Total impuesto Retenido": "","Total": "","UUID": "","Método de Pago": "",
+        "Forma de Pago": "","Moneda": "","Tipo de Cambio": "","Versión": "","Estado": "",
+        "Estatus": "","Validación EFOS": "","Fecha Consulta": "","Conceptos": "",
+        "Relacionados": "","Tipo Relación": "","Traslado IVA 0.160000 %": ""
+    }
+    parser = ET.XMLParser(target=_LectorCFDI(row))
+    try:
+        for bloque in iter(lambda: xml_file.read(TAM_BLOQUE_XML), b""):
+            parser.feed(bloque)
+        return parser.close(), None
+    except ET.ParseError as e:
+        return None, error_extraccion(filename, f"XML mal formado: {ErrorString(e.code)}", tuple(e.position))
+    except DocumentoNoSoportado as e:
+        return None, error_extraccion(filename, str(e))
+
+def _procesar_lote(lote):
+    # Se ejecuta en un proceso del pool: recibe [(nombre, bytes), ...]
+    return [_extraer_fila(filename, io.BytesIO(contenido)) for filename, contenido in lote]
+
+# Miembros que no se pueden descomprimir: CRC, cifrado, método no soportado, truncado
+_ERRORES_MIEMBRO = (zipfile.BadZipFile, zlib.error, RuntimeError, NotImplementedError, EOFError, ValueError)
+
+def _revisar_miembro(info, limite, limites):
+    # Regresa el motivo para rechazar el miembro según lo que declara el ZIP, o None
+    if info.file_size > limite:
+        return f"Excede el tamaño máximo ({info.file_size} > {limite} bytes)"
+    if (info.file_size > _MIN_TAMANO_RAZON and info.compress_size
+            and info.file_size / info.compress_size > limites["razon_compresion"]):
+        return f"Razón de compresión sospechosa ({info.file_size / info.compress_size:.0f}:1)"
+    return None
+
+def _tope_lectura(info, limite, limites):
+    # Lo más que se descomprime del miembro, sin confiar en el file_size del encabezado:
+    # el tamaño máximo y, por la razón de compresión, compress_size * razón (zipfile no
+    # lee más de compress_size bytes comprimidos)
+    return min(limite, max(_MIN_TAMANO_RAZON, info.compress_size * limites["razon_compresion"]))
+
+def _motivo_tope(tope, limite):
+    if tope >= limite:
+        return f"Excede el tamaño máximo ({limite} bytes)"
+    return f"Razón de compresión sospechosa (descomprime más de {tope} bytes)"
+
+def _miembros_xml(thezip, prefijo, profundidad, limites, errores):
+    """
+    Genera (nombre, bytes) de cada XML del ZIP, uno a la vez y en el orden del archivo,
+    bajando a los ZIPs anidados. Sólo un XML descomprimido está en memoria a la vez; un
+    ZIP anidado se copia a un archivo temporal (en memoria hasta UMBRAL_SPOOL) para
+    poder recorrerlo. Los miembros que no se pueden leer o que rebasan los límites se
+    reportan en errores y se omiten. Los nombres anidados llevan la ruta:
+    "trimestre.zip/enero/abc.xml".
+    """
+    for info in thezip.infolist():
+        nombre = prefijo + info.filename
+        es_xml = info.filename.lower().endswith(".xml")
+        es_zip = info.filename.lower().endswith(".zip")
+        if info.is_dir() or not (es_xml or es_zip):
+            continue
+        if es_zip and profundidad >= limites["profundidad"]:
+            errores.append(error_extraccion(nombre, f"ZIP anidado a más de {limites['profundidad']} niveles"))
+            continue
+        limite = limites["tamano_xml"] if es_xml else limites["tamano_zip"]
+        motivo = _revisar_miembro(info, limite, limites)
+        if motivo is not None:
+            errores.append(error_extraccion(nombre, motivo))
+            continue
+        # Los límites se aplican a los bytes que de verdad salen al descomprimir
+        tope = _tope_lectura(info, limite, limites)
+        if es_xml:
+            try:
+                with tramo("descompresión"), thezip.open(info) as miembro:
+                    contenido = miembro.read(tope + 1)
+            except _ERRORES_MIEMBRO as e:
+                errores.append(error_extraccion(nombre, f"No se pudo descomprimir: {e}"))
+                continue
+            if len(contenido) > tope:
+                errores.append(error_extraccion(nombre, _motivo_tope(tope, limite)))
+                continue
+            yield nombre, contenido
+            continue
+        with tempfile.SpooledTemporaryFile(max_size=UMBRAL_SPOOL) as temporal:
+            try:
+                with tramo("descompresión"), thezip.open(info) as miembro:
+                    copiados = 0
+                    for bloque in iter(lambda: miembro.read(TAM_BLOQUE_XML * 16), b""):
+                        copiados += len(bloque)
+                        if copiados > tope:
+                            raise ValueError(_motivo_tope(tope, limite))
+                        temporal.write(bloque)
+                anidado = zipfile.ZipFile(temporal)
+            except _ERRORES_MIEMBRO as e:
+                errores.append(error_extraccion(nombre, f"No se pudo leer el ZIP anidado: {e}"))
+                continue
+            with anidado:
+                yield from _miembros_xml(anidado, nombre + "/", profundidad + 1, limites, errores)
+
+def _leer_lotes(miembros, tam_lote):
+    while True:
+        lote = list(itertools.islice(miembros, tam_lote))
+        if not lote:
+            return
+        yield lote
+
+def _resolver_lote(lote, cache, resultado):
+    # Separa el lote en filas ya guardadas en caché y XMLs que hay que parsear
+    if cache is None:
+        return None, [None] * len(lote), lote
+    claves = [clave_contenido(contenido) for _, contenido in lote]
+    with tramo("caché"):
+        encontradas = cache.obtener(claves)
+    filas, faltantes = [], []
+    for (filename, contenido), clave in zip(lote, claves):
+        fila = encontradas.get(clave)
+        if fila is None:
+            faltantes.append((filename, contenido))
+        else:
+            fila = dict(fila, XML=filename)
+        filas.append(fila)
+    resultado["aciertos_cache"] += len(lote) - len(faltantes)
+    resultado["fallos_cache"] += len(faltantes)
+    return claves, filas, faltantes
+
+def _ensamblar(lote, claves, filas, parseadas, cache):
+    if isinstance(parseadas, Future):
+        # Con pool, "parseo" es el tiempo de espera por el lote
+        with tramo("parseo"):
+            try:
+                parseadas = parseadas.result()
+            except BrokenProcessPool:
+                # Un proceso del pool murió (memoria, fallo nativo): el lote se parsea aquí
+                parseadas = _procesar_lote([miembro for miembro, fila in zip(lote, filas) if fila is None])
+    nuevas = iter(parseadas)
+    por_guardar = []
+    salida = []
+    for i, (filename, _) in enumerate(lote):
+        fila, error = filas[i], None
+        if fila is None:
+            fila, error = next(nuevas)
+            if fila is not None and cache is not None:
+                por_guardar.append((claves[i], fila))
+        salida.append((filename, fila, error))
+    # Se guarda antes de entregar las filas: quien las recibe puede modificarlas
+    if por_guardar:
+        with tramo("caché"):
+            cache.guardar(por_guardar)
+    yield from salida
+
+# Los procesos del pool no se crean con fork: Streamlit corre con hilos y bifurcar un
+# proceso con hilos puede heredar locks tomados. forkserver donde existe, spawn en Windows
+_METODO_INICIO_POOL = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+def _extraer_lotes(miembros, num_procesos, tam_lote, cache, resultado):
+    # Se mantienen a lo más 2 lotes por proceso en vuelo para no cargar todo el ZIP
+    # descomprimido en memoria; los resultados se entregan en el orden del archivo.
+    lotes = _leer_lotes(miembros, tam_lote)
+    # El pool sólo se crea si hay más de un lote
+    primeros = list(itertools.islice(lotes, 2))
+    pool = None
+    if num_procesos > 1 and len(primeros) > 1:
+        pool = ProcessPoolExecutor(max_workers=num_procesos,
+                                   mp_context=multiprocessing.get_context(_METODO_INICIO_POOL))
+    pendientes = deque()
+    pool_roto = False
+    try:
+        for lote in itertools.chain(primeros, lotes):
+            claves, filas, faltantes = _resolver_lote(lote, cache, resultado)
+            parseadas = None
+            if pool is not None and not pool_roto and faltantes:
+                try:
+                    parseadas = pool.submit(_procesar_lote, faltantes)
+                except BrokenProcessPool:
+                    # Los lotes que faltan se parsean en este proceso
+                    pool_roto = True
+            if parseadas is None:
+                with tramo("parseo"):
+                    parseadas = _procesar_lote(faltantes)
+            pendientes.append((lote, claves, filas, parseadas))
+            if len(pendientes) >= 2 * num_procesos:
+                yield from _ensamblar(*pendientes.popleft(), cache)
+        while pendientes:
+            yield from _ensamblar(*pendientes.popleft(), cache)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+def obtener_cache():
+    try:
+        return cache_desde_entorno(VERSION_EXTRACTOR)
+    except (OSError, sqlite3.Error):
+        return None
+
+def _nombre_origen(origen):
+    if isinstance(origen, (str, os.PathLike)):
+        return os.fspath(origen)
+    return getattr(origen, "name", "") or "ZIP"
+
+def _abrir_zip(origen, pila):
+    # Sin copiar el archivo: ZipFile lee de la ruta o del archivo abierto sólo lo que
+    # necesita. Un flujo que no permite seek se pasa a un temporal (en disco si es grande).
+    if isinstance(origen, (str, os.PathLike)):
+        return zipfile.ZipFile(origen)
+    if isinstance(origen, (bytes, bytearray)):
+        return zipfile.ZipFile(io.BytesIO(origen))
+    if origen.seekable():
+        return zipfile.ZipFile(origen)
+    temporal = pila.enter_context(tempfile.SpooledTemporaryFile(max_size=UMBRAL_SPOOL))
+    shutil.copyfileobj(origen, temporal)
+    return zipfile.ZipFile(temporal)
+
+def procesar_zip(origen, num_procesos=1, tam_lote=TAM_LOTE_XML, cache=None, limites=None):
+    """
+    Extrae las filas de todos los XML del ZIP, incluidos los de ZIPs anidados. origen
+    puede ser una ruta, los bytes del ZIP o un archivo abierto (p. ej. el UploadedFile
+    de Streamlit); el ZIP no se copia a memoria y los XML se descomprimen por lotes,
+    así que la memoria depende del tamaño de los XML y no del archivo. limites
+    sobrescribe valores de LIMITES_ZIP. Con num_procesos > 1
+    el parseo se reparte en lotes de tam_lote archivos entre un pool de procesos; el
+    resultado es idéntico al de la ruta serial y conserva el orden del archivo. Si se
+    pasa una caché, los XML cuyo contenido ya fue procesado no se vuelven a parsear.
+
+    Regresa {"filas": [...], "conceptos": [...], "complementos": {tabla: [...]},
+    "versiones": {versión: n}, "errores": [...], "aciertos_cache": n, "fallos_cache": n};
+    cada concepto y cada fila de complemento es un dict con el UUID y el XML de su CFDI
+    (ver conceptos_a_df y complementos_a_df), versiones cuenta los CFDIs leídos por
+    versión ("3.3", "4.0") y cada error es un dict de error_extraccion. Los XML que no
+    son CFDI 3.3 o 4.0 se reportan como error. Si el ZIP no se puede abrir, el único
+    error lleva el nombre del ZIP y no hay filas.
+    """
+    limites = {**LIMITES_ZIP, **(limites or {})}
+    rows = []
+    conceptos = []
+    complementos = {}
+    versiones = {}
+    errores = []
+    resultado = {"filas": rows, "conceptos": conceptos, "complementos": complementos, "versiones": versiones,
+                 "errores": errores, "aciertos_cache": 0, "fallos_cache": 0}
+    with medir("procesar_zip") as span, ExitStack() as pila:
+        try:
+            thezip = pila.enter_context(_abrir_zip(origen, pila))
+        except (OSError, zipfile.BadZipFile) as e:
+            errores.append(error_extraccion(_nombre_origen(origen), f"No se pudo abrir el ZIP: {e}"))
+            return resultado
+        miembros = _miembros_xml(thezip, "", 0, limites, errores)
+        for filename, row, error in _extraer_lotes(miembros, num_procesos, tam_lote, cache, resultado):
+            if row is None:
+                errores.append(error)
+                continue
+            # Se copian: dos XML idénticos en el ZIP comparten la fila de la caché
+            for concepto in row.pop("_conceptos", []):
+                conceptos.append(dict(concepto, UUID=row["UUID"], XML=row["XML"]))
+            for tabla, filas in row.pop("_complementos", {}).items():
+                destino = complementos.setdefault(tabla, [])
+                for fila in filas:
+                    destino.append(dict(fila, UUID=row["UUID"], XML=row["XML"]))
+            versiones[row["Versión"]] = versiones.get(row["Versión"], 0) + 1
+            rows.append(row)
+        if cache is not None:
+            with tramo("caché"):
+                cache.recortar()
+        span.filas = len(rows)
+    return resultado
@@ -0,0 +1,168 @@
+import numpy as np
+import pandas as pd
+
+# Grafo de relaciones entre CFDIs, indexado por UUID. Las aristas salen de dos fuentes:
+# los nodos CfdiRelacionados del comprobante (columnas Relacionados y Tipo Relación de
+# la fila) y los DoctoRelacionado del complemento de pagos (tabla lateral pagos_doctos).
+# Cada arista va del CFDI que relaciona (nota de crédito, sustituto, pago) al CFDI
+# relacionado, y se guarda en los dos sentidos para consultar sin recorrer la tabla.
+
+TIPOS_RELACION = {
+    "01": "Nota de crédito de los documentos relacionados",
+    "02": "Nota de débito de los documentos relacionados",
+    "03": "Devolución de mercancía sobre facturas o traslados previos",
+    "04": "Sustitución de los CFDI previos",
+    "05": "Traslados de mercancías facturados previamente",
+    "06": "Factura generada por los traslados previos",
+    "07": "CFDI por aplicación de anticipo",
+    "08": "Factura generada por pagos en parcialidades",
+    "09": "Factura generada por pagos diferidos",
+}
+TIPO_PAGO = "Pago"                      # aristas de DoctoRelacionado
+TIPOS_DESCUENTO = ("01", "03")          # notas de crédito y devoluciones: restan al saldo
+TIPO_SUSTITUCION = "04"
+
+COLUMNAS_ARISTA = ["UUID", "XML", "UUIDRelacionado", "TipoRelacion", "Monto", "Parcialidad", "SaldoInsoluto"]
+
+
+def _uuid(valor):
+    return valor.strip().upper() if isinstance(valor, str) else ""
+
+
+def aristas_de_filas(df):
+    """
+    Aristas de CfdiRelacionados de las filas de df. Relacionados trae los UUID separados
+    por coma y Tipo Relación un solo tipo para todos o uno por UUID. El monto es el Total
+    del CFDI que relaciona, repartido en partes iguales entre sus relacionados.
+    """
+    if df.empty or "Relacionados" not in df.columns:
+        return []
+    con_relacion = df.loc[df["Relacionados"].fillna("").astype(str) != "",
+                          ["UUID", "XML", "Relacionados", "Tipo Relación", "Total"]]
+    aristas = []
+    for uuid, xml, relacionados, tipos, total in zip(*(con_relacion[col] for col in con_relacion.columns)):
+        tipos = tipos if isinstance(tipos, str) else ""
+        relacionados = [_uuid(u) for u in relacionados.split(",") if u.strip()]
+        tipos = [t.strip() for t in tipos.split(",")]
+        if len(tipos) != len(relacionados):
+            tipos = tipos[:1] * len(relacionados)
+        monto = total / len(relacionados) if pd.notna(total) and relacionados else np.nan
+        for relacionado, tipo in zip(relacionados, tipos):
+            aristas.append({"UUID": _uuid(uuid), "XML": xml, "UUIDRelacionado": relacionado, "TipoRelacion": tipo,
+                            "Monto": monto, "Parcialidad": None, "SaldoInsoluto": np.nan})
+    return aristas
+
+
+def aristas_de_pagos(pagos_doctos):
+    """
+    Aristas de los DoctoRelacionado del complemento de pagos (tabla lateral
+    pagos_doctos): del CFDI de pago al documento que liquida, con lo pagado.
+    """
+    if pagos_doctos is None or pagos_doctos.empty:
+        return []
+    return [
+        {"UUID": _uuid(uuid), "XML": xml, "UUIDRelacionado": _uuid(documento), "TipoRelacion": TIPO_PAGO,
+         "Monto": pagado, "Parcialidad": None if pd.isna(parcialidad) else int(parcialidad), "SaldoInsoluto": saldo}
+        for uuid, xml, documento, pagado, parcialidad, saldo in zip(
+            pagos_doctos["UUID"], pagos_doctos["XML"], pagos_doctos["IdDocumento"], pagos_doctos["ImpPagado"],
+            pagos_doctos["NumParcialidad"], pagos_doctos["ImpSaldoInsoluto"])
+        if _uuid(documento)
+    ]
+
+
+class GrafoRelaciones:
+    """
+    UUID -> aristas que salen de él (salientes) y que llegan a él (entrantes). Se
+    extiende con cada lote que se incorpora; como guarda UUIDs y no posiciones, sólo
+    hay que reconstruirlo si se eliminan CFDIs o se editan sus relaciones.
+    """
+    def __init__(self):
+        self.salientes = {}
+        self.entrantes = {}
+        self.n_aristas = 0
+
+    @classmethod
+    def desde_df(cls, df, pagos_doctos=None):
+        grafo = cls()
+        grafo.agregar(aristas_de_filas(df))
+        grafo.agregar(aristas_de_pagos(pagos_doctos))
+        return grafo
+
+    def __len__(self):
+        return self.n_aristas
+
+    def agregar(self, aristas):
+        for arista in aristas:
+            self.salientes.setdefault(arista["UUID"], []).append(arista)
+            self.entrantes.setdefault(arista["UUIDRelacionado"], []).append(arista)
+        self.n_aristas += len(aristas)
+
+    def aristas(self):
+        return pd.DataFrame([a for lista in self.salientes.values() for a in lista], columns=COLUMNAS_ARISTA)
+
+    def de(self, uuid):
+        """
+        Aristas de un CFDI: las que llegan (sus pagos, notas de crédito, sustitutos) y
+        las que salen (lo que él relaciona).
+        """
+        uuid = _uuid(uuid)
+        return self.entrantes.get(uuid, []), self.salientes.get(uuid, [])
+
+    def pagos_de(self, uuid):
+        return [a for a in self.entrantes.get(_uuid(uuid), []) if a["TipoRelacion"] == TIPO_PAGO]
+
+    def notas_de(self, uuid):
+        return [a for a in self.entrantes.get(_uuid(uuid), []) if a["TipoRelacion"] in TIPOS_DESCUENTO]
+
+    def cadena_sustitucion(self, uuid):
+        """
+        UUIDs de la cadena de sustituciones (relación 04) que pasa por uuid, del más
+        antiguo al vigente. Si un CFDI tiene varios sustitutos se sigue el primero.
+        """
+        uuid = _uuid(uuid)
+        vistos = {uuid}
+        anteriores = []
+        actual = uuid
+        while True:
+            previos = [a["UUIDRelacionado"] for a in self.salientes.get(actual, [])
+                       if a["TipoRelacion"] == TIPO_SUSTITUCION and a["UUIDRelacionado"] not in vistos]
+            if not previos:
+                break
+            actual = previos[0]
+            vistos.add(actual)
+            anteriores.append(actual)
+        cadena = anteriores[::-1] + [uuid]
+        actual = uuid
+        while True:
+            sustitutos = [a["UUID"] for a in self.entrantes.get(actual, [])
+                          if a["TipoRelacion"] == TIPO_SUSTITUCION and a["UUID"] not in vistos]
+            if not sustitutos:
+                break
+            actual = sustitutos[0]
+            vistos.add(actual)
+            cadena.append(actual)
+        return cadena
+
+    def saldos(self, df):
+        """
+        Saldo de cada CFDI de df: Total menos lo pagado (DoctoRelacionado) y menos las
+        notas de crédito y devoluciones que lo relacionan; "Sustituida por" indica que
+        otro CFDI lo reemplazó (su saldo ya no cuenta). Cuesta lo que mide df.
+        """
+        pagado, notas, pagos, saldo_insoluto, sustituta = [], [], [], [], []
+        for uuid in df["UUID"]:
+            entrantes = self.entrantes.get(_uuid(uuid), ())
+            sustituta.append(next((a["UUID"] for a in entrantes if a["TipoRelacion"] == TIPO_SUSTITUCION), ""))
+            de_pago = [a for a in entrantes if a["TipoRelacion"] == TIPO_PAGO]
+            pagado.append(sum(a["Monto"] for a in de_pago if pd.notna(a["Monto"])))
+            notas.append(sum(a["Monto"] for a in entrantes
+                             if a["TipoRelacion"] in TIPOS_DESCUENTO and pd.notna(a["Monto"])))
+            pagos.append(len(de_pago))
+            # El saldo que declara el último pago (mayor parcialidad)
+            ultimo = max(de_pago, key=lambda a: a["Parcialidad"] or 0, default=None)
+            saldo_insoluto.append(np.nan if ultimo is None else ultimo["SaldoInsoluto"])
+        resultado = pd.DataFrame({"Pagos": pagos, "Pagado": pagado, "Notas de crédito": notas,
+                                  "Saldo insoluto (último pago)": saldo_insoluto, "Sustituida por": sustituta},
+                                 index=df.index)
+        resultado.insert(3, "Saldo", df["Total"] - resultado["Pagado"] - resultado["Notas de crédito"])
+        return resultado
@@ -0,0 +1,39 @@
+import os
+import sys
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.join(RAIZ, "benchmarks"))
+
+from cache_cfdi import CacheCFDI  # noqa: E402
+from nucleo_cfdi import VERSION_EXTRACTOR, procesar_zip  # noqa: E402
+from generador_cfdi import generar_zip  # noqa: E402
+
+
+def test_guardar_y_obtener(tmp_path):
+    cache = CacheCFDI(str(tmp_path / "cfdi.sqlite3"), VERSION_EXTRACTOR)
+    cache.guardar([("a", {"Total": 1.0})])
+    assert cache.obtener(["a", "b"]) == {"a": {"Total": 1.0}}
+
+
+def test_archivo_borrado_con_la_app_corriendo(tmp_path):
+    ruta = str(tmp_path / "cfdi.sqlite3")
+    cache = CacheCFDI(ruta, VERSION_EXTRACTOR)
+    cache.guardar([("a", {"Total": 1.0})])
+    os.remove(ruta)
+    # connect crea un archivo vacío: el esquema se vuelve a crear y es un fallo
+    assert cache.obtener(["a"]) == {}
+    cache.guardar([("a", {"Total": 2.0})])
+    assert cache.obtener(["a"]) == {"a": {"Total": 2.0}}
+
+
+def test_directorio_borrado_no_detiene_la_extraccion(tmp_path):
+    directorio = tmp_path / "cache"
+    cache = CacheCFDI(str(directorio / "cfdi.sqlite3"), VERSION_EXTRACTOR)
+    os.remove(directorio / "cfdi.sqlite3")
+    os.rmdir(directorio)
+    destino = tmp_path / "cfdis.zip"
+    generar_zip(str(destino), 20, semilla=1)
+    resultado = procesar_zip(str(destino), cache=cache)
+    assert len(resultado["filas"]) == 20 and not resultado["errores"]
+    assert resultado["fallos_cache"] == 20
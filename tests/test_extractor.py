@@ -0,0 +1,262 @@
+import io
+import os
+import sys
+import xml.etree.ElementTree as ET
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.join(RAIZ, "benchmarks"))
+
+import nucleo_cfdi  # noqa: E402
+from nucleo_cfdi import _extraer_fila, codigo_map_forma_pago, codigo_map_uso_cfdi, procesar_zip  # noqa: E402
+from generador_cfdi import generar_cfdi, generar_zip  # noqa: E402
+
+# Equivalencia del lector por eventos (_LectorCFDI) con la extracción anterior sobre
+# ElementTree, campo por campo. La única diferencia buscada: "Traslado IVA 0.160000 %"
+# ahora es la suma (float) de los traslados del comprobante y antes era el texto del
+# Importe del último traslado de IVA al 16 % del documento (un Importe que no es número
+# ya no se copia tal cual: la columna queda vacía).
+
+NS_4 = "http://www.sat.gob.mx/cfd/4"
+NS_3 = "http://www.sat.gob.mx/cfd/3"
+NS_TFD = "http://www.sat.gob.mx/TimbreFiscalDigital"
+
+
+def _extraer_fila_base(filename, contenido, ns_cfdi=NS_4):
+    # Extractor de la línea base (ElementTree), con el namespace como parámetro para 3.3
+    ns = {"cfdi": ns_cfdi, "tfd": NS_TFD}
+    try:
+        comp = ET.parse(io.BytesIO(contenido)).getroot()
+    except ET.ParseError:
+        return None
+    row = {
+        "XML": filename, "Rfc Emisor": "", "Nombre Emisor": "", "Régimen Fiscal Emisor": "",
+        "Rfc Receptor": "", "Nombre Receptor": "", "CP Receptor": "", "Régimen Receptor": "",
+        "Uso Cfdi Receptor": "", "Tipo": "", "Serie": "", "Folio": "", "Fecha": "",
+        "Sub Total": "", "Descuento": "", "Total impuesto Trasladado": "", "Nombre Impuesto": "",
+        "Total impuesto Retenido": "", "Total": "", "UUID": "", "Método de Pago": "",
+        "Forma de Pago": "", "Moneda": "", "Tipo de Cambio": "", "Versión": "", "Estado": "",
+        "Estatus": "", "Validación EFOS": "", "Fecha Consulta": "", "Conceptos": "",
+        "Relacionados": "", "Tipo Relación": "", "Traslado IVA 0.160000 %": ""
+    }
+    row["Fecha"] = comp.attrib.get("Fecha", "")
+    row["Sub Total"] = comp.attrib.get("SubTotal", "")
+    row["Descuento"] = comp.attrib.get("Descuento", "")
+    row["Total"] = comp.attrib.get("Total", "")
+    row["Método de Pago"] = comp.attrib.get("MetodoPago", "")
+    forma_pago_codigo = comp.attrib.get("FormaPago", "")
+    forma_pago_desc = codigo_map_forma_pago.get(forma_pago_codigo, "")
+    row["Forma de Pago"] = f"{forma_pago_codigo}-{forma_pago_desc}" if forma_pago_desc else forma_pago_codigo
+    row["Moneda"] = comp.attrib.get("Moneda", "")
+    row["Tipo de Cambio"] = comp.attrib.get("TipoCambio", "")
+    row["Versión"] = comp.attrib.get("Version", "")
+    row["Serie"] = comp.attrib.get("Serie", "")
+    row["Folio"] = comp.attrib.get("Folio", "")
+    row["Tipo"] = comp.attrib.get("TipoDeComprobante", "")
+
+    emisor = comp.find("cfdi:Emisor", namespaces=ns)
+    if emisor is not None:
+        row["Rfc Emisor"] = emisor.attrib.get("Rfc", "")
+        row["Nombre Emisor"] = emisor.attrib.get("Nombre", "")
+        row["Régimen Fiscal Emisor"] = emisor.attrib.get("RegimenFiscal", "")
+    receptor = comp.find("cfdi:Receptor", namespaces=ns)
+    if receptor is not None:
+        row["Rfc Receptor"] = receptor.attrib.get("Rfc", "")
+        row["Nombre Receptor"] = receptor.attrib.get("Nombre", "")
+        row["CP Receptor"] = receptor.attrib.get("DomicilioFiscalReceptor", "")
+        row["Régimen Receptor"] = receptor.attrib.get("RegimenFiscalReceptor", "")
+        uso_cfdi_codigo = receptor.attrib.get("UsoCFDI", "")
+        uso_cfdi_desc = codigo_map_uso_cfdi.get(uso_cfdi_codigo, "")
+        row["Uso Cfdi Receptor"] = f"{uso_cfdi_codigo}-{uso_cfdi_desc}" if uso_cfdi_desc else uso_cfdi_codigo
+    timbre = comp.find(".//tfd:TimbreFiscalDigital", namespaces=ns)
+    if timbre is not None:
+        row["UUID"] = timbre.attrib.get("UUID", "")
+
+    impuestos_elem = comp.find("cfdi:Impuestos", namespaces=ns)
+    total_trasladado = (impuestos_elem.attrib.get("TotalImpuestosTrasladados")
+                        if impuestos_elem is not None else None)
+    # La base usaba un set (orden según la semilla de hash); aquí, orden de aparición
+    impuestos_nombres = {}
+    traslado_iva_016 = ""
+    suma = 0.0
+    for traslado in comp.findall(".//cfdi:Traslado", namespaces=ns):
+        try:
+            suma += float(traslado.attrib.get("Importe", "0"))
+        except ValueError:
+            pass
+        imp = traslado.attrib.get("Impuesto", "")
+        if imp:
+            impuestos_nombres[imp] = None
+        if traslado.attrib.get("TasaOCuota") == "0.160000" and traslado.attrib.get("Impuesto") == "002":
+            traslado_iva_016 = traslado.attrib.get("Importe", "")
+    total_retenido = 0.0
+    for retencion in comp.findall(".//cfdi:Retencion", namespaces=ns):
+        try:
+            total_retenido += float(retencion.attrib.get("Importe", "0"))
+        except ValueError:
+            pass
+    row["Total impuesto Trasladado"] = suma if total_trasladado is None else total_trasladado
+    row["Nombre Impuesto"] = ", ".join(impuestos_nombres)
+    row["Total impuesto Retenido"] = total_retenido
+    row["Traslado IVA 0.160000 %"] = traslado_iva_016
+    conceptos = comp.findall("cfdi:Conceptos/cfdi:Concepto", namespaces=ns)
+    row["Conceptos"] = "; ".join(f"{c.attrib.get('Descripcion','')}: {c.attrib.get('Importe','')}" for c in conceptos)
+    return row
+
+
+def _comparar(actual, base):
+    for campo, esperado in base.items():
+        valor = actual[campo]
+        if campo == "Traslado IVA 0.160000 %":
+            # Diferencia buscada: ahora es float
+            try:
+                esperado = pytest.approx(float(esperado))
+            except ValueError:
+                esperado = ""
+            assert valor == esperado, campo
+        else:
+            assert valor == esperado, campo
+
+
+def _extraer(nombre, contenido):
+    return _extraer_fila(nombre, io.BytesIO(contenido))
+
+
+@pytest.mark.parametrize("razon_33, ns", [(0.0, NS_4), (1.0, NS_3)])
+def test_generados_iguales_a_la_base(razon_33, ns):
+    for numero in range(300):
+        contenido = generar_cfdi(numero, semilla=7, razon_33=razon_33)
+        fila, error = _extraer(f"{numero}.xml", contenido)
+        assert error is None
+        _comparar(fila, _extraer_fila_base(f"{numero}.xml", contenido, ns))
+
+
+def test_procesar_zip_igual_a_la_base(tmp_path):
+    import zipfile
+    destino = tmp_path / "cfdis.zip"
+    generar_zip(str(destino), 200, semilla=3, razon_33=0.5)
+    filas = procesar_zip(str(destino))["filas"]
+    with zipfile.ZipFile(destino) as z:
+        nombres = [n for n in z.namelist() if n.lower().endswith(".xml")]
+        assert [f["XML"] for f in filas] == nombres
+        for fila in filas:
+            contenido = z.read(fila["XML"])
+            ns = NS_3 if b'Version="3.3"' in contenido else NS_4
+            _comparar(fila, _extraer_fila_base(fila["XML"], contenido, ns))
+
+
+@pytest.fixture(scope="module")
+def zip_mixto(tmp_path_factory):
+    destino = tmp_path_factory.mktemp("zips") / "mixto.zip"
+    generar_zip(str(destino), 120, semilla=5, mezcla="mixta", razon_33=0.3)
+    return str(destino)
+
+
+def test_pool_igual_a_la_ruta_serial(zip_mixto):
+    # Con forkserver/spawn cada proceso tiene otra semilla de hash: nada puede depender
+    # del orden de un set
+    serial = procesar_zip(zip_mixto, 1, tam_lote=10)
+    pool = procesar_zip(zip_mixto, 3, tam_lote=10)
+    assert pool["filas"] == serial["filas"]
+    assert pool["conceptos"] == serial["conceptos"]
+    assert pool["errores"] == serial["errores"]
+
+
+class _PoolRoto:
+    # El primer lote "muere" en el proceso; después el pool ya no acepta lotes
+    def __init__(self, *args, **kwargs):
+        self.enviados = 0
+
+    def submit(self, funcion, *args):
+        self.enviados += 1
+        if self.enviados > 1:
+            raise BrokenProcessPool("un proceso del pool terminó de forma abrupta")
+        futuro = Future()
+        futuro.set_exception(BrokenProcessPool("un proceso del pool terminó de forma abrupta"))
+        return futuro
+
+    def shutdown(self, wait=True):
+        pass
+
+
+def test_pool_roto_sigue_en_serie(zip_mixto, monkeypatch):
+    serial = procesar_zip(zip_mixto, 1, tam_lote=10)
+    monkeypatch.setattr(nucleo_cfdi, "ProcessPoolExecutor", _PoolRoto)
+    assert procesar_zip(zip_mixto, 3, tam_lote=10)["filas"] == serial["filas"]
+
+
+def _documento(cuerpo, impuestos_attr=' TotalImpuestosTrasladados="16.00"', complemento=True):
+    timbre = (f'<cfdi:Complemento><tfd:TimbreFiscalDigital xmlns:tfd="{NS_TFD}" UUID="ABC"/></cfdi:Complemento>'
+              if complemento else "")
+    return (
+        f'<cfdi:Comprobante xmlns:cfdi="{NS_4}" Version="4.0" Fecha="2024-01-01T00:00:00" SubTotal="100" '
+        f'Total="116" TipoDeComprobante="I" FormaPago="03" MetodoPago="PUE">'
+        f'<cfdi:Emisor Rfc="AAA010101AAA" Nombre="E" RegimenFiscal="601"/>'
+        f'<cfdi:Receptor Rfc="BBB010101BBB" Nombre="R" UsoCFDI="G03"/>{cuerpo}'
+        f'{timbre}</cfdi:Comprobante>'
+    ).encode("utf-8")
+
+
+CONCEPTO = (
+    '<cfdi:Conceptos><cfdi:Concepto Descripcion="a" Importe="100"><cfdi:Impuestos><cfdi:Traslados>'
+    '<cfdi:Traslado Base="100" Impuesto="002" TipoFactor="Tasa" TasaOCuota="0.160000" Importe="16.00"/>'
+    '<cfdi:Traslado Base="100" Impuesto="003" TipoFactor="Tasa" TasaOCuota="0.080000" Importe="8.00"/>'
+    '</cfdi:Traslados><cfdi:Retenciones><cfdi:Retencion Base="100" Impuesto="001" Importe="10.00"/>'
+    '<cfdi:Retencion Base="100" Impuesto="002" Importe="10.67"/></cfdi:Retenciones></cfdi:Impuestos>'
+    '</cfdi:Concepto></cfdi:Conceptos>'
+)
+IMPUESTOS = (
+    '<cfdi:Retenciones><cfdi:Retencion Impuesto="001" Importe="10.00"/>'
+    '<cfdi:Retencion Impuesto="002" Importe="10.67"/></cfdi:Retenciones><cfdi:Traslados>'
+    '<cfdi:Traslado Base="100" Impuesto="002" TipoFactor="Tasa" TasaOCuota="0.160000" Importe="16.00"/>'
+    '<cfdi:Traslado Base="100" Impuesto="003" TipoFactor="Tasa" TasaOCuota="0.080000" Importe="8.00"/>'
+    '</cfdi:Traslados>'
+)
+
+CASOS = {
+    "sin_complemento": _documento(CONCEPTO + f"<cfdi:Impuestos>{IMPUESTOS}</cfdi:Impuestos>", complemento=False),
+    "varios_traslados_y_retenciones": _documento(
+        CONCEPTO + f'<cfdi:Impuestos TotalImpuestosTrasladados="24.00">{IMPUESTOS}</cfdi:Impuestos>'),
+    "sin_total_trasladado": _documento(CONCEPTO + f"<cfdi:Impuestos>{IMPUESTOS}</cfdi:Impuestos>"),
+    "sin_tasa_o_cuota": _documento(
+        '<cfdi:Impuestos><cfdi:Traslados><cfdi:Traslado Base="100" Impuesto="002" TipoFactor="Tasa" Importe="16"/>'
+        '<cfdi:Traslado Base="100" Impuesto="002" TipoFactor="Exento"/></cfdi:Traslados></cfdi:Impuestos>'),
+    "importe_no_numerico": _documento(
+        '<cfdi:Impuestos><cfdi:Traslados><cfdi:Traslado Impuesto="002" TipoFactor="Tasa" TasaOCuota="0.160000" '
+        'Importe="x"/></cfdi:Traslados><cfdi:Retenciones><cfdi:Retencion Impuesto="001" Importe="y"/>'
+        '</cfdi:Retenciones></cfdi:Impuestos>'),
+    "sin_impuestos": _documento(""),
+}
+
+
+@pytest.mark.parametrize("caso", sorted(CASOS))
+def test_casos_limite_iguales_a_la_base(caso):
+    fila, error = _extraer(f"{caso}.xml", CASOS[caso])
+    assert error is None
+    _comparar(fila, _extraer_fila_base(f"{caso}.xml", CASOS[caso]))
+
+
+def test_sin_complemento_no_tiene_uuid():
+    fila, _ = _extraer("x.xml", CASOS["sin_complemento"])
+    assert fila["UUID"] == ""
+
+
+def test_traslado_iva_16_es_float():
+    fila, _ = _extraer("x.xml", CASOS["varios_traslados_y_retenciones"])
+    assert fila["Traslado IVA 0.160000 %"] == 16.0
+    assert _extraer_fila_base("x.xml", CASOS["varios_traslados_y_retenciones"])["Traslado IVA 0.160000 %"] == "16.00"
+
+
+@pytest.mark.parametrize("contenido", [
+    b'<cfdi:Comprobante xmlns:cfdi="http://www.sat.gob.mx/cfd/4" Version="4.0"><cfdi:Emisor',
+    b"no es xml",
+    b"",
+])
+def test_xml_mal_formado(contenido):
+    fila, error = _extraer("roto.xml", contenido)
+    assert fila is None and _extraer_fila_base("roto.xml", contenido) is None
+    assert error["archivo"] == "roto.xml" and error["motivo"].startswith("XML mal formado")